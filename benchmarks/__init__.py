@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for django-unload.
+
+Run a benchmark from the root of the repository, e.g.:
+
+    $ python -m benchmarks.bench_template
+"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import timeit
+
+SYNTHETIC_BLOCK = '''{% load app_tags %}
+{% load example_simple_tag plus from app_tags %}
+<div class="item">
+    {% if items %}
+        {% for item in items %}
+            <p>{{ item.title|default:"-"|plus:1 }}</p>
+            <p>{% example_simple_tag item 2|plus:5 %}</p>
+        {% endfor %}
+    {% endif %}
+    {% example_inclusion_tag %}
+    {{ value|lower|truncatechars:10 }}
+</div>
+'''
+
+
+def setup_django():
+    """
+    Configure Django using the demo project's settings.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'demo.demo.settings')
+    import django
+    django.setup()
+
+
+def get_synthetic_template(blocks):
+    """
+    Build a template by repeating a block that contains loads, tags, filters
+    and variables.
+
+    :blocks: Integer; the number of repetitions
+    :returns: String
+    """
+    return '{% extends "master.html" %}\n' + SYNTHETIC_BLOCK * blocks
+
+
+def measure(func, number, repeat=5):
+    """
+    Measure the execution time of the callable.
+
+    :func: a callable without arguments
+    :number: Integer; the number of calls in a single measurement
+    :repeat: Integer; the number of measurements
+    :returns: Float; the best time per call (in milliseconds)
+    """
+    timings = timeit.repeat(func, number=number, repeat=repeat)
+    return min(timings) / number * 1000
+
+
+def output_comparison(title, baseline, candidate):
+    """
+    Output the timings of both implementations and the speedup.
+
+    :title: String
+    :baseline: Float; the baseline time per call (in milliseconds)
+    :candidate: Float; the candidate time per call (in milliseconds)
+    """
+    print('{}: {:.3f} ms -> {:.3f} ms ({:.2f}x)'.format(
+        title, baseline, candidate, baseline / candidate))
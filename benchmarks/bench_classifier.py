@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the single-pass token classifier with the previous implementation,
+which walked the tokens three times and split each token three times.
+
+    $ python -m benchmarks.bench_classifier
+"""
+
+from __future__ import print_function, unicode_literals
+
+from . import get_synthetic_template, measure, output_comparison, setup_django
+
+
+def parse_load_block(tokens):
+    """
+    The previous implementation of the load block parser.
+    """
+    from unload.utils import update_dictionary
+
+    modules = {}
+    members = {}
+    for token in tokens:
+        token_content = token.split_contents()
+        if token.token_type == 2 and token_content[0] == 'load':
+            if len(token_content) >= 4 and token_content[-2] == 'from':
+                update_dictionary(modules, token_content[-1], token.lineno)
+                for member in token_content[1:-2]:
+                    update_dictionary(members, member, token.lineno)
+            else:
+                for module in token_content[1:]:
+                    update_dictionary(modules, module, token.lineno)
+
+    return modules, members
+
+
+def get_used_tags(tokens):
+    """
+    The previous implementation of the custom tag search.
+    """
+    from unload.settings import BUILT_IN_TAG_VALUES, BUILT_IN_TAGS
+
+    used_tags = []
+    for token in tokens:
+        token_content = token.split_contents()
+        if (token.token_type == 2 and
+                token_content[0] not in BUILT_IN_TAGS.keys() and
+                token_content[0] not in BUILT_IN_TAG_VALUES):
+            used_tags.append(token_content[0])
+
+    return used_tags
+
+
+def get_used_filters(tokens):
+    """
+    The previous implementation of the custom filter search.
+    """
+    from unload.settings import BUILT_IN_FILTERS
+    from unload.utils import get_filters
+
+    used_filters = []
+    for token in tokens:
+        filters = []
+        token_content = token.split_contents()
+        if token.token_type == 1 and '|' in token_content[0]:
+            filters += get_filters(token_content[0])
+        elif token.token_type == 2:
+            if '|' in ' '.join(token_content):
+                for item in token_content:
+                    if '|' in item:
+                        filters += get_filters(item)
+        for filter_name in filters:
+            if (filter_name not in BUILT_IN_FILTERS and
+                    filter_name not in used_filters):
+                used_filters.append(filter_name)
+
+    return used_filters
+
+
+def classify_in_three_walks(tokens):
+    """
+    Walk the tokens three times, as the previous implementation did.
+    """
+    modules, members = parse_load_block(tokens)
+    return modules, members, get_used_tags(tokens), get_used_filters(tokens)
+
+
+def main():
+    setup_django()
+
+    from unload.base import LexedTemplate
+
+    for blocks in (10, 100, 1000):
+        template = LexedTemplate(get_synthetic_template(blocks))
+        # _classify_tokens populates the template's attributes
+        assert classify_in_three_walks(template.tokens) == (
+            template.loaded_modules, template.loaded_members,
+            template.used_tags, template.used_filters)
+        number = max(1, 1000 // blocks)
+        three_walks = measure(
+            lambda: classify_in_three_walks(template.tokens), number)
+        single_pass = measure(template._classify_tokens, number)
+        output_comparison('{} tokens'.format(len(template.tokens)),
+                          three_walks, single_pass)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Check that the overhead of the runtime profiler's template loader compared
+with Django's cached loader stays below 1% at the default sample rate.
+
+Comparing the render times of whole pages cannot show this: on a shared
+machine, two identical cached engines already differ by a few percent. The
+work the profiler adds to a page render is therefore measured directly:
+
+- the cost of counting a render (the wrapper of the template's _render
+  method around a template that renders nothing), multiplied by the number
+  of templates rendered per page (the page, includes and inclusion tags);
+- the additional cost of the loader's template lookups, multiplied by the
+  number of lookups per page;
+- the additional cost of a sampled render of the page, multiplied by the
+  sample rate.
+
+The costs and the page's render time with the cached loader are measured
+back to back in many short rounds (in a rotating order) and the overhead is
+computed per round, so changes of the machine's speed affect both sides of
+the ratio alike. The benchmark passes if the upper bound of the 95%
+confidence interval of the mean overhead is below 1%.
+
+    $ python -m benchmarks.bench_runtime
+
+The exit status is 1 if the overhead cannot be shown to stay below 1%.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import math
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from . import SYNTHETIC_BLOCK, setup_django
+
+# The maximum overhead at the default sample rate
+OVERHEAD_BUDGET = 0.01
+# The number of rounds
+ROUNDS = 300
+# The number of calls per measurement of a page render and of the
+# profiler's fixed costs
+PAGE_NUMBER = 5
+CALL_NUMBER = 2000
+# The two-sided 95% quantile of the normal distribution (the number of
+# rounds is large enough for the normal approximation)
+Z_95 = 1.96
+
+
+class EmptyTemplate(object):
+    """
+    A template that renders nothing, so only the profiler's wrapper of its
+    _render method is measured.
+    """
+    name = 'empty.html'
+    origin = None
+
+    def _render(self, context):
+        return ''
+
+
+def get_engine(loader, templates):
+    """
+    Create an engine loading the templates from memory.
+
+    :loader: String; the path of the caching loader
+    :templates: {name: source}
+    :returns: Engine object
+    """
+    from django.template import engines
+    from django.template.engine import Engine
+
+    options = {}
+    # The installed libraries (Django 1.9+)
+    default_engine = engines.all()[0].engine
+    if hasattr(default_engine, 'libraries'):
+        options['libraries'] = default_engine.libraries
+
+    return Engine(loaders=[
+        (loader, [('django.template.loaders.locmem.Loader', templates)])],
+        **options)
+
+
+def get_profiled_engine(templates, path, sample_rate):
+    """
+    Create an engine whose loader instruments the templates with a new
+    runtime profiler.
+
+    :templates: {name: source}
+    :path: String; the path of the profile file
+    :sample_rate: Float
+    :returns: Engine object
+    """
+    from unload import runtime
+
+    runtime._runtime_profiler = runtime.RuntimeProfiler(
+        path=path, sample_rate=sample_rate)
+
+    return get_engine('unload.runtime.Loader', templates)
+
+
+def count_page_work(engine, context):
+    """
+    Count the templates rendered and looked up by a render of the page.
+
+    :engine: Engine object (using the runtime profiler's loader)
+    :context: Context object
+    :returns: a tuple (renders, lookups)
+    """
+    from unload import runtime
+
+    template = engine.get_template('page.html')
+    lookups = []
+    find_template = engine.find_template
+
+    def counted_find_template(*args, **kwargs):
+        lookups.append(args)
+        return find_template(*args, **kwargs)
+
+    engine.find_template = counted_find_template
+    try:
+        renders = runtime._runtime_profiler.get_profile()['renders']
+        before = sum(renders.values())
+        template.render(context)
+        renders = runtime._runtime_profiler.get_profile()['renders']
+    finally:
+        del engine.find_template
+
+    return sum(renders.values()) - before, len(lookups)
+
+
+def measure_rounds(funcs, rounds=ROUNDS):
+    """
+    Measure the callables in rounds. The order of the callables rotates
+    every round, so none of them is favoured by its position.
+
+    :funcs: a list of tuples (callable without arguments, the number of
+        calls per measurement)
+    :rounds: Integer; the number of rounds
+    :returns: a list of rounds, i.e. lists of the times per call (in
+        microseconds) in the order of the callables
+    """
+    timings = []
+    for index in range(rounds):
+        times = [None] * len(funcs)
+        for offset in range(len(funcs)):
+            position = (index + offset) % len(funcs)
+            func, number = funcs[position]
+            times[position] = timeit.timeit(func, number=number) / number
+        timings.append([time * 1e6 for time in times])
+
+    return timings
+
+
+def get_interval(values, z=Z_95):
+    """
+    Get the mean of the values and its confidence interval.
+
+    :values: a list of floats (at least two)
+    :z: Float; the quantile of the normal distribution
+    :returns: a tuple (mean, lower bound, upper bound)
+    """
+    mean = sum(values) / len(values)
+    variance = sum((value - mean) ** 2 for value in values) / (
+        len(values) - 1)
+    margin = z * math.sqrt(variance / len(values))
+
+    return mean, mean - margin, mean + margin
+
+
+def format_interval(interval, scale=1, unit=''):
+    """
+    :interval: a tuple (mean, lower bound, upper bound)
+    :scale: Float; the factor the values are multiplied by
+    :unit: String
+    :returns: String
+    """
+    mean, lower, upper = (value * scale for value in interval)
+
+    return '{:+.3f}{unit} (95% CI {:+.3f}{unit} .. {:+.3f}{unit})'.format(
+        mean, lower, upper, unit=unit)
+
+
+def check_page(blocks, path, sample_rate):
+    """
+    Measure the overhead of the profiler on a page.
+
+    :blocks: Integer; the number of synthetic blocks of the page
+    :path: String; the path of the profile file
+    :sample_rate: Float
+    :returns: Float; the upper bound of the overhead's interval
+    """
+    from django.template import Context
+    from unload import runtime
+
+    templates = {
+        'app/tags/tag_template.html': '{{ tag_name }}',
+        'include.html': '{{ value|lower }}',
+        'page.html': '{% include "include.html" %}' + SYNTHETIC_BLOCK * blocks
+    }
+    context = Context({'items': [{'title': 1}] * 10, 'value': 'Value'})
+    cached_engine = get_engine('django.template.loaders.cached.Loader',
+                               templates)
+    cached = cached_engine.get_template('page.html')
+    unsampled = get_profiled_engine(templates, path, 0).get_template(
+        'page.html')
+    sampled = get_profiled_engine(templates, path, 1).get_template(
+        'page.html')
+    profiled_engine = get_profiled_engine(templates, path, sample_rate)
+    renders, lookups = count_page_work(profiled_engine, context)
+    # The wrapper takes the same path as an unsampled render
+    empty = EmptyTemplate()
+    counted = EmptyTemplate()
+    runtime._runtime_profiler.instrument(counted)
+
+    timings = measure_rounds([
+        (lambda: cached.render(context), PAGE_NUMBER),
+        (lambda: unsampled.render(context), PAGE_NUMBER),
+        (lambda: sampled.render(context), PAGE_NUMBER),
+        (lambda: empty._render(context), CALL_NUMBER),
+        (lambda: counted._render(context), CALL_NUMBER),
+        (lambda: cached_engine.get_template('page.html'), CALL_NUMBER),
+        (lambda: profiled_engine.get_template('page.html'), CALL_NUMBER)
+    ])
+    overheads = []
+    render_costs = []
+    lookup_costs = []
+    for (page, page_unsampled, page_sampled, render, counted_render, lookup,
+         profiled_lookup) in timings:
+        render_costs.append(counted_render - render)
+        lookup_costs.append(profiled_lookup - lookup)
+        overheads.append((renders * render_costs[-1] +
+                          lookups * lookup_costs[-1] +
+                          sample_rate * (page_sampled - page_unsampled)) /
+                         page)
+    interval = get_interval(overheads)
+    page_time = sorted(times[0] for times in timings)[len(timings) // 2]
+
+    print('{} blocks: {:.3f} ms per render (median), {} templates rendered '
+          'and {} looked up'.format(blocks, page_time / 1000, renders,
+                                    lookups))
+    print('  counting a render: {}'.format(
+        format_interval(get_interval(render_costs), unit=' us')))
+    print('  looking up a template: {}'.format(
+        format_interval(get_interval(lookup_costs), unit=' us')))
+    print('  overhead at the sample rate {}: {}; {}'.format(
+        sample_rate, format_interval(interval, scale=100, unit='%'),
+        get_verdict(interval[2])))
+
+    return interval[2]
+
+
+def get_verdict(upper_bound, budget=OVERHEAD_BUDGET):
+    """
+    :upper_bound: Float; the upper bound of the overhead's interval
+    :budget: Float; the maximum overhead
+    :returns: String ('PASS' or 'FAIL')
+    """
+    return 'PASS' if upper_bound < budget else 'FAIL'
+
+
+def main():
+    setup_django()
+
+    from unload.runtime import SAMPLE_RATE
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'profile.json')
+    try:
+        upper_bound = max(check_page(blocks, path, SAMPLE_RATE)
+                          for blocks in (1, 10))
+    finally:
+        shutil.rmtree(directory)
+
+    verdict = get_verdict(upper_bound)
+    print('{}: the overhead is {} {:.0%} at the sample rate {}'.format(
+        verdict, 'below' if verdict == 'PASS' else 'not shown to be below',
+        OVERHEAD_BUDGET, SAMPLE_RATE))
+
+    return 0 if verdict == 'PASS' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
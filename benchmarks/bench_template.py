@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the Template class (full compilation) with the lexing-only
+LexedTemplate class.
+
+    $ python -m benchmarks.bench_template
+"""
+
+from __future__ import print_function, unicode_literals
+
+from . import get_synthetic_template, measure, output_comparison, setup_django
+
+
+def main():
+    setup_django()
+
+    from unload.base import LexedTemplate, Template
+
+    for blocks in (10, 100, 1000):
+        source = get_synthetic_template(blocks)
+        number = max(1, 1000 // blocks)
+        compiled = measure(lambda: Template(source), number)
+        lexed = measure(lambda: LexedTemplate(source), number)
+        output_comparison('{} blocks'.format(blocks), compiled, lexed)
+
+
+if __name__ == '__main__':
+    main()
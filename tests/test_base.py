@@ -3,13 +3,14 @@
 from __future__ import unicode_literals
 
 import os
+import pickle
 
 from django.apps import apps
 from django.conf import settings
 from django.test import TestCase
 from django.test.utils import override_settings
 
-from unload.base import Template
+from unload.base import LexedTemplate, Template, TemplateResult
 from unload.utils import get_contents
 
 
@@ -624,3 +625,140 @@ class TestBase(TestCase):
             name=self.only_filter)
         self.assertEqual(only_filter.list_unutilized_items(),
                          ([], ['Unutilized module', 'Unutilized tag/filter']))
+
+    def test_lexed_template(self):
+        """
+        The lexing-only analysis must match the results of the Template class.
+        """
+        templates = [self.master_template, self.tag_template,
+                     self.double_loads, self.with_tags, self.without_tags,
+                     self.from_syntax_with_tags, self.from_syntax_without_tags,
+                     self.double_member_load, self.only_filter]
+        attributes = ['loaded_modules', 'loaded_members', 'used_tags',
+                      'used_filters', 'utilized_modules', 'utilized_members']
+        for template_path in templates:
+            source = get_contents(template_path)
+            template = Template(template_string=source, name=template_path)
+            lexed = LexedTemplate(template_string=source, name=template_path)
+            self.assertFalse(hasattr(lexed, 'nodelist'))
+            for attribute in attributes:
+                self.assertEqual(getattr(template, attribute),
+                                 getattr(lexed, attribute))
+            self.assertEqual(template.list_duplicates(),
+                             lexed.list_duplicates())
+            self.assertEqual(template.list_unutilized_items(),
+                             lexed.list_unutilized_items())
+
+    def test_classify_tokens(self):
+        source = ('{% load app_tags %}\n'
+                  '{% load plus from app_tags %}\n'
+                  '{{ value|lower|plus:1 }}{{ value }}{# comment|plus #}\n'
+                  '{% example_simple_tag value|plus:2 %}\n'
+                  '{% if value|plus %}{% endif %}{% %}')
+        template = LexedTemplate(template_string=source, name='inline.html')
+        self.assertEqual(template.loaded_modules, {'app_tags': [1, 2]})
+        self.assertEqual(template.loaded_members, {'plus': [2]})
+        self.assertEqual(template.load_blocks,
+                         [(1, ['app_tags'], []), (2, ['app_tags'], ['plus'])])
+        self.assertEqual(template.used_tags, ['example_simple_tag'])
+        self.assertEqual(template.used_filters, ['plus'])
+        self.assertEqual(template.usage_lines,
+                         {'example_simple_tag': [4], 'plus': [3, 4, 5]})
+
+    def test_classify_tokens_comment(self):
+        """
+        The tags and filters within comment blocks are never rendered.
+        """
+        source = ('{% comment "note" %}\n'
+                  '{% load app_tags %}{% example_simple_tag %}\n'
+                  '{{ value|plus:1 }}{% trans "Text" %}\n'
+                  '{% endcomment %}\n'
+                  '{{ value|lower }}')
+        template = LexedTemplate(template_string=source, name='inline.html')
+        self.assertEqual(template.load_blocks, [])
+        self.assertEqual(template.used_tags, [])
+        self.assertEqual(template.used_filters, [])
+        self.assertEqual(template.missing_loads, {})
+        self.assertFalse(template.has_issues)
+
+    def test_list_missing_loads(self):
+        with_tags = Template(
+            template_string=get_contents(self.with_tags),
+            name=self.with_tags)
+        self.assertEqual(with_tags.missing_loads, {})
+        self.assertEqual(with_tags.list_missing_loads(),
+                         ([], ['Unloaded tag/filter', 'Provided by',
+                               'Line number']))
+
+        source = ('{% load example_simple_tag from app_tags %}\n'
+                  '{% example_simple_tag %}\n'
+                  '{% example_inclusion_tag %}{{ 2|plus:5 }}\n'
+                  '{% trans "Text" %}{% endcustom %}\n'
+                  '{{ 2|plus:1 }}')
+        template = LexedTemplate(template_string=source, name='inline.html')
+        self.assertEqual(template.missing_loads,
+                         {'example_inclusion_tag': frozenset(['app_tags']),
+                          'plus': frozenset(['app_tags']),
+                          'trans': frozenset(['i18n'])})
+        table, headers = template.list_missing_loads()
+        self.assertEqual(table, [['example_inclusion_tag', 'app_tags', '3'],
+                                 ['plus', 'app_tags', '3, 5'],
+                                 ['trans', 'i18n', '4']])
+
+    def test_template_result(self):
+        for template_path in [self.with_tags, self.double_member_load]:
+            template = Template(template_string=get_contents(template_path),
+                                name=template_path)
+            result = pickle.loads(
+                pickle.dumps(TemplateResult.from_template(template)))
+            self.assertEqual(template_path, result.name)
+            self.assertEqual(template.has_issues, result.has_issues)
+            self.assertEqual(template.list_duplicates(),
+                             result.list_duplicates())
+            self.assertEqual(template.list_unutilized_items(),
+                             result.list_unutilized_items())
+            self.assertEqual(template.list_missing_loads(),
+                             result.list_missing_loads())
+
+    def test_list_duplicates_partial_module_lines(self):
+        """
+        A member can be loaded twice from a module that is loaded more often.
+        """
+        source = ('{% load plus from app_tags %}\n'
+                  '{% load plus from app_tags %}\n'
+                  '{% load app_tags %}')
+        template = LexedTemplate(template_string=source, name='inline.html')
+        table, headers = template.list_duplicates()
+        self.assertEqual(table, [['app_tags', None, '1, 2, 3'],
+                                 [None, 'plus', '1, 2']])
+
+    def test_get_report(self):
+        source = ('{% load app_tags %}\n{% load i18n %}\n{% load app_tags %}\n'
+                  '{% load plus example_simple_tag from app_tags %}\n'
+                  '{% load plus from app_tags %}\n'
+                  '{{ 2|plus:1 }}{% cache 5 a %}{% endcache %}\n')
+        template = LexedTemplate(template_string=source, name='inline.html')
+        report = template.get_report()
+        self.assertEqual(list(report.keys()),
+                         ['template', 'has_issues', 'messages',
+                          'compile_error', 'duplicate_modules',
+                          'duplicate_members', 'unutilized_modules',
+                          'unutilized_members', 'missing_loads'])
+        self.assertEqual(report['template'], 'inline.html')
+        self.assertTrue(report['has_issues'])
+        self.assertEqual(report['messages'], [])
+        self.assertIsNone(report['compile_error'])
+        self.assertEqual(report['duplicate_modules'],
+                         [{'module': 'app_tags', 'lines': [1, 3, 4, 5]}])
+        self.assertEqual(report['duplicate_members'],
+                         [{'member': 'plus', 'lines': [4, 5]}])
+        self.assertEqual(report['unutilized_modules'],
+                         [{'module': 'i18n', 'lines': [2]}])
+        self.assertEqual(report['unutilized_members'],
+                         [{'member': 'example_simple_tag', 'lines': [4]}])
+        self.assertEqual(report['missing_loads'],
+                         [{'member': 'cache', 'libraries': ['cache'],
+                           'lines': [6]}])
+
+        result = TemplateResult.from_template(template)
+        self.assertEqual(report, result.get_report())
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+
+from django.template import Engine
+from django.test import TestCase
+
+from unload import logic
+from unload.base import LexedTemplate, TemplateResult
+from unload.cache import ResultCache, get_default_cache_path
+from unload.libraries import LibraryIndex
+from unload.logic import analyze_templates, get_cached_results, worker_pool
+from unload.utils import get_app, get_contents, get_templates
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'results.json')
+        self.engine = Engine.get_default()
+        self.library_index = LibraryIndex()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_result(self, source, name='test.html'):
+        template = LexedTemplate(template_string=source, engine=self.engine,
+                                 name=name,
+                                 library_index=self.library_index)
+        return TemplateResult.from_template(template)
+
+    def test_default_cache_path(self):
+        path = get_default_cache_path()
+        self.assertTrue(os.path.isabs(path))
+        self.assertEqual('django-unload',
+                         os.path.basename(os.path.dirname(path)))
+
+    def test_result_roundtrip(self):
+        result = self.get_result('{% load app_tags %}{% load app_tags %}'
+                                 '{{ var|plus:1 }}{% example_inclusion_tag %}')
+        restored = TemplateResult.from_dict(result.to_dict())
+        for attribute in TemplateResult.attributes:
+            self.assertEqual(getattr(result, attribute),
+                             getattr(restored, attribute))
+        self.assertEqual(result.list_duplicates(), restored.list_duplicates())
+
+    def test_get_and_set(self):
+        source = '{% load app_tags %}{{ var|plus:1 }}'
+        result = self.get_result(source)
+
+        cache = ResultCache(path=self.path)
+        key = cache.get_key('test.html', source)
+        self.assertIsNone(cache.get(key, self.engine, self.library_index))
+        cache.set(key, result, self.engine, self.library_index)
+        cache.save()
+        self.assertTrue(os.path.isfile(self.path))
+
+        cache = ResultCache(path=self.path)
+        cached = cache.get(key, self.engine, self.library_index)
+        self.assertEqual(result.to_dict(), cached.to_dict())
+        # Changed contents
+        key = cache.get_key('test.html', source + ' ')
+        self.assertIsNone(cache.get(key, self.engine, self.library_index))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+        # The results of another mode are not reused
+        cache = ResultCache(path=self.path, lex_only=True)
+        key = cache.get_key('test.html', source)
+        self.assertIsNone(cache.get(key, self.engine, self.library_index))
+
+    def test_changed_library(self):
+        source = '{% load app_tags %}{{ var|plus:1 }}'
+        result = self.get_result(source)
+        cache = ResultCache(path=self.path)
+        key = cache.get_key('test.html', source)
+        cache.set(key, result, self.engine, self.library_index)
+
+        # The library no longer provides the same members
+        self.library_index._fingerprints['app_tags'] = 'changed'
+        self.assertIsNone(cache.get(key, self.engine, self.library_index))
+
+    def test_dependency_index(self):
+        sources = {'tags.html': '{% load app_tags %}{{ var|plus:1 }}',
+                   'missing.html': '{{ var|plus:1 }}',
+                   'i18n.html': '{% load i18n %}{% trans "Text" %}'}
+        cache = ResultCache(path=self.path)
+        keys = {}
+        for name, source in sources.items():
+            keys[name] = cache.get_key(name, source)
+            cache.set(keys[name], self.get_result(source), self.engine,
+                      self.library_index)
+        dependents = cache.get_dependency_index()
+        self.assertEqual(sorted([keys['tags.html'], keys['missing.html']]),
+                         dependents['app_tags'])
+        self.assertEqual([keys['i18n.html']], dependents['i18n'])
+        self.assertTrue(cache._libraries['app_tags']['path'].endswith(
+            'app_tags.py'))
+        cache.save()
+
+        # Unchanged libraries
+        cache = ResultCache(path=self.path)
+        self.assertEqual(0, cache.invalidated)
+        self.assertEqual([], cache.get_modified_libraries())
+
+        # The modification time changed, but the contents did not
+        with open(self.path) as fp:
+            data = json.load(fp)
+        data['libraries']['app_tags']['stamp'] = [0, 0]
+        with open(self.path, 'w') as fp:
+            json.dump(data, fp)
+        cache = ResultCache(path=self.path)
+        self.assertEqual(0, cache.invalidated)
+        self.assertNotEqual([0, 0], cache._libraries['app_tags']['stamp'])
+
+        # Modified library
+        data['libraries']['app_tags']['digest'] = 'modified'
+        with open(self.path, 'w') as fp:
+            json.dump(data, fp)
+        cache = ResultCache(path=self.path)
+        self.assertEqual(2, cache.invalidated)
+        self.assertNotIn('app_tags', cache._libraries)
+        self.assertIsNone(cache.get(keys['tags.html'], self.engine,
+                                    self.library_index))
+        self.assertIsNone(cache.get(keys['missing.html'], self.engine,
+                                    self.library_index))
+        self.assertIsNotNone(cache.get(keys['i18n.html'], self.engine,
+                                       self.library_index))
+
+    def test_save_prunes_unused_entries(self):
+        sources = {'tags.html': '{% load app_tags %}{{ var|plus:1 }}',
+                   'i18n.html': '{% load i18n %}{% trans "Text" %}',
+                   'static.html': '{% load static %}{% static "a.css" %}'}
+        cache = ResultCache(path=self.path)
+        keys = {}
+        for name, source in sources.items():
+            filepath = os.path.join(self.directory, name)
+            with open(filepath, 'w') as fp:
+                fp.write(source)
+            keys[name] = cache.get_key(filepath, source)
+            cache.set(keys[name], self.get_result(source, filepath),
+                      self.engine, self.library_index)
+        cache.save()
+
+        # Only i18n.html is scanned after it was edited and tags.html is
+        # deleted; the entry of static.html is kept, since it was not scanned
+        os.remove(os.path.join(self.directory, 'tags.html'))
+        filepath = os.path.join(self.directory, 'i18n.html')
+        cache = ResultCache(path=self.path)
+        key = cache.get_key(filepath, 'Text')
+        self.assertIsNone(cache.get(key, self.engine, self.library_index))
+        cache.set(key, self.get_result('Text', filepath), self.engine,
+                  self.library_index)
+        cache.save()
+        cache = ResultCache(path=self.path)
+        self.assertEqual(sorted([key, keys['static.html']]),
+                         sorted(cache._entries))
+        dependents = cache.get_dependency_index()
+        self.assertIn('static', dependents)
+        for module in ('app_tags', 'i18n'):
+            self.assertNotIn(module, cache._libraries)
+            self.assertNotIn(module, dependents)
+
+    def test_analyze_templates_streams_misses(self):
+        app = get_app('app')
+        templates = get_templates(os.path.join(app.path, 'templates'), [])
+        self.assertGreater(len(templates), 2)
+        # The first result is available once its template is looked up
+        cache = ResultCache(path=self.path)
+        results = analyze_templates(templates, 0, self.engine,
+                                    library_index=self.library_index,
+                                    cache=cache)
+        self.assertEqual(templates[0], next(results).name)
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+
+        # The workers receive the templates in batches
+        self.addCleanup(setattr, logic, 'CACHE_BATCH_SIZE',
+                        logic.CACHE_BATCH_SIZE)
+        logic.CACHE_BATCH_SIZE = 2
+        cache = ResultCache(path=os.path.join(self.directory, 'pool.json'))
+        with worker_pool(2) as pool:
+            results = analyze_templates(templates, 0, self.engine,
+                                        library_index=self.library_index,
+                                        pool=pool, cache=cache)
+            self.assertEqual(templates[0], next(results).name)
+            self.assertEqual((0, 2), (cache.hits, cache.misses))
+            self.assertEqual(templates[1:],
+                             [result.name for result in results])
+        self.assertEqual((0, len(templates)), (cache.hits, cache.misses))
+
+    def test_corrupted_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as fp:
+            fp.write('{')
+        cache = ResultCache(path=self.path)
+        self.assertEqual({}, cache._entries)
+
+    def test_analyze_templates(self):
+        app = get_app('app')
+        templates = get_templates(os.path.join(app.path, 'templates'), [])
+
+        cache = ResultCache(path=self.path)
+        expected = [result.to_dict() for result in analyze_templates(
+            templates, 0, self.engine, library_index=self.library_index,
+            cache=cache)]
+        self.assertEqual((0, len(templates)), (cache.hits, cache.misses))
+
+        results = [result.to_dict() for result in analyze_templates(
+            templates, 0, self.engine, library_index=self.library_index,
+            cache=cache)]
+        self.assertEqual(expected, results)
+        self.assertEqual((len(templates), len(templates)),
+                         (cache.hits, cache.misses))
+
+    def test_get_cached_results(self):
+        app = get_app('app')
+        templates = get_templates(os.path.join(app.path, 'templates'), [])
+        cache = ResultCache(path=self.path)
+        # The contents of the missing templates are passed to the analysis
+        entries = get_cached_results(templates, self.engine,
+                                     self.library_index, cache)
+        for filepath, key, result, source in entries:
+            self.assertIsNone(result)
+            self.assertEqual(get_contents(filepath), source)
+        list(analyze_templates(templates, 0, self.engine,
+                               library_index=self.library_index,
+                               cache=cache))
+        entries = get_cached_results(templates, self.engine,
+                                     self.library_index, cache)
+        self.assertEqual([None] * len(templates),
+                         [source for _, _, _, source in entries])
+
+        # The workers analyze the contents read by the cache lookup
+        cache = ResultCache(path=os.path.join(self.directory, 'pool.json'))
+        with worker_pool(2) as pool:
+            results = [result.to_dict() for result in analyze_templates(
+                templates, 0, self.engine, library_index=self.library_index,
+                pool=pool, cache=cache)]
+        self.assertEqual(
+            [result.to_dict() for result in analyze_templates(
+                templates, 0, self.engine,
+                library_index=self.library_index)],
+            results)
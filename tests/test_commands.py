@@ -2,10 +2,19 @@
 
 from __future__ import unicode_literals
 
-from django.core.management import call_command
+import json
+import os
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.core.management import CommandError, call_command
 from django.test import TestCase
 from django.utils.six import StringIO
 
+from unload.diagnostics import tracemalloc
+from unload.utils import get_contents
+
 
 class TestCommand(TestCase):
 
@@ -25,3 +34,265 @@ class TestCommand(TestCase):
         output = StringIO()
         call_command('find_unnecessary_loads', app='empty', stdout=output)
         self.assertEqual('Has issues: False', output.getvalue().strip())
+
+        output = StringIO()
+        call_command('find_unnecessary_loads', app='app', lex_only=True,
+                     stdout=output)
+        self.assertEqual('Has issues: True', output.getvalue().strip())
+
+        output = StringIO()
+        call_command('find_unnecessary_loads', app='app', jobs=2,
+                     stdout=output)
+        self.assertEqual('Has issues: True', output.getvalue().strip())
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', jobs=-1)
+
+    def test_find_unnecessary_loads_format(self):
+        output = StringIO()
+        errors = StringIO()
+        call_command('find_unnecessary_loads', app='app',
+                     output_format='jsonl', stdout=output, stderr=errors)
+        self.assertEqual('', output.getvalue())
+        self.assertEqual('Has issues: True', errors.getvalue().strip())
+
+    def test_find_unnecessary_loads_paths(self):
+        app = apps.get_app_config('app')
+        templates = os.path.join(app.path, 'templates', 'app', 'templates')
+
+        output = StringIO()
+        call_command('find_unnecessary_loads',
+                     os.path.join(templates, 'with_tags.html'), stdout=output)
+        self.assertEqual('Has issues: False', output.getvalue().strip())
+
+        output = StringIO()
+        call_command('find_unnecessary_loads',
+                     os.path.join(templates, 'with_tags.html'),
+                     os.path.join(templates, 'double_loads.html'),
+                     stdout=output)
+        self.assertEqual('Has issues: True', output.getvalue().strip())
+
+        output = StringIO()
+        call_command('find_unnecessary_loads',
+                     os.path.join(templates, 'double_loads.html'),
+                     app='clean', stdout=output)
+        self.assertEqual('Has issues: False', output.getvalue().strip())
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', since='unknown-revision')
+
+    def test_find_unnecessary_loads_shard(self):
+        output = StringIO()
+        call_command('find_unnecessary_loads', app='clean', shard='1/2',
+                     stdout=output)
+        self.assertEqual('Has issues: False', output.getvalue().strip())
+
+        for shard in ('1', '0/2', '3/2'):
+            with self.assertRaises(CommandError):
+                call_command('find_unnecessary_loads', shard=shard)
+
+    def test_find_unnecessary_loads_fail_on_issues(self):
+        output = StringIO()
+        call_command('find_unnecessary_loads', app='clean',
+                     fail_on_issues=True, stdout=output)
+        self.assertEqual('Has issues: False', output.getvalue().strip())
+
+        # The summary is written before the command fails
+        output = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', app='app',
+                         fail_on_issues=True, stdout=output)
+        self.assertEqual('Has issues: True', output.getvalue().strip())
+
+        # A shard fails if and only if its templates have issues
+        failed = []
+        for shard in ('1/2', '2/2'):
+            output = StringIO()
+            try:
+                call_command('find_unnecessary_loads', app='app',
+                             shard=shard, fail_on_issues=True, stdout=output)
+            except CommandError:
+                failed.append(True)
+            else:
+                failed.append(False)
+            self.assertEqual('Has issues: {}'.format(failed[-1]),
+                             output.getvalue().strip())
+        self.assertIn(True, failed)
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', fail_on_issues=True,
+                         diff=True, stdout=StringIO(), stderr=StringIO())
+
+    def test_find_unnecessary_loads_diff(self):
+        output = StringIO()
+        errors = StringIO()
+        call_command('find_unnecessary_loads', app='app', diff=True,
+                     stdout=output, stderr=errors)
+        self.assertEqual('Fixed templates: 4; removed load tags: 6',
+                         errors.getvalue().strip())
+
+        errors = StringIO()
+        call_command('find_unnecessary_loads', app='clean', diff=True,
+                     stderr=errors)
+        self.assertEqual('Fixed templates: 0; removed load tags: 0',
+                         errors.getvalue().strip())
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', fix=True,
+                         output_format='jsonl')
+
+    def test_find_unnecessary_loads_rank(self):
+        output = StringIO()
+        call_command('find_unnecessary_loads', app='clean', rank=True,
+                     repeat=1, stdout=output)
+        self.assertEqual('Wasted compile time: 0.000 ms',
+                         output.getvalue().strip())
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', rank=True, repeat=0)
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', rank=True, fix=True)
+
+    def test_find_unnecessary_loads_render_counts(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'counts.csv')
+            with open(path, 'w') as fp:
+                fp.write('app/templates/double_loads.html,10\n')
+            output = StringIO()
+            call_command('find_unnecessary_loads', app='app',
+                         render_counts=[path], stdout=output)
+            self.assertEqual('Has issues: True', output.getvalue().strip())
+
+            with open(path, 'w') as fp:
+                fp.write('template,renders\nwith_tags.html,many\n')
+            with self.assertRaises(CommandError):
+                call_command('find_unnecessary_loads', render_counts=[path])
+        finally:
+            shutil.rmtree(directory)
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads',
+                         render_counts=[os.path.join(directory, 'missing')])
+
+    def test_find_unnecessary_loads_timings(self):
+        output = StringIO()
+        call_command('find_unnecessary_loads', app='clean', timings=True,
+                     stdout=output)
+        self.assertIn('| Discovery ', output.getvalue())
+        self.assertTrue(output.getvalue().strip().endswith(
+            'Has issues: False'))
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', timings=True, rank=True)
+
+    def test_find_unnecessary_loads_trace(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'trace.json')
+            output = StringIO()
+            call_command('find_unnecessary_loads', app='clean',
+                         trace_out=path, stdout=output)
+            self.assertIn('Trace written to', output.getvalue())
+            # The timings are not listed
+            self.assertNotIn('| Discovery ', output.getvalue())
+            trace = json.loads(get_contents(path))
+            self.assertEqual('ms', trace['displayTimeUnit'])
+            self.assertIn('discovery', [event['name']
+                                        for event in trace['traceEvents']])
+        finally:
+            shutil.rmtree(directory)
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', trace_out='trace.json',
+                         rank=True)
+
+    def test_find_unnecessary_loads_diagnostics(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'profile.pstats')
+            output = StringIO()
+            call_command('find_unnecessary_loads', app='clean',
+                         profile_out=path, stdout=output)
+            self.assertIn('Profile written to', output.getvalue())
+            self.assertTrue(os.path.isfile(path))
+        finally:
+            shutil.rmtree(directory)
+
+        if tracemalloc is None:
+            with self.assertRaises(CommandError):
+                call_command('find_unnecessary_loads', memory_report=True)
+            return
+        output = StringIO()
+        call_command('find_unnecessary_loads', app='clean',
+                     memory_report=True, top=3, stdout=output)
+        self.assertIn('| Allocation site ', output.getvalue())
+        self.assertIn('Memory in use: ', output.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', memory_report=True,
+                         top=-1)
+
+    def test_find_unnecessary_loads_profile_compile(self):
+        output = StringIO()
+        call_command('find_unnecessary_loads', app='empty',
+                     profile_compile=True, stdout=output)
+        self.assertEqual('Total compile time: 0.000 ms',
+                         output.getvalue().strip())
+
+        output = StringIO()
+        errors = StringIO()
+        call_command('find_unnecessary_loads', app='clean',
+                     profile_compile=True, output_format='jsonl',
+                     stdout=output, stderr=errors)
+        self.assertEqual('', output.getvalue())
+        self.assertTrue(errors.getvalue().startswith('Total compile time: '))
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', profile_compile=True,
+                         jobs=2)
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', profile_compile=True,
+                         top=-1)
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', profile_compile=True,
+                         rank=True)
+
+    def test_find_unnecessary_loads_dead(self):
+        output = StringIO()
+        call_command('find_unnecessary_loads', dead=True, stdout=output)
+        self.assertEqual('Has unused templatetags: False',
+                         output.getvalue().strip())
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', dead=True, app='app')
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', dead=True, shard='1/2')
+
+    def test_find_unnecessary_loads_usage(self):
+        output = StringIO()
+        call_command('find_unnecessary_loads', usage=True, stdout=output)
+        self.assertEqual('Recommendations: 0', output.getvalue().strip())
+
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', usage=True, dead=True)
+
+    def test_find_unnecessary_loads_watch(self):
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', watch=True, jobs=2)
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', watch=True, cache='')
+        with self.assertRaises(CommandError):
+            call_command('find_unnecessary_loads', watch=True,
+                         output_format='json')
+
+    def test_find_unnecessary_loads_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache_path = os.path.join(directory, 'results.json')
+
+        for _ in range(2):
+            output = StringIO()
+            call_command('find_unnecessary_loads', app='app',
+                         cache=cache_path, stdout=output)
+            self.assertEqual('Has issues: True', output.getvalue().strip())
+            self.assertTrue(os.path.isfile(cache_path))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import pstats
+import shutil
+import tempfile
+from unittest import skipIf
+
+from django.test import TestCase
+
+from unload.diagnostics import (get_allocation_sites,
+                                profile_to_file,
+                                trace_memory,
+                                tracemalloc)
+
+
+def allocate():
+    return [str(number) for number in range(1000)]
+
+
+class TestDiagnostics(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_profile_to_file(self):
+        path = os.path.join(self.directory, 'profile.pstats')
+        with profile_to_file(path):
+            allocate()
+        functions = [function for filename, line, function
+                     in pstats.Stats(path).stats]
+        self.assertIn('allocate', functions)
+
+    @skipIf(tracemalloc is None, 'tracemalloc requires Python 3.4+')
+    def test_trace_memory(self):
+        with trace_memory() as report:
+            numbers = allocate()
+        self.assertGreater(report['peak'], 0)
+        self.assertGreaterEqual(report['peak'], report['current'])
+        self.assertFalse(tracemalloc.is_tracing())
+
+        sites = get_allocation_sites(report['snapshot'], top=3)
+        self.assertLessEqual(len(sites), 3)
+        self.assertEqual(__file__, sites[0]['file'])
+        self.assertGreaterEqual(sites[0]['count'], len(numbers))
+
+    @skipIf(tracemalloc is not None, 'tracemalloc is available')
+    def test_trace_memory_unavailable(self):
+        with self.assertRaises(RuntimeError):
+            with trace_memory():
+                pass
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from unload.base import LexedTemplate, TemplateResult
+from unload.fix import (consolidate_source,
+                        fix_source,
+                        fix_template,
+                        get_consolidated_loads,
+                        get_load_spans,
+                        get_tag_spans,
+                        get_unified_diff,
+                        replace_span)
+from unload.libraries import get_library_index
+from unload.logic import fix_unnecessary_loads
+from unload.utils import get_djangotemplates_engines
+
+
+class TestFix(TestCase):
+
+    def fix(self, source):
+        template = LexedTemplate(template_string=source, name='inline.html')
+        result = TemplateResult.from_template(template)
+        return fix_source(source, result, get_library_index())
+
+    def test_get_load_spans(self):
+        source = ('{% load app_tags %}\n{% verbatim %}{% load i18n %}'
+                  '{% endverbatim %}{# {% load i18n %} #}{%load  i18n%}')
+        start = source.index('{%load')
+        self.assertEqual([(0, 19), (start, start + 14)],
+                         get_load_spans(source))
+        # Loads within comment blocks are skipped
+        self.assertEqual([], get_load_spans(
+            '{% comment %}{% load i18n %}{% endcomment %}'))
+
+    def test_replace_span(self):
+        source = 'a\n  {% load i18n %}  \nb'
+        self.assertEqual('a\nb', replace_span(source, 4, 19))
+        self.assertEqual('a\n  x  \nb', replace_span(source, 4, 19, 'x'))
+        # The line contains other text
+        self.assertEqual('a\n  {% x %}\nb',
+                         replace_span('a\n  {% load i18n %}{% x %}\nb', 4, 19))
+        self.assertEqual('', replace_span('{% load i18n %}', 0, 15))
+
+    def test_fix_source(self):
+        # Duplicate and unutilized modules
+        self.assertEqual(
+            '{% load app_tags %}\n{{ 1|plus:2 }}',
+            self.fix('{% load app_tags %}\n{% load app_tags i18n %}\n'
+                     '{% load i18n %}\n{{ 1|plus:2 }}'))
+        # Duplicate and unutilized members
+        self.assertEqual(
+            '{% load plus from app_tags %}\n{{ 1|plus:2 }}\n',
+            self.fix('{% load plus example_simple_tag from app_tags %}\n'
+                     '{% load plus from app_tags %}\n{{ 1|plus:2 }}\n'))
+        # Members of a module loaded by a preceding block
+        self.assertEqual(
+            '{% load app_tags %}{{ 1|plus:2 }}',
+            self.fix('{% load app_tags %}{% load plus from app_tags %}'
+                     '{{ 1|plus:2 }}'))
+        # Unknown libraries and clean templates are left as they are
+        source = ('{% load unknown_tags %}{% load x from unknown_tags %}'
+                  '{% load app_tags %}{{ 1|plus:2 }}')
+        self.assertEqual(source, self.fix(source))
+        # Only the loads of the listed names are removed
+        template = LexedTemplate(
+            template_string='{% load app_tags %}{% load app_tags i18n %}'
+                            '{% load plus x from app_tags %}{{ 1|plus:2 }}',
+            name='inline.html')
+        result = TemplateResult.from_template(template)
+        self.assertEqual(
+            '{% load app_tags %}{% load i18n %}{{ 1|plus:2 }}',
+            fix_source(template.source, result, get_library_index(),
+                       names=['app_tags']))
+        self.assertEqual(
+            '{% load app_tags %}{% load app_tags %}'
+            '{% load plus from app_tags %}{{ 1|plus:2 }}',
+            fix_source(template.source, result, get_library_index(),
+                       names=['i18n', 'x']))
+        # Line endings are preserved
+        self.assertEqual(
+            '{% load app_tags %}\r\n{{ 1|plus:2 }}\r\n',
+            self.fix('{% load app_tags %}\r\n{% load i18n %}\r\n'
+                     '{{ 1|plus:2 }}\r\n'))
+
+    def consolidate(self, source):
+        template = LexedTemplate(template_string=source, name='inline.html')
+        result = TemplateResult.from_template(template)
+        return consolidate_source(source, result, get_library_index())
+
+    def test_get_tag_spans(self):
+        source = ('{% extends "a.html" %}{% comment %}{% load i18n %}'
+                  '{% endcomment %}{% load i18n %}')
+        self.assertEqual(
+            [('extends', False), ('comment', False), ('load', True),
+             ('endcomment', False), ('load', False)],
+            [(tag_name, commented)
+             for tag_name, _, _, commented in get_tag_spans(source)])
+
+    def test_get_consolidated_loads(self):
+        source = ('{% load static %}{% load plus from app_tags %}'
+                  '{% load i18n static %}{% load example_simple_tag from '
+                  'app_tags %}{% trans "a" %}{% static "b" %}'
+                  '{{ 1|plus:2 }}{% example_simple_tag %}')
+        template = LexedTemplate(template_string=source, name='inline.html')
+        result = TemplateResult.from_template(template)
+        self.assertEqual(
+            ['{% load i18n static %}',
+             '{% load example_simple_tag plus from app_tags %}'],
+            get_consolidated_loads(result, get_library_index()))
+
+        # Unknown libraries cannot be reordered
+        template = LexedTemplate(
+            template_string='{% load unknown_tags %}{% load i18n %}',
+            name='inline.html')
+        result = TemplateResult.from_template(template)
+        self.assertIsNone(get_consolidated_loads(result,
+                                                 get_library_index()))
+
+    def test_consolidate_source(self):
+        # The loads are placed after the extends tag
+        self.assertEqual(
+            '{% extends "a.html" %}\n{% load i18n static %}\n'
+            '{% block a %}\n{% trans "a" %}{% static "b" %}\n'
+            '{% endblock %}',
+            self.consolidate(
+                '{% extends "a.html" %}\n{% block a %}\n{% load static %}'
+                '\n{% load i18n %}{% trans "a" %}{% static "b" %}\n'
+                '{% endblock %}'))
+        # The first load tag is replaced if it is located at the top
+        self.assertEqual(
+            '{% load i18n static %}\n<p>{% trans "a" %}{% static "b" %}',
+            self.consolidate('{% load static %}\n<p>{% load i18n %}'
+                             '{% trans "a" %}{% static "b" %}'))
+        # Loads without extends are placed at the top
+        self.assertEqual(
+            '{% load i18n static %}\n<p>{% trans "a" %}{% static "b" %}',
+            self.consolidate('<p>{% load static i18n %}{% trans "a" %}'
+                             '{% static "b" %}'))
+        # Loads within comments are never rendered and left as they are
+        source = ('<p>{% comment %}{% load static %}{% endcomment %}'
+                  '{% load i18n %}{% load i18n %}{% trans "a" %}')
+        self.assertEqual('{% load i18n %}\n<p>{% comment %}{% load static %}'
+                         '{% endcomment %}{% trans "a" %}',
+                         self.consolidate(source))
+
+    def test_fix_source_modified(self):
+        template = LexedTemplate(template_string='{% load i18n %}',
+                                 name='inline.html')
+        result = TemplateResult.from_template(template)
+        source = '{% load i18n %}{% load i18n %}'
+        self.assertEqual(source,
+                         fix_source(source, result, get_library_index()))
+
+    def test_get_unified_diff(self):
+        filepath = os.path.join(os.getcwd(), 'templates', 'index.html')
+        self.assertEqual('', get_unified_diff(filepath, 'a\n', 'a\n'))
+        self.assertEqual(
+            '--- a/templates/index.html\n'
+            '+++ b/templates/index.html\n'
+            '@@ -1,2 +1 @@\n'
+            '-{% load i18n %}\n'
+            ' a\n'
+            '\\ No newline at end of file\n',
+            get_unified_diff(filepath, '{% load i18n %}\na', 'a'))
+
+
+class TestFixTemplates(TestCase):
+
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.duplicates = os.path.join(self.directory, 'duplicates.html')
+        self.clean = os.path.join(self.directory, 'clean.html')
+        self.write(self.duplicates,
+                   '{% load app_tags %}\r\n{% load app_tags %}\r\nčć'
+                   '{{ 1|plus:2 }}\r\n')
+        self.write(self.clean, '{% load app_tags %}{{ 1|plus:2 }}')
+        settings = override_settings(TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'DIRS': [self.directory],
+            'APP_DIRS': False,
+            'OPTIONS': {},
+        }])
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, filepath, source):
+        with io.open(filepath, 'w', encoding='UTF-8', newline='') as fp:
+            fp.write(source)
+
+    def read(self, filepath):
+        with io.open(filepath, encoding='UTF-8', newline='') as fp:
+            return fp.read()
+
+    def get_result(self, filepath):
+        template = LexedTemplate(template_string=self.read(filepath),
+                                 name=filepath)
+        return TemplateResult.from_template(template)
+
+    def test_fix_template(self):
+        engine = get_djangotemplates_engines()[0].engine
+        result = self.get_result(self.duplicates)
+        filepath, patch, removed, error = fix_template(
+            self.duplicates, engine, result, dry_run=True)
+        self.assertEqual(self.duplicates, filepath)
+        self.assertEqual(1, removed)
+        self.assertIsNone(error)
+        self.assertIn('-{% load app_tags %}\r\n', patch)
+        self.assertIn('{% load app_tags %}\r\n{% load app_tags %}',
+                      self.read(self.duplicates))
+
+        fix_template(self.duplicates, engine, result)
+        self.assertEqual('{% load app_tags %}\r\nčć{{ 1|plus:2 }}\r\n',
+                         self.read(self.duplicates))
+
+    def test_fix_template_invalid(self):
+        """
+        The templates whose fixed contents cannot be compiled are left as
+        they are.
+        """
+        engine = get_djangotemplates_engines()[0].engine
+        sources = {
+            # blocktrans is considered a built-in tag
+            'blocktrans.html': ('{% load i18n %}\n{% blocktrans %}Text'
+                                '{% endblocktrans %}'),
+            # The filters of the filter tag are not recognized
+            'filter.html': ('{% load app_tags %}\n{% filter plus:1 %}2'
+                            '{% endfilter %}')
+        }
+        for name, source in sorted(sources.items()):
+            filepath = os.path.join(self.directory, name)
+            self.write(filepath, source)
+            result = self.get_result(filepath)
+            for dry_run in (True, False):
+                _, patch, removed, error = fix_template(
+                    filepath, engine, result, dry_run=dry_run)
+                self.assertEqual(('', 0), (patch, removed))
+                self.assertIn('cannot be compiled', error)
+                self.assertEqual(source, self.read(filepath))
+
+        output = StringIO()
+        self.assertEqual((1, 1), fix_unnecessary_loads(output=output))
+        self.assertIn('Unable to fix {}: '.format(
+            os.path.join(self.directory, 'filter.html')), output.getvalue())
+        self.assertEqual(sources['blocktrans.html'], self.read(
+            os.path.join(self.directory, 'blocktrans.html')))
+
+    def test_consolidate_template_invalid(self):
+        engine = get_djangotemplates_engines()[0].engine
+        sources = [
+            ('{% load static %}\n{% load i18n %}{% static "a" %}\n'
+             '{% blocktrans %}Text{% endblocktrans %}'),
+            ('{% load static %}\n{% load app_tags %}{% static "a" %}\n'
+             '{% filter plus:1 %}2{% endfilter %}')
+        ]
+        filepath = os.path.join(self.directory, 'consolidate.html')
+        for source in sources:
+            self.write(filepath, source)
+            result = self.get_result(filepath)
+            _, patch, removed, error = fix_template(
+                filepath, engine, result, consolidate=True)
+            self.assertEqual(('', 0), (patch, removed))
+            self.assertIn('cannot be compiled', error)
+            self.assertEqual(source, self.read(filepath))
+
+            output = StringIO()
+            fix_unnecessary_loads(consolidate=True, filepaths=[filepath],
+                                  output=output)
+            self.assertIn('Unable to fix {}: '.format(filepath),
+                          output.getvalue())
+            self.assertEqual(source, self.read(filepath))
+
+    def test_fix_unnecessary_loads(self):
+        output = StringIO()
+        self.assertEqual((1, 1), fix_unnecessary_loads(dry_run=True,
+                                                       output=output))
+        self.assertIn('+++ b/', output.getvalue())
+        self.assertIn('{% load app_tags %}\r\n{% load app_tags %}',
+                      self.read(self.duplicates))
+
+        output = StringIO()
+        self.assertEqual((1, 1), fix_unnecessary_loads(jobs=2,
+                                                       output=output))
+        self.assertEqual('Fixed {}'.format(self.duplicates),
+                         output.getvalue().strip())
+        self.assertEqual('{% load app_tags %}\r\nčć{{ 1|plus:2 }}\r\n',
+                         self.read(self.duplicates))
+        self.assertEqual('{% load app_tags %}{{ 1|plus:2 }}',
+                         self.read(self.clean))
+
+        self.assertEqual((0, 0), fix_unnecessary_loads(output=StringIO()))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.template import TemplateSyntaxError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from unload.impact import estimate_impact, get_unnecessary_loads, time_compile
+from unload.logic import analyze_template, rank_unnecessary_loads
+from unload.utils import get_app, get_djangotemplates_engines
+
+
+class TestImpact(TestCase):
+
+    def setUp(self):
+        self.engine = get_djangotemplates_engines()[0].engine
+        app = get_app('app')
+        self.templates = os.path.join(app.path, 'templates', 'app',
+                                      'templates')
+
+    def analyze(self, name):
+        return analyze_template(os.path.join(self.templates, name),
+                                self.engine)
+
+    def test_time_compile(self):
+        duration = time_compile('{% load app_tags %}{{ 1|plus:2 }}',
+                                self.engine, number=2, repeat=2)
+        self.assertGreater(duration, 0)
+
+    def test_get_unnecessary_loads(self):
+        self.assertEqual([], get_unnecessary_loads(
+            self.analyze('with_tags.html')))
+        self.assertEqual(['app_tags'], get_unnecessary_loads(
+            self.analyze('double_loads.html')))
+        self.assertEqual(['app_tags', 'example_simple_tag', 'plus'],
+                         get_unnecessary_loads(
+                             self.analyze('from_syntax_without_tags.html')))
+
+    def test_estimate_impact(self):
+        self.assertEqual(([], {}), estimate_impact(
+            self.analyze('with_tags.html'), self.engine))
+
+        result = self.analyze('without_tags.html')
+        records, errors = estimate_impact(result, self.engine, number=2,
+                                          repeat=2)
+        self.assertEqual({}, errors)
+        self.assertEqual(1, len(records))
+        record = records[0]
+        self.assertEqual(result.name, record['template'])
+        self.assertEqual('app_tags', record['load'])
+        self.assertGreater(record['compile_ms'], 0)
+        self.assertGreater(record['fixed_compile_ms'], 0)
+        self.assertAlmostEqual(
+            record['compile_ms'] - record['fixed_compile_ms'],
+            record['wasted_ms'])
+
+        # Every load is measured on its own
+        records, errors = estimate_impact(
+            self.analyze('from_syntax_without_tags.html'), self.engine,
+            number=2, repeat=2)
+        self.assertEqual(['app_tags', 'example_simple_tag', 'plus'],
+                         [record['load'] for record in records])
+        self.assertEqual(1, len(set(record['compile_ms']
+                                    for record in records)))
+
+    def test_estimate_impact_invalid(self):
+        directory = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory)
+        filepath = os.path.join(directory, 'blocktrans.html')
+        # blocktrans is considered a built-in tag
+        with open(filepath, 'w') as fp:
+            fp.write('{% load i18n %}{% blocktrans %}Text{% endblocktrans %}')
+        result = analyze_template(filepath, self.engine)
+        records, errors = estimate_impact(result, self.engine, number=1,
+                                          repeat=1)
+        self.assertEqual([], records)
+        self.assertEqual(['i18n'], list(errors))
+        self.assertIn('blocktrans', errors['i18n'])
+        # The ranking reports the skipped load
+        settings = override_settings(TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'DIRS': [directory],
+            'APP_DIRS': False,
+            'OPTIONS': {},
+        }])
+        with settings:
+            output = StringIO()
+            self.assertEqual([], rank_unnecessary_loads(repeat=1,
+                                                        output=output))
+        self.assertIn('Unable to compile {} without i18n: '.format(filepath),
+                      output.getvalue())
+
+        with open(filepath, 'w') as fp:
+            fp.write('{% load i18n %}{% load i18n %}{% if %}{% endif %}')
+        result = analyze_template(filepath, self.engine, lex_only=True)
+        with self.assertRaises(TemplateSyntaxError):
+            estimate_impact(result, self.engine, number=1, repeat=1)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.template.engine import Engine
+from django.test import TestCase
+
+from unload.libraries import (LibraryIndex,
+                              get_library_index,
+                              invalidate_library_index)
+
+
+class TestLibraries(TestCase):
+
+    def test_get_members(self):
+        library_index = LibraryIndex()
+        tags, filters = library_index.get_members('app_tags')
+        self.assertIsInstance(tags, frozenset)
+        self.assertIsInstance(filters, frozenset)
+        self.assertIn('example_simple_tag', tags)
+        self.assertIn('example_inclusion_tag', tags)
+        self.assertIn('example_assignment_tag', tags)
+        self.assertEqual(frozenset(['plus']), filters)
+        # The members are computed only once
+        self.assertIs(tags, library_index.get_members('app_tags')[0])
+        # Nonexistent library
+        self.assertIsNone(library_index.get_members('some_lib'))
+
+    def test_libraries(self):
+        library_index = LibraryIndex()
+        libraries = library_index.libraries
+        self.assertEqual('demo.app.templatetags.app_tags',
+                         libraries['app_tags'])
+        # The installed apps are walked only once
+        self.assertIs(libraries, library_index.libraries)
+
+    def test_get_providers(self):
+        library_index = LibraryIndex()
+        tag_providers, filter_providers = library_index.get_providers()
+        self.assertEqual(frozenset(['app_tags']),
+                         tag_providers['example_simple_tag'])
+        self.assertEqual(frozenset(['app_tags']), filter_providers['plus'])
+        self.assertEqual(frozenset(['i18n']), tag_providers['trans'])
+        self.assertNotIn('plus', tag_providers)
+        self.assertIs(tag_providers, library_index.get_providers()[0])
+
+    def test_get_builtin_members(self):
+        library_index = LibraryIndex()
+        builtin_members = library_index.get_builtin_members(
+            Engine.get_default())
+        self.assertIn('block', builtin_members)
+        self.assertIn('default', builtin_members)
+        self.assertNotIn('example_simple_tag', builtin_members)
+
+    def test_invalidate(self):
+        library_index = LibraryIndex()
+        libraries = library_index.libraries
+        tags, filters = library_index.get_members('app_tags')
+        library_index.invalidate('app_tags')
+        self.assertIsNot(tags, library_index.get_members('app_tags')[0])
+        self.assertIs(libraries, library_index.libraries)
+        library_index.invalidate()
+        self.assertIsNot(libraries, library_index.libraries)
+
+    def test_get_library_index(self):
+        library_index = get_library_index()
+        self.assertIsInstance(library_index, LibraryIndex)
+        self.assertIs(library_index, get_library_index())
+        invalidate_library_index()
+        self.assertIsNot(library_index, get_library_index())
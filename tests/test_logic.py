@@ -2,13 +2,33 @@
 
 from __future__ import unicode_literals
 
+import json
 import os
+import shutil
+import tempfile
+from itertools import count
 
 from django.conf import settings
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
 
-from unload.logic import list_unnecessary_loads, process_template
-from unload.utils import get_app, get_djangotemplates_engines
+from unload.logic import (analyze_template,
+                          analyze_templates,
+                          fix_unnecessary_loads,
+                          get_engine_templates,
+                          list_dead_templatetags,
+                          list_library_usage,
+                          list_unnecessary_loads,
+                          output_dead_templatetags,
+                          output_results,
+                          output_timings,
+                          process_template,
+                          profile_templates,
+                          rank_unnecessary_loads,
+                          worker_pool)
+from unload.timings import ScanTimings
+from unload.traffic import RenderCounts
+from unload.utils import get_app, get_djangotemplates_engines, get_package_trie
 
 
 class TestLogic(TestCase):
@@ -64,6 +84,55 @@ class TestLogic(TestCase):
         status = process_template(without_tags, dt_engines[0].engine)
         self.assertTrue(status)
 
+    def test_analyze_template_source(self):
+        engine = get_djangotemplates_engines()[0].engine
+        # The contents are not read from the file if they are passed
+        result = analyze_template(
+            os.path.join(settings.TEMPLATES[0]['DIRS'][0], 'missing.html'),
+            engine, source='{% load app_tags %}\n{% load app_tags %}')
+        self.assertTrue(result.has_issues)
+        self.assertEqual({'app_tags': [1, 2]}, result.loaded_modules)
+
+    def test_analyze_template_compile_error(self):
+        engine = get_djangotemplates_engines()[0].engine
+        # The template cannot be compiled, since app_tags is not loaded; it
+        # is analyzed without compiling it
+        result = analyze_template(
+            os.path.join(settings.TEMPLATES[0]['DIRS'][0], 'missing.html'),
+            engine, source='{% load i18n %}\n{{ 2|plus:1 }}')
+        self.assertIn('plus', result.compile_error)
+        self.assertEqual({'plus': frozenset(['app_tags'])},
+                         result.missing_loads)
+        self.assertEqual({'i18n': False}, result.utilized_modules)
+        self.assertTrue(result.has_issues)
+
+    def test_list_unnecessary_loads_compile_error(self):
+        directory = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory)
+        filepath = os.path.join(directory, 'missing.html')
+        with open(filepath, 'w') as fp:
+            fp.write('{% load i18n %}\n{{ 2|plus:1 }}')
+        templates = override_settings(TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'DIRS': [directory],
+            'APP_DIRS': False,
+            'OPTIONS': {},
+        }])
+        with templates:
+            # The scan is not aborted by the template
+            output = StringIO()
+            self.assertTrue(list_unnecessary_loads(output=output))
+            self.assertIn('Unable to compile the template: ',
+                          output.getvalue())
+            self.assertIn('plus', output.getvalue())
+            # The fix cannot be compiled either, so the file is kept
+            output = StringIO()
+            fix_unnecessary_loads(output=output)
+            self.assertIn('Unable to fix {}: '.format(filepath),
+                          output.getvalue())
+        with open(filepath) as fp:
+            self.assertEqual('{% load i18n %}\n{{ 2|plus:1 }}', fp.read())
+
     def test_list_unnecessary_loads(self):
         status = list_unnecessary_loads()
         self.assertTrue(status)
@@ -76,3 +145,257 @@ class TestLogic(TestCase):
 
         status = list_unnecessary_loads('clean')
         self.assertFalse(status)
+
+    def test_list_unnecessary_loads_lex_only(self):
+        status = list_unnecessary_loads(lex_only=True)
+        self.assertTrue(status)
+
+        status = list_unnecessary_loads('clean', lex_only=True)
+        self.assertFalse(status)
+
+    def test_list_unnecessary_loads_jobs(self):
+        status = list_unnecessary_loads(jobs=2)
+        self.assertTrue(status)
+
+        status = list_unnecessary_loads('clean', jobs=2)
+        self.assertFalse(status)
+
+    def test_list_unnecessary_loads_json_lines(self):
+        output = StringIO()
+        status = list_unnecessary_loads('app', output_format='jsonl',
+                                        output=output)
+        self.assertTrue(status)
+        records = [json.loads(line)
+                   for line in output.getvalue().splitlines()]
+        self.assertTrue(records)
+        self.assertTrue(any(record['has_issues'] for record in records))
+        for record in records:
+            self.assertTrue(record['template'].endswith('.html'))
+
+        output = StringIO()
+        status = list_unnecessary_loads('app', output_format='json',
+                                        output=output)
+        self.assertTrue(status)
+        self.assertEqual(records, json.loads(output.getvalue()))
+
+        output = StringIO()
+        status = list_unnecessary_loads('clean', output_format='json',
+                                        output=output)
+        self.assertFalse(status)
+        for record in json.loads(output.getvalue()):
+            self.assertFalse(record['has_issues'])
+
+    def test_list_unnecessary_loads_render_counts(self):
+        render_counts = RenderCounts({
+            'app/templates/double_loads.html': 1,
+            'app/templates/without_tags.html': 10})
+        output = StringIO()
+        status = list_unnecessary_loads('app', output_format='json',
+                                        output=output,
+                                        render_counts=render_counts)
+        self.assertTrue(status)
+        records = json.loads(output.getvalue())
+        self.assertTrue(records[0]['template'].endswith('without_tags.html'))
+        self.assertEqual(10, records[0]['renders'])
+        self.assertTrue(records[1]['template'].endswith('double_loads.html'))
+        wasted = [record['wasted_loads'] for record in records]
+        self.assertEqual(sorted(wasted, reverse=True), wasted)
+
+        output = StringIO()
+        list_unnecessary_loads('app', output=output,
+                               render_counts=render_counts)
+        self.assertIn('Renders: 10; wasted loads: ', output.getvalue())
+
+    def test_list_unnecessary_loads_timings(self):
+        for jobs in (1, 2):
+            timings = ScanTimings()
+            status = list_unnecessary_loads('app', jobs=jobs,
+                                            output=StringIO(),
+                                            timings=timings)
+            self.assertTrue(status)
+            summary = timings.get_summary()
+            self.assertEqual(8, summary['templates'])
+            self.assertTrue(summary['templates_per_second'])
+            for phase in ('read', 'compile', 'lex', 'libraries', 'analysis'):
+                self.assertEqual(8, len(timings.template_durations[phase]))
+                self.assertIsNotNone(summary['phases'][phase]['p50'])
+            self.assertGreater(summary['phases']['output']['total_ms'], 0)
+
+        # Lexing only
+        timings = ScanTimings()
+        list_unnecessary_loads('app', lex_only=True, output=StringIO(),
+                               timings=timings)
+        self.assertEqual([], timings.template_durations['compile'])
+
+        output = StringIO()
+        output_timings(timings, output=output)
+        self.assertIn('| Library resolution ', output.getvalue())
+        self.assertIn('Templates: 8; elapsed: ', output.getvalue())
+        output = StringIO()
+        output_timings(timings, output=output, output_format='jsonl')
+        self.assertEqual(8, json.loads(output.getvalue())['templates'])
+
+    def test_list_unnecessary_loads_timer(self):
+        # The scan's timer measures every phase of a serial scan; a timer
+        # advancing by a second on every call
+        ticks = count()
+        timings = ScanTimings(timer=lambda: next(ticks))
+        list_unnecessary_loads('app', output=StringIO(), timings=timings)
+        timings.stop()
+        for phase, total in timings.totals.items():
+            self.assertEqual(int(total), total)
+        self.assertEqual(8, len(timings.template_durations['read']))
+        for seconds in timings.template_durations['read']:
+            self.assertEqual(1, seconds)
+        self.assertEqual(next(ticks) - 1, timings.elapsed)
+
+    def test_list_unnecessary_loads_trace(self):
+        timings = ScanTimings(trace=True)
+        list_unnecessary_loads('app', jobs=2, output=StringIO(),
+                               timings=timings)
+        events = timings.get_trace_events()
+        spans = [event for event in events if event['ph'] == 'X']
+        # The templates are analyzed in the worker processes
+        analyzed = [span for span in spans if span['cat'] == 'analyze']
+        self.assertEqual(8, len(analyzed))
+        self.assertNotIn(os.getpid(), [span['pid'] for span in analyzed])
+        self.assertEqual(
+            {'discovery', 'read', 'compile', 'lex', 'libraries', 'analysis',
+             'analyze', 'output'},
+            set(span['cat'] for span in spans))
+        self.assertEqual(
+            set(span['pid'] for span in spans),
+            set(event['pid'] for event in events if event['ph'] == 'M'))
+
+    def test_rank_unnecessary_loads(self):
+        output = StringIO()
+        records = rank_unnecessary_loads('app', repeat=1, output=output)
+        # A record per unnecessary load of the 4 templates
+        self.assertEqual(8, len(records))
+        self.assertEqual(4, len(set(record['template']
+                                    for record in records)))
+        wasted = [record['wasted_ms'] for record in records]
+        self.assertEqual(sorted(wasted, reverse=True), wasted)
+        self.assertIn('Wasted (ms)', output.getvalue())
+
+        output = StringIO()
+        render_counts = RenderCounts({'app/templates/double_loads.html': 10})
+        records = rank_unnecessary_loads('app', repeat=1, output=output,
+                                         render_counts=render_counts)
+        # The wasted time of a single load may be negative (noise)
+        total_wasted = [record['total_wasted_ms'] for record in records]
+        self.assertEqual(sorted(total_wasted, reverse=True), total_wasted)
+        for record in records:
+            if record['template'].endswith('double_loads.html'):
+                self.assertEqual(10, record['renders'])
+                self.assertAlmostEqual(record['wasted_ms'] * 10,
+                                       record['total_wasted_ms'])
+            else:
+                self.assertEqual(0, record['renders'])
+                self.assertEqual(0, record['total_wasted_ms'])
+        self.assertIn('Total wasted (ms)', output.getvalue())
+
+        output = StringIO()
+        records = rank_unnecessary_loads('clean', repeat=1,
+                                         output_format='json', output=output)
+        self.assertEqual([], records)
+        self.assertEqual([], json.loads(output.getvalue()))
+
+    def test_profile_templates(self):
+        output = StringIO()
+        records = profile_templates('app', top=2, output=output)
+        self.assertEqual(8, len(records))
+        durations = [record['compile_ms'] for record in records]
+        self.assertEqual(sorted(durations, reverse=True), durations)
+        self.assertIn('| Templates: 8 ', output.getvalue())
+        # Only the top templates are listed
+        self.assertEqual(2, output.getvalue().count('.html '))
+
+        output = StringIO()
+        records = profile_templates('app', output_format='json',
+                                    output=output)
+        summary = json.loads(output.getvalue())
+        self.assertEqual(8, summary['templates'])
+        self.assertEqual(records, summary['records'])
+        self.assertEqual(['max', 'p50', 'p90', 'p99'],
+                         sorted(summary['statistics']['compile_ms']))
+
+        output = StringIO()
+        profile_templates('app', output_format='jsonl', output=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(9, len(lines))
+        self.assertEqual(8, json.loads(lines[-1])['templates'])
+
+    def test_list_dead_templatetags(self):
+        output = StringIO()
+        self.assertFalse(list_dead_templatetags(output=output))
+        self.assertEqual('All templatetags libraries are used!\n',
+                         output.getvalue())
+
+        output = StringIO()
+        self.assertFalse(list_dead_templatetags(output_format='json',
+                                                jobs=2, output=output))
+        self.assertEqual([], json.loads(output.getvalue()))
+
+    def test_list_library_usage(self):
+        # app_tags is loaded by most templates, but used by fewer than half
+        output = StringIO()
+        self.assertEqual(0, list_library_usage(output=output))
+        self.assertIn('| app_tags  | No         | 8 (80%)     | 4 (40%)',
+                      output.getvalue())
+        self.assertNotIn('Add to builtins', output.getvalue())
+
+        output = StringIO()
+        self.assertEqual(0, list_library_usage(output_format='jsonl',
+                                               output=output))
+        record = json.loads(output.getvalue())
+        self.assertEqual('app_tags', record['library'])
+        self.assertEqual((8, 4), (record['loaded_by'], record['used_by']))
+        self.assertIsNone(record['recommendation'])
+
+    def test_output_dead_templatetags(self):
+        records = [{'library': 'app_tags', 'module': 'app.templatetags',
+                    'templates': 0, 'unused_tags': ['a', 'b'],
+                    'unused_filters': ['plus']}]
+        output = StringIO()
+        output_dead_templatetags(records, output=output)
+        self.assertIn('| app_tags  |', output.getvalue())
+        self.assertIn('| a, b ', output.getvalue())
+
+        output = StringIO()
+        output_dead_templatetags(records, output=output,
+                                 output_format='jsonl')
+        self.assertEqual(records, [json.loads(output.getvalue())])
+
+    def test_get_engine_templates_shard(self):
+        dt_engine = get_djangotemplates_engines()[0]
+        templates = get_engine_templates(dt_engine, get_package_trie())
+        shards = [get_engine_templates(dt_engine, get_package_trie(),
+                                       shard=(index, 3))
+                  for index in range(1, 4)]
+        self.assertEqual(sorted(templates), sorted(sum(shards, [])))
+        self.assertEqual(len(templates), len(set(sum(shards, []))))
+
+        statuses = [list_unnecessary_loads(shard=(index, 3))
+                    for index in range(1, 4)]
+        self.assertTrue(any(statuses))
+
+    def test_analyze_templates_in_workers(self):
+        """
+        The workers' results are equal to the results of a serial analysis
+        and are returned in the same order.
+        """
+        dt_engine = get_djangotemplates_engines()[0]
+        templates = get_engine_templates(dt_engine, get_package_trie())
+        serial = list(analyze_templates(templates, 0, dt_engine.engine))
+        with worker_pool(2) as pool:
+            parallel = list(analyze_templates(templates, 0, dt_engine.engine,
+                                              pool=pool))
+        self.assertEqual(templates, [result.name for result in serial])
+        self.assertEqual(templates, [result.name for result in parallel])
+
+        serial_output = StringIO()
+        parallel_output = StringIO()
+        self.assertTrue(output_results(serial, serial_output))
+        self.assertTrue(output_results(parallel, parallel_output))
+        self.assertEqual(serial_output.getvalue(), parallel_output.getvalue())
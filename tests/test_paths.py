@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from unload.paths import (ExtensionFilter,
+                          PathTrie,
+                          filter_files,
+                          split_path,
+                          walk_files)
+
+
+class TestPaths(TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.lib = os.path.join(self.root, 'venv', 'lib')
+        self.lib2 = os.path.join(self.root, 'venv', 'lib2')
+        os.makedirs(os.path.join(self.lib, 'site-packages'))
+        os.makedirs(self.lib2)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_split_path(self):
+        self.assertEqual(split_path(self.lib)[-2:], ['venv', 'lib'])
+        self.assertEqual(split_path(self.lib + os.sep),
+                         split_path(os.path.join(self.lib2, '..', 'lib')))
+
+    def test_contains(self):
+        trie = PathTrie([self.lib])
+        self.assertTrue(trie.contains(self.lib))
+        self.assertTrue(trie.contains(os.path.join(self.lib,
+                                                   'site-packages')))
+        self.assertFalse(trie.contains(self.lib2))
+        self.assertFalse(trie.contains(self.root))
+        self.assertFalse(PathTrie().contains(self.lib))
+
+    def test_contains_symlink(self):
+        link = os.path.join(self.root, 'link')
+        os.symlink(self.lib, link)
+        trie = PathTrie([self.lib])
+        self.assertTrue(trie.contains(os.path.join(link, 'site-packages')))
+        # Links are resolved when the paths are stored as well
+        trie = PathTrie([link])
+        self.assertTrue(trie.contains(self.lib))
+        self.assertFalse(trie.contains(self.lib2))
+
+    def test_extension_filter(self):
+        file_filter = ExtensionFilter(['.html', '.TXT', ''])
+        self.assertTrue(file_filter.accepts('index.html'))
+        self.assertTrue(file_filter.accepts('INDEX.HTML'))
+        self.assertTrue(file_filter.accepts('body.txt'))
+        self.assertTrue(file_filter.accepts('README'))
+        self.assertFalse(file_filter.accepts('app.py'))
+        self.assertFalse(ExtensionFilter(['.html']).accepts('README'))
+
+    def test_walk_files(self):
+        paths = [os.path.join(self.root, 'index.html'),
+                 os.path.join(self.root, 'module.py'),
+                 os.path.join(self.root, 'node_modules', 'pkg', 'pkg.html'),
+                 os.path.join(self.lib, 'site-packages', 'admin.html'),
+                 os.path.join(self.lib2, 'mail.email')]
+        for path in paths:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        file_filter = ExtensionFilter(['.html', '.email'])
+
+        files = walk_files(self.root, file_filter)
+        self.assertEqual(files, sorted([paths[0], paths[2], paths[3],
+                                        paths[4]]))
+
+        files = walk_files(self.root, file_filter,
+                           ignored_names=['node_modules'],
+                           exclude=PathTrie([self.lib]))
+        self.assertEqual(files, [paths[0], paths[4]])
+
+    def test_filter_files(self):
+        paths = [os.path.join(self.root, 'index.html'),
+                 os.path.join(self.root, 'module.py'),
+                 os.path.join(self.root, 'node_modules', 'pkg', 'pkg.html'),
+                 os.path.join(self.lib, 'site-packages', 'admin.html'),
+                 os.path.join(self.lib2, 'mail.email')]
+        for path in paths:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        file_filter = ExtensionFilter(['.html', '.email'])
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        filepaths = paths + [
+            # Relative, duplicate, missing and external files
+            os.path.relpath(paths[0]),
+            os.path.join(self.root, 'missing.html'),
+            os.path.join(outside, 'index.html')]
+
+        files = filter_files(self.root, filepaths, file_filter)
+        self.assertEqual(files, walk_files(self.root, file_filter))
+
+        files = filter_files(self.root, filepaths, file_filter,
+                             ignored_names=['node_modules'],
+                             exclude=PathTrie([self.lib]))
+        self.assertEqual(files, [paths[0], paths[4]])
+
+        files = filter_files(self.lib2, filepaths, file_filter)
+        self.assertEqual(files, [paths[4]])
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from itertools import count
+
+from django.template import TemplateSyntaxError
+from django.test import TestCase
+
+from unload.profiling import get_compile_statistics, profile_compile
+from unload.utils import get_djangotemplates_engines
+
+
+class TestProfiling(TestCase):
+
+    def setUp(self):
+        self.engine = get_djangotemplates_engines()[0].engine
+
+    def test_profile_compile(self):
+        source = ('{% extends "master.html" %}{% load app_tags %}'
+                  '{% block content %}{{ 1|plus:2 }}{% endblock %}')
+        # A timer advancing by a second on every call
+        ticks = count()
+        record = profile_compile(source, self.engine, name='template.html',
+                                 timer=lambda: next(ticks))
+        self.assertEqual('template.html', record['template'])
+        self.assertEqual(1000, record['lex_ms'])
+        self.assertEqual(1000, record['parse_ms'])
+        self.assertEqual(2000, record['compile_ms'])
+        self.assertEqual(5, record['tokens'])
+        # The extends and load nodes, the block and the variable within it
+        self.assertEqual(4, record['nodes'])
+
+        with self.assertRaises(TemplateSyntaxError):
+            profile_compile('{% load missing_tags %}', self.engine)
+
+    def test_get_compile_statistics(self):
+        records = [profile_compile('{{ a }}' * size, self.engine)
+                   for size in range(1, 11)]
+        statistics = get_compile_statistics(records, percents=(50, 100))
+        self.assertEqual(['lex_ms', 'parse_ms', 'compile_ms', 'tokens',
+                          'nodes'], list(statistics))
+        self.assertEqual([5, 10], statistics['tokens'])
+        self.assertEqual([5, 10], statistics['nodes'])
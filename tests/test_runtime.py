@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+
+import django
+from django.conf import settings
+from django.template import Context
+from django.template.engine import Engine
+from django.test import TestCase
+
+from unload import runtime
+from unload.runtime import RuntimeProfiler, iter_filter_expressions
+from unload.utils import get_app, get_contents
+
+WITH_TAGS = 'app/templates/with_tags.html'
+
+
+class TestRuntimeProfiler(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'profile-{pid}.json')
+        self.profiler = RuntimeProfiler(path=self.path, sample_rate=0.5)
+        # Replace the process-wide profiler used by the loader
+        self.default_profiler = runtime._runtime_profiler
+        runtime._runtime_profiler = self.profiler
+
+        options = {}
+        if django.VERSION >= (1, 9):
+            options['libraries'] = {
+                'app_tags': 'demo.app.templatetags.app_tags'}
+        self.app_templates = os.path.abspath(
+            os.path.join(get_app('app').path, 'templates'))
+        self.engine = Engine(
+            dirs=[settings.TEMPLATES[0]['DIRS'][0], self.app_templates],
+            loaders=[('unload.runtime.Loader',
+                      ['django.template.loaders.filesystem.Loader'])],
+            **options)
+
+    def tearDown(self):
+        runtime._runtime_profiler = self.default_profiler
+        shutil.rmtree(self.directory)
+
+    def test_loader(self):
+        template = self.engine.get_template(WITH_TAGS)
+        expected = template.render(Context({}))
+        for _ in range(4):
+            # The sampled renders produce the same output
+            self.assertEqual(expected, template.render(Context({})))
+
+        profile = self.profiler.get_profile()
+        name = os.path.join(self.app_templates, WITH_TAGS)
+        self.assertEqual(runtime.PROFILE_VERSION, profile['version'])
+        self.assertEqual(5, profile['renders'][name])
+        # Every second render of each template is sampled
+        self.assertEqual(2, profile['sampled_renders'][name])
+        self.assertEqual({'example_inclusion_tag': 2,
+                          'example_simple_tag': 4,
+                          'example_assignment_tag': 2},
+                         profile['tags'][name])
+        self.assertEqual({'plus': 2}, profile['filters'][name])
+        # The built-in tags and filters are not recorded
+        for counts in profile['tags'].values():
+            self.assertNotIn('block', counts)
+            self.assertNotIn('load', counts)
+
+        # The cached template is instrumented only once
+        self.assertIs(template, self.engine.get_template(WITH_TAGS))
+        template.render(Context({}))
+        self.assertEqual(6, self.profiler.get_profile()['renders'][name])
+
+    def test_instrument(self):
+        source = '{{ value|lower }}'
+        template = self.engine.from_string(source)
+        profiler = RuntimeProfiler(path=self.path, sample_rate=1)
+        # Django 1.8 does not store the source in the template
+        profiler.instrument(template, source=source, name='page.html')
+        self.assertEqual('value', template.render(Context({'value': 'VALUE'})))
+        profile = profiler.get_profile()
+        self.assertEqual({'page.html': 1}, profile['renders'])
+        self.assertEqual({'page.html': 1}, profile['sampled_renders'])
+        self.assertEqual({}, profile['filters'])
+
+        # Without a sample rate only the renders are counted
+        template = self.engine.from_string('{{ value|lower }}')
+        profiler = RuntimeProfiler(path=self.path, sample_rate=0)
+        profiler.instrument(template, name='page.html')
+        template.render(Context({}))
+        profile = profiler.get_profile()
+        self.assertEqual({'page.html': 1}, profile['renders'])
+        self.assertEqual({}, profile['sampled_renders'])
+
+    def test_flush(self):
+        template = self.engine.get_template(WITH_TAGS)
+        template.render(Context({}))
+        self.profiler.flush()
+        path = self.path.format(pid=os.getpid())
+        profile = json.loads(get_contents(path))
+        self.assertEqual(self.profiler.get_profile(), profile)
+
+        # The profile is written at most once per flush interval
+        self.profiler.flush_interval = 3600
+        for _ in range(4):
+            template.render(Context({}))
+        self.assertEqual(profile, json.loads(get_contents(path)))
+
+    def test_flush_unsampled(self):
+        # The flush interval is checked without sampling the renders
+        template = self.engine.from_string('{{ value|lower }}')
+        profiler = RuntimeProfiler(path=self.path, sample_rate=0,
+                                   flush_interval=0)
+        profiler.instrument(template, name='page.html')
+        path = self.path.format(pid=os.getpid())
+        for _ in range(runtime.FLUSH_CHECK_INTERVAL - 1):
+            template.render(Context({}))
+        self.assertFalse(os.path.exists(path))
+        template.render(Context({}))
+        profile = json.loads(get_contents(path))
+        self.assertEqual({'page.html': runtime.FLUSH_CHECK_INTERVAL},
+                         profile['renders'])
+
+    def test_iter_filter_expressions(self):
+        template = self.engine.from_string(
+            '{% if a|length > b|add:1 %}{{ c|lower }}{% endif %}')
+        # The variable within the if tag is a separate node
+        if_node = template.nodelist[0]
+        expressions = [expression
+                       for value in vars(if_node).values()
+                       for expression in iter_filter_expressions(value)]
+        self.assertEqual(['a|length', 'b|add:1'],
+                         sorted(expression.token
+                                for expression in expressions))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+from itertools import count
+
+from django.test import TestCase
+
+from unload.timings import (NULL_TIMER,
+                            PHASES,
+                            TEMPLATE_SPAN,
+                            PhaseRecorder,
+                            ScanTimings,
+                            time_phase)
+
+
+def get_recorder(name, durations, trace=False):
+    """
+    Create a recorder of a template's analysis lasting the given seconds.
+    """
+    recorder = PhaseRecorder(name, trace=trace)
+    for phase, seconds in durations.items():
+        recorder.add(phase, 0, seconds)
+
+    return recorder
+
+
+class TestTimings(TestCase):
+
+    def test_time_phase(self):
+        self.assertIs(NULL_TIMER, time_phase(None, 'read'))
+        with time_phase(None, 'read'):
+            pass
+
+        recorder = PhaseRecorder('page.html')
+        for _ in range(2):
+            with time_phase(recorder, 'read'):
+                pass
+        recorder.stop()
+        self.assertEqual(['read'], list(recorder.durations))
+        self.assertGreaterEqual(recorder.durations['read'], 0)
+        self.assertIsNone(recorder.spans)
+
+        recorder = PhaseRecorder('page.html', trace=True)
+        with time_phase(recorder, 'lex'):
+            pass
+        recorder.stop()
+        self.assertEqual([(os.getpid(), 'lex', 'page.html'),
+                          (os.getpid(), TEMPLATE_SPAN, 'page.html')],
+                         [(pid, phase, name)
+                          for pid, phase, start, end, name
+                          in recorder.spans])
+
+    def test_scan_timings(self):
+        # A timer advancing by a second on every call
+        ticks = count()
+        timings = ScanTimings(timer=lambda: next(ticks))
+        with time_phase(timings, 'discovery'):
+            pass
+        for seconds in range(1, 5):
+            timings.add_template(get_recorder(
+                'page.html', {'read': seconds, 'lex': 2 * seconds}))
+        # A cached result
+        timings.add_template()
+        timings.stop()
+
+        summary = timings.get_summary(percents=(50, 100))
+        self.assertEqual(5, summary['templates'])
+        self.assertEqual(3000, summary['elapsed_ms'])
+        self.assertEqual(5 / 3.0, summary['templates_per_second'])
+        self.assertEqual(list(PHASES), list(summary['phases']))
+        self.assertEqual({'total_ms': 1000, 'p50': None, 'p100': None},
+                         summary['phases']['discovery'])
+        self.assertEqual({'total_ms': 10000, 'p50': 2000, 'p100': 4000},
+                         summary['phases']['read'])
+        self.assertEqual({'total_ms': 20000, 'p50': 4000, 'p100': 8000},
+                         summary['phases']['lex'])
+        self.assertEqual([], timings.get_trace_events())
+
+    def test_get_trace_events(self):
+        ticks = count()
+        timings = ScanTimings(timer=lambda: next(ticks), trace=True)
+        with time_phase(timings, 'output', name='page.html'):
+            pass
+        recorder = get_recorder('page.html', {'read': 2}, trace=True)
+        # Measured by a worker process
+        recorder.spans = [(0, phase, start, end, name)
+                          for pid, phase, start, end, name in recorder.spans]
+        timings.add_template(recorder)
+
+        events = timings.get_trace_events()
+        self.assertEqual([('process_name', 'M', 0, {'name': 'worker 0'}),
+                          ('process_name', 'M', os.getpid(),
+                           {'name': 'main'})],
+                         [(event['name'], event['ph'], event['pid'],
+                           event['args']) for event in events[:2]])
+        output, read = events[2:]
+        self.assertEqual(('output', 'X', 1e6, 1e6, os.getpid()),
+                         (output['name'], output['ph'], output['ts'],
+                          output['dur'], output['pid']))
+        self.assertEqual(('read', 0, 2e6, {'template': 'page.html'}),
+                         (read['name'], read['pid'], read['dur'],
+                          read['args']))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from unload.impact import get_unnecessary_loads
+from unload.logic import analyze_template
+from unload.traffic import RenderCounts, parse_csv_counts, prioritize_results
+from unload.utils import get_app, get_djangotemplates_engines
+
+
+class TestRenderCounts(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, contents):
+        path = os.path.join(self.directory, name)
+        with io.open(path, 'w', encoding='UTF-8') as fp:
+            fp.write(contents)
+        return path
+
+    def test_get(self):
+        templates_dir = os.path.join(self.directory, 'templates')
+        filepath = os.path.join(templates_dir, 'app', 'page.html')
+        render_counts = RenderCounts({'app/page.html': 3, filepath: 5})
+        self.assertEqual(5, render_counts.get(filepath))
+
+        render_counts = RenderCounts({'app/page.html': 3})
+        self.assertEqual(0, render_counts.get(filepath))
+        self.assertEqual(3, render_counts.get(filepath, [templates_dir]))
+        # The template is not located in the directory
+        self.assertEqual(0, render_counts.get(
+            filepath, [os.path.join(self.directory, 'other')]))
+
+    def test_load(self):
+        paths = [
+            self.write('counts.json', '{"a.html": 2, "b.html": 1}'),
+            # A profile written by the runtime profiler
+            self.write('profile.json',
+                       '{"version": 1, "renders": {"a.html": 3}, '
+                       '"tags": {"a.html": {"example_simple_tag": 1}}}'),
+            self.write('counts.csv', 'template,renders\nb.html,4\n\n')
+        ]
+        render_counts = RenderCounts.from_files(paths)
+        self.assertEqual({'a.html': 5, 'b.html': 5}, render_counts.counts)
+
+        for contents in ('[1, 2]', '{"a.html": "many"}', '{"a.html": -1}'):
+            with self.assertRaises(ValueError):
+                RenderCounts().load(self.write('invalid.json', contents))
+
+    def test_parse_csv_counts(self):
+        self.assertEqual({'a,b.html': 3, 'c.html': 1},
+                         parse_csv_counts('"a,b.html",1\na,b.html,2\n'
+                                          'c.html, "1"'))
+        with self.assertRaises(ValueError):
+            parse_csv_counts('a.html,1\nb.html,many')
+
+    def test_prioritize_results(self):
+        app_path = os.path.join(get_app('app').path, 'templates')
+        engine = get_djangotemplates_engines()[0].engine
+        results = [analyze_template(os.path.join(app_path, 'app', 'templates',
+                                                 name), engine)
+                   for name in ('with_tags.html', 'double_loads.html',
+                                'without_tags.html')]
+        render_counts = RenderCounts({
+            'app/templates/with_tags.html': 100,
+            'app/templates/double_loads.html': 1,
+            'app/templates/without_tags.html': 10})
+
+        prioritized, weights = prioritize_results(results, render_counts,
+                                                  [app_path])
+        # Templates without unnecessary loads are listed last
+        self.assertEqual(['without_tags.html', 'double_loads.html',
+                          'with_tags.html'],
+                         [os.path.basename(result.name)
+                          for result in prioritized])
+        weight = weights[results[2].name]
+        self.assertEqual(10, weight['renders'])
+        self.assertEqual(10 * len(get_unnecessary_loads(results[2])),
+                         weight['wasted_loads'])
+        self.assertEqual({'renders': 100, 'wasted_loads': 0},
+                         dict(weights[results[0].name]))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+from unittest import skipIf
+
+import django
+from django.template.engine import Engine
+from django.test import TestCase
+
+from unload.logic import analyze_template
+from unload.paths import PathTrie
+from unload.usage import LibraryUsage
+from unload.utils import (get_app,
+                          get_djangotemplates_engines,
+                          get_package_locations)
+
+
+class TestLibraryUsage(TestCase):
+
+    def setUp(self):
+        self.engine = get_djangotemplates_engines()[0].engine
+        app = get_app('app')
+        self.templates = os.path.join(app.path, 'templates', 'app',
+                                      'templates')
+        self.usage = LibraryUsage()
+
+    def add(self, name):
+        filepath = os.path.join(self.templates, name)
+        self.usage.add(analyze_template(filepath, self.engine))
+
+    def test_add(self):
+        self.add('only_filter.html')
+        self.add('with_tags.html')
+        self.assertEqual(2, self.usage.templates)
+        self.assertEqual({'app_tags': 2}, self.usage.libraries)
+        self.assertEqual({'app_tags': {'plus': 2}}, self.usage.filters)
+        self.assertEqual(1, self.usage.tags['app_tags']['example_simple_tag'])
+
+        # Loaded, but not used
+        self.add('without_tags.html')
+        self.assertEqual(3, self.usage.templates)
+        self.assertEqual({'app_tags': 2}, self.usage.libraries)
+
+    def test_get_project_libraries(self):
+        libraries = self.usage.get_project_libraries()
+        self.assertIn('app_tags', libraries)
+        # Django's libraries are located in an installed package
+        self.assertNotIn('i18n', libraries)
+
+        app = get_app('app')
+        pkg_locations = PathTrie(list(get_package_locations()) + [app.path])
+        self.assertEqual([], self.usage.get_project_libraries(pkg_locations))
+
+    def test_get_dead_templatetags(self):
+        records = self.usage.get_dead_templatetags()
+        self.assertEqual(['app_tags'],
+                         [record['library'] for record in records])
+        self.assertEqual(0, records[0]['templates'])
+        self.assertEqual(['plus'], records[0]['unused_filters'])
+
+        self.add('only_filter.html')
+        records = self.usage.get_dead_templatetags()
+        self.assertEqual(1, records[0]['templates'])
+        self.assertEqual(['example_assignment_tag', 'example_inclusion_tag',
+                          'example_simple_tag'], records[0]['unused_tags'])
+        self.assertEqual([], records[0]['unused_filters'])
+
+        self.add('with_tags.html')
+        self.assertEqual([], self.usage.get_dead_templatetags())
+
+    def test_add_loads(self):
+        self.add('only_filter.html')
+        self.add('without_tags.html')
+        self.add('double_loads.html')
+        self.assertEqual({'app_tags': 3}, self.usage.loads)
+        self.assertEqual({'app_tags': 1}, self.usage.libraries)
+
+    @skipIf(django.VERSION < (1, 9), 'The builtins option requires 1.9+')
+    def test_add_builtins(self):
+        self.usage.add_builtins(self.engine)
+        self.assertEqual(set(), self.usage.builtins)
+        self.assertIn('if', self.usage.builtin_members)
+
+        engine = Engine(builtins=['demo.app.templatetags.app_tags'])
+        self.usage.add_builtins(engine)
+        self.assertEqual(set(['app_tags']), self.usage.builtins)
+        self.assertIn('plus', self.usage.builtin_members)
+
+    def test_get_recommendation(self):
+        self.assertIsNone(self.usage.get_recommendation('app_tags'))
+
+        self.usage.add_builtins(self.engine)
+        self.add('only_filter.html')
+        self.add('without_tags.html')
+        self.assertEqual('promote', self.usage.get_recommendation('app_tags'))
+        self.assertIsNone(self.usage.get_recommendation(
+            'app_tags', promote_threshold=1.5))
+
+        # Loaded by every template, but used by only a third of them
+        self.add('double_loads.html')
+        self.assertEqual(3, self.usage.loads['app_tags'])
+        self.assertIsNone(self.usage.get_recommendation('app_tags'))
+        self.assertEqual('promote', self.usage.get_recommendation(
+            'app_tags', promote_threshold=0.3))
+
+        # Would replace a built-in filter
+        self.usage.builtin_members.add('plus')
+        self.assertIsNone(self.usage.get_recommendation('app_tags'))
+
+        self.usage.builtins.add('app_tags')
+        self.assertIsNone(self.usage.get_recommendation('app_tags'))
+        self.assertEqual('demote', self.usage.get_recommendation(
+            'app_tags', demote_threshold=0.4))
+
+    def test_get_usage_report(self):
+        self.assertEqual([], self.usage.get_usage_report())
+
+        self.add('only_filter.html')
+        self.add('without_tags.html')
+        self.usage.builtins.add('i18n')
+        records = self.usage.get_usage_report()
+        self.assertEqual(['app_tags', 'i18n'],
+                         [record['library'] for record in records])
+        self.assertEqual(2, records[0]['loaded_by'])
+        self.assertEqual(1, records[0]['used_by'])
+        self.assertEqual('promote', records[0]['recommendation'])
+        self.assertTrue(records[1]['builtin'])
+        self.assertEqual('demote', records[1]['recommendation'])
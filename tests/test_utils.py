@@ -2,8 +2,13 @@
 
 from __future__ import unicode_literals
 
+import io
+import json
 import os
+import shutil
+import subprocess
 import sys
+import tempfile
 
 from django.apps.config import AppConfig
 from django.conf import settings
@@ -11,18 +16,28 @@ from django.test import TestCase
 from django.test.utils import override_settings
 from django.utils.six import StringIO
 
+from unload.paths import PathTrie
 from unload.utils import (get_app,
+                          get_changed_files,
                           get_contents,
                           get_djangotemplates_engines,
                           get_filters,
                           get_package_locations,
+                          get_package_trie,
+                          get_percentiles,
+                          get_shard_index,
                           get_template_files,
                           get_templates,
                           get_templatetag_members,
+                          output_as_json,
+                          output_as_json_line,
                           output_as_table,
+                          output_cache_statistics,
                           output_message,
                           output_template_name,
-                          update_dictionary)
+                          parse_shard,
+                          update_dictionary,
+                          write_atomic)
 
 PYTHON_VERSION = sys.version_info
 
@@ -74,9 +89,85 @@ class TestUtils(TestCase):
         self.assertIn(os.path.join(app_path, 'app', 'templates',
                                    'without_tags.html'), templates)
         # Test external directory
-        templates = get_templates(pkg_locations[0], pkg_locations)
+        templates = get_templates(sorted(pkg_locations)[0], pkg_locations)
         self.assertEqual(templates, [])
 
+    def test_get_templates_filepaths(self):
+        templates_dir = settings.TEMPLATES[0]['DIRS'][0]
+        master_template = os.path.join(templates_dir, 'master.html')
+        pkg_locations = get_package_locations()
+        app = get_app('app')
+        app_path = os.path.join(app.path, 'templates')
+        with_tags = os.path.join(app_path, 'app', 'templates',
+                                 'with_tags.html')
+        filepaths = [master_template, with_tags]
+
+        templates = get_templates(templates_dir, pkg_locations,
+                                  filepaths=filepaths)
+        self.assertEqual(templates, [master_template])
+        templates = get_templates(app_path, pkg_locations, app,
+                                  filepaths=filepaths)
+        self.assertEqual(templates, [with_tags])
+        templates = get_templates(templates_dir, pkg_locations, app,
+                                  filepaths=filepaths)
+        self.assertEqual(templates, [])
+        templates = get_templates(app_path, pkg_locations, filepaths=[])
+        self.assertEqual(templates, [])
+
+    def test_parse_shard(self):
+        self.assertEqual((1, 4), parse_shard('1/4'))
+        self.assertEqual((4, 4), parse_shard('4/4'))
+        for value in ('', '1', '1/', '/4', 'a/4', '0/4', '5/4', '-1/4'):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+
+    def test_get_shard_index(self):
+        first_root = os.path.join(os.sep, 'builds', 'first')
+        second_root = os.path.join(os.sep, 'home', 'ci', 'second')
+        relative_path = os.path.join('templates', 'app', 'index.html')
+        index = get_shard_index(os.path.join(first_root, relative_path), 8,
+                                root=first_root)
+        self.assertTrue(1 <= index <= 8)
+        self.assertEqual(index, get_shard_index(
+            os.path.join(second_root, relative_path), 8, root=second_root))
+        self.assertEqual(1, get_shard_index(relative_path, 1))
+
+        indexes = set(get_shard_index('template{}.html'.format(number), 4)
+                      for number in range(100))
+        self.assertEqual(set([1, 2, 3, 4]), indexes)
+
+    def test_get_changed_files(self):
+        directory = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory)
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(directory)
+
+        def git(*args):
+            subprocess.check_call(
+                ('git', '-c', 'user.name=unload',
+                 '-c', 'user.email=unload@example.com') + args,
+                stdout=open(os.devnull, 'w'))
+
+        for name in ('committed.html', 'modified.html', 'deleted.html'):
+            with open(name, 'w') as fp:
+                fp.write(name)
+        git('init', '-q')
+        git('add', '.')
+        git('commit', '-q', '-m', 'Initial commit')
+        os.mkdir('new')
+        for name in ('modified.html', os.path.join('new', 'untracked.html')):
+            with open(name, 'w') as fp:
+                fp.write('{% load app_tags %}')
+        os.remove('deleted.html')
+        os.chdir('new')
+
+        self.assertEqual(get_changed_files('HEAD'),
+                         [os.path.join(directory, 'modified.html'),
+                          os.path.join(directory, 'new', 'untracked.html')])
+        with self.assertRaises(subprocess.CalledProcessError):
+            get_changed_files('unknown-revision')
+
     def test_get_contents(self):
         """
         Test the get_contents function on the master.html template. Avoid
@@ -123,8 +214,43 @@ class TestUtils(TestCase):
         end_of_path = ('/lib/python{0}.{1}/site-packages').format(
             PYTHON_VERSION.major, PYTHON_VERSION.minor)
         pkg_locations = get_package_locations()
+        self.assertIsInstance(pkg_locations, frozenset)
+        self.assertTrue(pkg_locations)
         for location in pkg_locations:
             self.assertTrue(location.endswith(end_of_path))
+        # The locations are computed once per process
+        self.assertIs(pkg_locations, get_package_locations())
+
+    def test_get_package_trie(self):
+        pkg_trie = get_package_trie()
+        self.assertIsInstance(pkg_trie, PathTrie)
+        self.assertIs(pkg_trie, get_package_trie())
+        for location in get_package_locations():
+            self.assertTrue(pkg_trie.contains(location))
+
+    def test_get_template_files_exclude(self):
+        """
+        Excluded subtrees (e.g. a virtualenv within the project) are pruned.
+        """
+        root = tempfile.mkdtemp()
+        try:
+            site_packages = os.path.join(root, 'venv', 'lib', 'site-packages')
+            os.makedirs(os.path.join(site_packages, 'pkg'))
+            os.makedirs(os.path.join(root, 'venv', 'lib2'))
+            for path in [os.path.join(root, 'index.html'),
+                         os.path.join(site_packages, 'pkg', 'pkg.html'),
+                         os.path.join(root, 'venv', 'lib2', 'lib2.html')]:
+                open(path, 'w').close()
+            template_files = get_template_files(
+                root, PathTrie([os.path.join(root, 'venv', 'lib')]))
+            self.assertEqual(sorted(template_files),
+                             [os.path.join(root, 'index.html'),
+                              os.path.join(root, 'venv', 'lib2',
+                                           'lib2.html')])
+            templates = get_templates(root, [site_packages])
+            self.assertEqual(2, len(templates))
+        finally:
+            shutil.rmtree(root)
 
     def test_get_template_files(self):
         """
@@ -135,6 +261,21 @@ class TestUtils(TestCase):
         template_files = get_template_files(templates_dir)
         self.assertIn(master_html, template_files)
 
+    def test_get_template_files_settings(self):
+        app_templates = os.path.join(get_app('app').path, 'templates')
+        extensionless = os.path.join(app_templates, 'app', 'templates',
+                                     'something')
+        self.assertNotIn(extensionless, get_template_files(app_templates))
+
+        with self.settings(UNLOAD_TEMPLATE_EXTENSIONS=['.html', '']):
+            template_files = get_template_files(app_templates)
+        self.assertEqual(9, len(template_files))
+        self.assertIn(extensionless, template_files)
+
+        with self.settings(UNLOAD_IGNORED_DIRECTORIES=['tags']):
+            template_files = get_template_files(app_templates)
+        self.assertEqual(7, len(template_files))
+
     def test_get_templatetag_members(self):
         output = StringIO()
         template_name = 'example.html'
@@ -199,6 +340,41 @@ class TestUtils(TestCase):
         self.assertEqual(output.getvalue().strip(),
                          'Your templates are clean!')
 
+    def test_output_as_json(self):
+        records = [{'template': 'a.html', 'lines': [1, 2]},
+                   {'template': 'b.html', 'lines': []}]
+        output = StringIO()
+        for record in records:
+            output_as_json_line(record, output=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual(records, [json.loads(line) for line in lines])
+
+        output = StringIO()
+        output_as_json(records, output=output)
+        self.assertEqual(records, json.loads(output.getvalue()))
+        for line in output.getvalue().splitlines():
+            self.assertEqual(line.rstrip(), line)
+
+    def test_output_cache_statistics(self):
+        output = StringIO()
+        output_cache_statistics(hits=3, misses=1, output=output)
+        self.assertEqual('Cache hits: 3; cache misses: 1',
+                         output.getvalue().strip())
+
+    def test_write_atomic(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filepath = os.path.join(directory, 'template.html')
+
+        write_atomic(filepath, '{% load app_tags %}\n')
+        os.chmod(filepath, 0o640)
+        write_atomic(filepath, '{% load app_tags %}\r\nčć')
+        with io.open(filepath, encoding='UTF-8', newline='') as fp:
+            self.assertEqual('{% load app_tags %}\r\nčć', fp.read())
+        self.assertEqual(0o640, os.stat(filepath).st_mode & 0o777)
+        self.assertEqual(['template.html'], os.listdir(directory))
+
     def test_update_dictionary(self):
         dictionary = {}
         # Add new data
@@ -219,3 +395,11 @@ class TestUtils(TestCase):
         self.assertIn('module', dictionary.keys())
         self.assertEqual(1, len(dictionary.keys()))
         self.assertEqual([1, 2], dictionary.get('module'))
+
+    def test_get_percentiles(self):
+        self.assertEqual([None, None], get_percentiles([], (50, 100)))
+        self.assertEqual([7, 7, 7], get_percentiles([7]))
+        values = list(range(100, 0, -1))
+        self.assertEqual([50, 90, 99], get_percentiles(values))
+        self.assertEqual([1, 100], get_percentiles(values, (0, 100)))
+        self.assertEqual([2, 3], get_percentiles([1, 2, 3], (50, 90)))
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from unload.utils import get_modification_stamp, get_module_file
+from unload.watch import TemplateWatcher, watch_templates
+
+
+class TestWatch(TestCase):
+
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.with_tags = os.path.join(self.directory, 'with_tags.html')
+        self.without_tags = os.path.join(self.directory, 'without_tags.html')
+        self.write(self.with_tags, '{% load app_tags %}{{ 1|plus:2 }}')
+        self.write(self.without_tags, '{% load i18n %}')
+        settings = override_settings(TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'DIRS': [self.directory],
+            'APP_DIRS': False,
+            'OPTIONS': {},
+        }])
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, filepath, source):
+        with open(filepath, 'w') as fp:
+            fp.write(source)
+
+    def test_get_modification_stamp(self):
+        stamp = get_modification_stamp(self.with_tags)
+        self.assertEqual(stamp[1], os.path.getsize(self.with_tags))
+        self.write(self.with_tags, '{% load app_tags %}')
+        self.assertNotEqual(stamp, get_modification_stamp(self.with_tags))
+        self.assertIsNone(get_modification_stamp(
+            os.path.join(self.directory, 'missing.html')))
+
+    def test_get_module_file(self):
+        self.assertEqual(get_module_file(os), os.__file__.rstrip('co'))
+        self.assertIsNone(get_module_file(None))
+
+    def test_poll(self):
+        watcher = TemplateWatcher(output=StringIO())
+        results = watcher.poll()
+        self.assertEqual([self.with_tags, self.without_tags],
+                         [result.name for result in results])
+        self.assertTrue(watcher.has_issues)
+        self.assertEqual([], watcher.poll())
+
+        # Modified template
+        self.write(self.without_tags, 'Text')
+        results = watcher.poll()
+        self.assertEqual([self.without_tags],
+                         [result.name for result in results])
+        self.assertFalse(watcher.has_issues)
+
+        # New and deleted templates
+        new_template = os.path.join(self.directory, 'new.html')
+        self.write(new_template, '{% load i18n %}')
+        os.remove(self.without_tags)
+        results = watcher.poll()
+        self.assertEqual([new_template], [result.name for result in results])
+        self.assertEqual(sorted([(0, self.with_tags), (0, new_template)]),
+                         sorted(watcher.results))
+        self.assertTrue(watcher.has_issues)
+
+    def test_poll_invalid_template(self):
+        output = StringIO()
+        watcher = TemplateWatcher(output=output)
+        watcher.poll()
+
+        # Saved in the middle of an edit; the template is analyzed without
+        # compiling it
+        self.write(self.with_tags, '{% load app_tags %}{% if 1 == %}'
+                   '{% endif %}')
+        results = watcher.poll()
+        self.assertEqual([self.with_tags], [result.name for result in results])
+        self.assertTrue(results[0].compile_error)
+        self.assertTrue(watcher.has_issues)
+        with open(self.without_tags, 'wb') as fp:
+            fp.write(b'{% load i18n %}\xff')
+        self.assertEqual([], watcher.poll())
+        self.assertIn('Unable to analyze {}: '.format(self.without_tags),
+                      output.getvalue())
+        # The error is reported once, but the template is analyzed again
+        self.assertEqual([], watcher.poll())
+        self.assertEqual(1, output.getvalue().count('Unable to analyze'))
+
+        self.write(self.with_tags, '{% load app_tags %}{{ 1|plus:2 }}')
+        self.write(self.without_tags, 'Text')
+        results = watcher.poll()
+        self.assertEqual([self.with_tags, self.without_tags],
+                         [result.name for result in results])
+        self.assertEqual({}, watcher.errors)
+        self.assertFalse(watcher.has_issues)
+
+    def test_poll_modified_library(self):
+        watcher = TemplateWatcher(output=StringIO())
+        watcher.poll()
+        filepath, stamp = watcher._library_stamps['app_tags']
+        self.assertTrue(filepath.endswith('app_tags.py'))
+
+        # Pretend that the module was modified
+        watcher._library_stamps['app_tags'] = (filepath, None)
+        results = watcher.poll()
+        self.assertEqual([self.with_tags], [result.name for result in results])
+        self.assertEqual((filepath, stamp),
+                         watcher._library_stamps['app_tags'])
+        self.assertEqual([], watcher.poll())
+
+    def test_watch_templates(self):
+        output = StringIO()
+        status = watch_templates(output_format='jsonl', output=output,
+                                 interval=0, polls=2)
+        self.assertTrue(status)
+        records = [json.loads(line)
+                   for line in output.getvalue().splitlines()]
+        self.assertEqual([self.with_tags, self.without_tags],
+                         [record['template'] for record in records])
+
+        output = StringIO()
+        status = watch_templates(output=output, filepaths=[self.with_tags],
+                                 interval=0, polls=1)
+        self.assertFalse(status)
+        self.assertEqual('Your templates are clean!',
+                         output.getvalue().strip())
@@ -2,50 +2,42 @@
 
 from __future__ import unicode_literals
 
+from collections import OrderedDict, namedtuple
+
 from django.template.base import Template as BaseTemplate
+from django.template.engine import Engine
+from django.utils.six import StringIO
 
-from .compat import get_lexer
+from .compat import TOKEN_BLOCK, TOKEN_VAR, get_lexer
+from .libraries import get_library_index
 from .settings import BUILT_IN_FILTERS, BUILT_IN_TAG_VALUES, BUILT_IN_TAGS
+from .timings import time_phase
 from .utils import get_filters, get_templatetag_members, update_dictionary
 
+# A single {% load %} block; members are empty unless the FROM syntax is used
+LoadBlock = namedtuple('LoadBlock', ['lineno', 'modules', 'members'])
 
-class Template(BaseTemplate):
-    """
-    An override of Django's Template class.
-
-    After calling the parent class, the template is analyzed for duplicates
-    and unnecessary loads.
 
-    Additional attributes:
-    :tokens: a list of tokens found in the template
-    :loaded_modules: a dictionary of loaded modules
-    :loaded_members: a dictionary of loaded tags/filters
-    :used_tags: a list of custom tags used in the template
-    :used_filters: a list of custom filters used in the template
-    :tags: a dictionary of custom tags loaded into the template
-    :filters: a dictionary of custom filters loaded into the template
-    :utilized_modules: a dictionary of utilization statuses
-    :utilized_members: a dictionary of utilization statuses
+class TemplateReportMixin(object):
     """
+    Lists the issues found in the template.
 
-    def __init__(self, template_string, origin=None, name=None, engine=None):
-        super(Template, self).__init__(template_string, origin, name, engine)
-
-        # Used for backwards compatibility (implemented in Django 1.9)
-        if not hasattr(self, 'source'):
-            self.source = template_string
+    The class using the mixin must provide the following attributes:
+    loaded_modules, loaded_members, usage_lines, utilized_modules,
+    utilized_members, missing_loads and compile_error (get_report also uses
+    name and messages).
+    """
 
-        self.tokens = self._get_tokens()
-        # The manually specified (loaded) modules and members (tags/filters)
-        self.loaded_modules, self.loaded_members = self._parse_load_block()
-        self.used_tags = self._get_used_tags()
-        self.used_filters = self._get_used_filters()
-        # Get the tags and filters available to this template
-        self.tags, self.filters = get_templatetag_members(
-            self.name, self.loaded_modules)
-        # Find utilized modules, tags and filters
-        self.utilized_modules = self._get_utilized_modules()
-        self.utilized_members = self._get_utilized_members()
+    @property
+    def has_issues(self):
+        """
+        Does the template have duplicate, unutilized or missing loads (or
+        can it not be compiled).
+        """
+        return bool(self.compile_error or
+                    self.list_duplicates()[0] or
+                    self.list_unutilized_items()[0] or
+                    self.list_missing_loads()[0])
 
     def list_duplicates(self):
         """
@@ -55,20 +47,23 @@ class Template(BaseTemplate):
         :returns: table (list of lists), header (list of header names)
         """
 
-        temp_table = {}
+        # Sorted for a deterministic order of rows and members
+        temp_table = OrderedDict()
         # Find duplicate library loads
-        for module in self.loaded_modules:
+        for module in sorted(self.loaded_modules):
             lines = self.loaded_modules[module]
             lines_str = ', '.join(map(str, lines))
             if len(lines) > 1 and lines_str not in temp_table.keys():
                 temp_table[lines_str] = [module, []]
 
         # Find duplicate member loads
-        for member in self.loaded_members:
+        for member in sorted(self.loaded_members):
             lines = self.loaded_members[member]
             lines_str = ', '.join(map(str, lines))
 
             if len(lines) > 1:
+                # The module can be loaded on other lines as well
+                temp_table.setdefault(lines_str, [None, []])
                 temp_table[lines_str][1].append(member)
 
         for key in temp_table:
@@ -96,13 +91,13 @@ class Template(BaseTemplate):
         members = []
         # List unutilized modules
         if self.utilized_modules:
-            for module in self.utilized_modules:
+            for module in sorted(self.utilized_modules):
                 if not self.utilized_modules[module]:
                     modules.append(module)
 
         # List unutilized tags/filters
         if self.utilized_members:
-            for member in self.utilized_members:
+            for member in sorted(self.utilized_members):
                 if not self.utilized_members[member]:
                     members.append(member)
 
@@ -118,6 +113,152 @@ class Template(BaseTemplate):
 
         return list(table), headers
 
+    def list_missing_loads(self):
+        """
+        List custom tags and filters that are used in the template, although
+        none of the libraries providing them are loaded.
+
+        Such templates raise a TemplateSyntaxError when they are rendered.
+
+        :returns: table (list of lists), header (list of header names)
+        """
+        table = []
+        for member in sorted(self.missing_loads):
+            libraries = ', '.join(sorted(self.missing_loads[member]))
+            lines = ', '.join(map(str, self.usage_lines[member]))
+            table.append([member, libraries, lines])
+
+        headers = ['Unloaded tag/filter', 'Provided by', 'Line number']
+
+        return table, headers
+
+    def get_report(self):
+        """
+        Get the issues found in the template as a JSON-serializable record.
+
+        Unlike the tables, the record lists every issue separately along
+        with its line numbers.
+
+        :returns: OrderedDict
+        """
+        report = OrderedDict()
+        report['template'] = self.name
+        report['has_issues'] = self.has_issues
+        report['messages'] = self.messages.splitlines()
+        report['compile_error'] = self.compile_error
+        report['duplicate_modules'] = [
+            OrderedDict([('module', module), ('lines', list(lines))])
+            for module, lines in sorted(self.loaded_modules.items())
+            if len(lines) > 1]
+        report['duplicate_members'] = [
+            OrderedDict([('member', member), ('lines', list(lines))])
+            for member, lines in sorted(self.loaded_members.items())
+            if len(lines) > 1]
+        report['unutilized_modules'] = [
+            OrderedDict([('module', module),
+                         ('lines', list(self.loaded_modules[module]))])
+            for module, utilized in sorted(self.utilized_modules.items())
+            if not utilized]
+        report['unutilized_members'] = [
+            OrderedDict([('member', member),
+                         ('lines', list(self.loaded_members[member]))])
+            for member, utilized in sorted(self.utilized_members.items())
+            if not utilized]
+        report['missing_loads'] = [
+            OrderedDict([('member', member),
+                         ('libraries', sorted(libraries)),
+                         ('lines', list(self.usage_lines[member]))])
+            for member, libraries in sorted(self.missing_loads.items())]
+
+        return report
+
+
+class TemplateAnalysisMixin(TemplateReportMixin):
+    """
+    Analyzes the template's source for duplicates and unnecessary loads.
+
+    The class using the mixin must provide the following attributes before
+    calling `_analyze`: source, origin, name, engine, library_index and
+    timings (the PhaseRecorder object measuring the analysis or None).
+
+    Additional attributes:
+    :tokens: a list of tokens found in the template
+    :loaded_modules: a dictionary of loaded modules
+    :loaded_members: a dictionary of loaded tags/filters
+    :used_tags: a list of custom tags used in the template
+    :used_filters: a list of custom filters used in the template
+    :load_blocks: a list of LoadBlock tuples (in order of appearance)
+    :usage_lines: a dictionary of line numbers of used custom tags/filters
+    :tags: a dictionary of custom tags loaded into the template
+    :filters: a dictionary of custom filters loaded into the template
+    :utilized_modules: a dictionary of utilization statuses
+    :utilized_members: a dictionary of utilization statuses
+    :missing_loads: a dictionary of used tags/filters whose libraries are
+        not loaded (and the names of those libraries)
+    :messages: String; warnings issued during the analysis (e.g. libraries
+        that cannot be located)
+    :compile_error: String; the error raised when the template was compiled
+        (the template is then analyzed without compiling it) or None
+    """
+
+    def _analyze(self):
+        """
+        Populate the additional attributes listed in the class docstring.
+        """
+        if self.library_index is None:
+            self.library_index = get_library_index()
+
+        with time_phase(self.timings, 'lex'):
+            self.tokens = self._get_tokens()
+        with time_phase(self.timings, 'analysis'):
+            # The manually specified (loaded) modules and members
+            # (tags/filters) and the custom tags and filters used in the
+            # template
+            self._classify_tokens()
+        # Get the tags and filters available to this template
+        messages = StringIO()
+        with time_phase(self.timings, 'libraries'):
+            self.tags, self.filters = get_templatetag_members(
+                self.name, self.loaded_modules, output=messages,
+                library_index=self.library_index)
+        self.messages = messages.getvalue()
+        with time_phase(self.timings, 'analysis'):
+            # Find utilized modules, tags and filters
+            self.utilized_modules = self._get_utilized_modules()
+            self.utilized_members = self._get_utilized_members()
+            # Find used tags and filters that are not loaded
+            self.missing_loads = self._get_missing_loads()
+
+    def _get_missing_loads(self):
+        """
+        Find used tags and filters whose libraries are never loaded.
+
+        Only the members of installed libraries are taken into account;
+        unknown names (e.g. 'end' tags of custom block tags) are ignored.
+
+        :returns: {'member_name': frozenset(libraries)}
+        """
+        tag_providers, filter_providers = self.library_index.get_providers()
+        builtin_members = self.library_index.get_builtin_members(self.engine)
+        # Libraries loaded without the FROM syntax provide all of their members
+        loaded_libraries = set()
+        for load_block in self.load_blocks:
+            if not load_block.members:
+                loaded_libraries.update(load_block.modules)
+
+        missing_loads = {}
+        used = [(tag_providers, self.used_tags),
+                (filter_providers, self.used_filters)]
+        for providers, used_members in used:
+            for member in used_members:
+                libraries = providers.get(member)
+                if (libraries and member not in self.loaded_members and
+                        member not in builtin_members and
+                        libraries.isdisjoint(loaded_libraries)):
+                    missing_loads[member] = libraries
+
+        return missing_loads
+
     def _get_utilized_members(self):
         """
         Separates the loaded tags based on their utilization.
@@ -138,25 +279,21 @@ class Template(BaseTemplate):
         """
         Separates the loaded modules based on their utilization.
 
+        Uses the library index's reverse index, i.e. a module is utilized if
+        it provides at least one of the used tags or filters.
+
         :returns: {'module_name': Boolean}
         """
-        utilized_modules = {}
+        tag_providers, filter_providers = self.library_index.get_providers()
+        providers = set()
+        for tag in set(self.used_tags):
+            providers.update(tag_providers.get(tag, ()))
+        for custom_filter in self.used_filters:
+            providers.update(filter_providers.get(custom_filter, ()))
 
+        utilized_modules = {}
         for module in self.loaded_modules:
-            utilized = False
-
-            for tag in self.used_tags:
-                if tag in self.tags[module]:
-                    utilized = True
-                    break
-
-            if not utilized and self.used_filters:
-                for custom_filter in self.used_filters:
-                    if custom_filter in self.filters[module]:
-                        utilized = True
-                        break
-
-            utilized_modules[module] = utilized
+            utilized_modules[module] = module in providers
 
         return utilized_modules
 
@@ -177,87 +314,231 @@ class Template(BaseTemplate):
 
         return lexer.tokenize()
 
-    def _parse_load_block(self):
+    def _classify_tokens(self):
         """
-        Get the names of loaded templatetags modules as well as individually
-        loaded tags and the line numbers they are located at.
+        Classify the template's tokens in a single pass.
 
-        :returns: {'module': [line_numbers]}, {'member': [line_numbers]}
+        Every block and variable token is split only once. Load blocks are
+        searched for loaded modules and members (and the line numbers they are
+        located at), the remaining blocks for custom tags and both block and
+        variable tokens for custom filters. The contents of comment blocks
+        are never rendered and therefore skipped.
+
+        Populates the loaded_modules ({'module': [line_numbers]}),
+        loaded_members ({'member': [line_numbers]}), used_tags, used_filters,
+        load_blocks and usage_lines attributes.
         """
+        self.loaded_modules = {}
+        self.loaded_members = {}
+        self.load_blocks = []
+        self.used_tags = []
+        self.used_filters = []
+        self.usage_lines = {}
+        # Preserves the order of the used filters while avoiding list lookups
+        seen_filters = set()
+
+        for token in self._iter_rendered_tokens():
+            # Tag token
+            if token.token_type == TOKEN_BLOCK:
+                token_content = token.split_contents()
+                if not token_content:
+                    continue
+                tag_name = token_content[0]
+                if tag_name == 'load':
+                    self._parse_load_block(token, token_content)
+                # Extract blocks that do not contain one of the built-in tags
+                elif (tag_name not in BUILT_IN_TAGS and
+                        # Skip built-in 'end' tags
+                        tag_name not in BUILT_IN_TAG_VALUES):
+                    # Extract only the name of the template tag (ignore
+                    # arguments)
+                    self.used_tags.append(tag_name)
+                    update_dictionary(self.usage_lines, tag_name,
+                                      token.lineno)
+            # Variable token (only the variable itself can contain filters)
+            elif token.token_type == TOKEN_VAR and '|' in token.contents:
+                token_content = token.split_contents()[:1]
+            else:
+                continue
 
-        modules = {}
-        members = {}
+            # Exclude built-in filters
+            for filter_name in self._get_token_filters(token_content):
+                if filter_name not in BUILT_IN_FILTERS:
+                    update_dictionary(self.usage_lines, filter_name,
+                                      token.lineno)
+                    if filter_name not in seen_filters:
+                        seen_filters.add(filter_name)
+                        self.used_filters.append(filter_name)
+
+    def _iter_rendered_tokens(self):
+        """
+        Iterate over the template's tokens, skipping the {% comment %} and
+        {% endcomment %} tags and everything between them (the way Django's
+        parser discards them).
 
+        :returns: a generator of Tokens
+        """
+        in_comment = False
         for token in self.tokens:
-            token_content = token.split_contents()
-            # Extract load blocks
-            if token.token_type == 2 and token_content[0] == 'load':
-                # FROM syntax is used; individual members are loaded
-                if len(token_content) >= 4 and token_content[-2] == 'from':
-                    # Add loaded module
-                    module = token_content[-1]
-                    modules = update_dictionary(modules, module, token.lineno)
-                    # Add loaded members
-                    loaded_members = token_content[1:-2]
-                    for member in loaded_members:
-                        members = update_dictionary(
-                            members, member, token.lineno)
-                # Regular syntax
-                else:
-                    # Multiple modules can be imported in the same load block
-                    templatetags_modules = token_content[1:]
-                    for module in templatetags_modules:
-                        modules = update_dictionary(
-                            modules, module, token.lineno)
-
-        return modules, members
-
-    def _get_used_tags(self):
-        """
-        Get the list of custom template tags used in the template.
-
-        :returns: a list of custom tag names
-        """
-        used_tags = []
-        for token in self.tokens:
-            token_content = token.split_contents()
-            # Extract blocks that do not contain one of the built-in tags
-            if (token.token_type == 2 and
-                    token_content[0] not in BUILT_IN_TAGS.keys() and
-                    # Skip built-in 'end' tags
-                    token_content[0] not in BUILT_IN_TAG_VALUES):
-                # Extract only the name of the template tag (ignore arguments)
-                used_tags.append(token_content[0])
+            if token.token_type != TOKEN_BLOCK:
+                if not in_comment:
+                    yield token
+            elif in_comment:
+                in_comment = token.contents != 'endcomment'
+            elif token.contents.split(None, 1)[:1] == ['comment']:
+                in_comment = True
+            else:
+                yield token
 
-        return used_tags
+    def _get_token_filters(self, token_content):
+        """
+        Get the names of filters used in the split contents of a token.
 
-    def _get_used_filters(self):
+        :token_content: a list of strings (the split contents of the token)
+        :returns: a list of filter names
         """
-        Get the list of custom filters used in the template.
+        filters = []
+        for item in token_content:
+            if '|' in item:
+                filters += get_filters(item)
+
+        return filters
 
-        :returns: a list of custom filter names
+    def _parse_load_block(self, token, token_content):
         """
-        used_filters = []
+        Add the names of templatetags modules and individually loaded tags
+        from the load block to the loaded_modules and loaded_members
+        dictionaries, along with the line number the block is located at.
 
-        for token in self.tokens:
-            filters = []
-            token_content = token.split_contents()
+        :token: the load block's Token
+        :token_content: a list of strings (the split contents of the token)
+        """
+        # FROM syntax is used; individual members are loaded
+        if len(token_content) >= 4 and token_content[-2] == 'from':
+            modules = token_content[-1:]
+            members = token_content[1:-2]
+        # Regular syntax; multiple modules can be loaded in the same block
+        else:
+            modules = token_content[1:]
+            members = []
 
-            # Variable token
-            if token.token_type == 1 and '|' in token_content[0]:
-                filters += get_filters(token_content[0])
+        for module in modules:
+            update_dictionary(self.loaded_modules, module, token.lineno)
+        for member in members:
+            update_dictionary(self.loaded_members, member, token.lineno)
+        self.load_blocks.append(LoadBlock(token.lineno, modules, members))
 
-            # Tag token
-            elif token.token_type == 2:
-                if '|' in ' '.join(token_content):
-                    for item in token_content:
-                        if '|' in item:
-                            filters += get_filters(item)
 
-            # Exclude built-in filters
-            for filter_name in filters:
-                if (filter_name not in BUILT_IN_FILTERS and
-                        filter_name not in used_filters):
-                    used_filters.append(filter_name)
+class Template(TemplateAnalysisMixin, BaseTemplate):
+    """
+    An override of Django's Template class.
+
+    After calling the parent class, the template is analyzed for duplicates
+    and unnecessary loads. Compiling the nodelist ensures that templates with
+    syntax errors or missing libraries raise a TemplateSyntaxError.
+    """
 
-        return used_filters
+    def __init__(self, template_string, origin=None, name=None, engine=None,
+                 library_index=None, timings=None):
+        with time_phase(timings, 'compile'):
+            super(Template, self).__init__(template_string, origin, name,
+                                           engine)
+        self.library_index = library_index
+        self.timings = timings
+        self.compile_error = None
+
+        # Used for backwards compatibility (implemented in Django 1.9)
+        if not hasattr(self, 'source'):
+            self.source = template_string
+
+        self._analyze()
+
+
+class LexedTemplate(TemplateAnalysisMixin):
+    """
+    The lexing-only counterpart of the Template class.
+
+    Produces the same analysis results without calling Django's Template
+    class, i.e. the nodelist is never compiled and the loaded libraries are
+    not imported by the parser. Syntax errors are not detected.
+    """
+
+    def __init__(self, template_string, origin=None, name=None, engine=None,
+                 library_index=None, timings=None):
+        if engine is None:
+            engine = Engine.get_default()
+        self.source = template_string
+        self.origin = origin
+        self.name = name
+        self.engine = engine
+        self.library_index = library_index
+        self.timings = timings
+        self.compile_error = None
+
+        self._analyze()
+
+
+class TemplateResult(TemplateReportMixin):
+    """
+    The analysis results of a single template.
+
+    Unlike templates, the results can be pickled (e.g. sent from worker
+    processes) and contain only the data needed for the reports.
+    """
+
+    # The PhaseRecorder object measuring the template's analysis (see
+    # unload.timings); not stored in the cache
+    timings = None
+
+    attributes = ('name', 'messages', 'loaded_modules', 'loaded_members',
+                  'load_blocks', 'used_tags', 'used_filters', 'usage_lines',
+                  'utilized_modules', 'utilized_members', 'missing_loads',
+                  'compile_error')
+
+    def __init__(self, **kwargs):
+        for attribute in self.attributes:
+            setattr(self, attribute, kwargs[attribute])
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create the results from a dictionary created by to_dict.
+
+        :data: dict object
+        :returns: TemplateResult
+        """
+        data = dict(data)
+        data['load_blocks'] = [LoadBlock(*load_block)
+                               for load_block in data['load_blocks']]
+        data['missing_loads'] = dict(
+            (member, frozenset(libraries))
+            for member, libraries in data['missing_loads'].items())
+
+        return cls(**data)
+
+    @classmethod
+    def from_template(cls, template):
+        """
+        Copy the results of the analyzed template.
+
+        :template: Template or LexedTemplate object
+        :returns: TemplateResult
+        """
+        return cls(**dict((attribute, getattr(template, attribute))
+                          for attribute in cls.attributes))
+
+    def to_dict(self):
+        """
+        Convert the results to a dictionary that can be serialized as JSON.
+
+        :returns: dict object
+        """
+        data = dict((attribute, getattr(self, attribute))
+                    for attribute in self.attributes)
+        data['load_blocks'] = [list(load_block)
+                               for load_block in self.load_blocks]
+        data['missing_loads'] = dict(
+            (member, sorted(libraries))
+            for member, libraries in self.missing_loads.items())
+
+        return data
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import sys
+
+from django.utils import six
+
+from .base import TemplateResult
+from .settings import BUILT_IN_FILTERS, BUILT_IN_TAG_VALUES, BUILT_IN_TAGS
+from .utils import get_modification_stamp, get_module_file, write_atomic
+
+# Increase whenever the format of the cached results changes
+CACHE_VERSION = 4
+
+
+def get_default_cache_path():
+    """
+    Get the default location of the project's cache file.
+
+    The file is located in $XDG_CACHE_HOME/django-unload (~/.cache by
+    default) and its name depends on the current working directory and the
+    settings module, so projects do not share cache files.
+
+    :returns: absolute path to the cache file
+    """
+    cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                  os.path.join(os.path.expanduser('~'), '.cache'))
+    project = '{}:{}'.format(os.getcwd(),
+                             os.environ.get('DJANGO_SETTINGS_MODULE', ''))
+    filename = hashlib.sha1(project.encode('utf-8')).hexdigest()[:16]
+
+    return os.path.join(cache_home, 'django-unload', filename + '.json')
+
+
+def get_digest(parts):
+    """
+    Get the hexadecimal SHA-1 digest of the strings.
+
+    :parts: an iterable of strings
+    :returns: String
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+def get_file_digest(filepath):
+    """
+    Get the hexadecimal SHA-1 digest of the file's contents.
+
+    :filepath: String
+    :returns: String
+    """
+    with open(filepath, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+def get_settings_fingerprint(lex_only=False):
+    """
+    Get the fingerprint of everything that affects the results of all
+    templates: the built-in tags and filters, the analysis mode and the
+    cache's version.
+
+    :lex_only: Boolean; are the templates analyzed without compiling them
+    :returns: String
+    """
+    parts = ['version={}'.format(CACHE_VERSION),
+             'lex_only={}'.format(lex_only)]
+    parts += sorted(BUILT_IN_TAGS)
+    parts += sorted(value for value in BUILT_IN_TAG_VALUES if value)
+    parts += sorted(BUILT_IN_FILTERS)
+
+    return get_digest(parts)
+
+
+class ResultCache(object):
+    """
+    A persistent cache of template analysis results.
+
+    An entry is found using the template's path and a digest of its contents,
+    so unchanged templates are answered without lexing them. The entry is
+    valid as long as the libraries that the template depends on still
+    provide the same tags and filters: the loaded libraries, the libraries
+    providing the used tags/filters and the engine's built-in libraries.
+
+    The cache also stores the modification stamps and digests of the
+    libraries' modules along with a dependency index (library -> templates).
+    When the cache is loaded, the entries of templates that depend on a
+    modified module are discarded without importing any library. When it is
+    saved, the entries of the templates scanned during the run that were
+    neither looked up nor stored (i.e. the results of their previous
+    contents) and the entries of deleted templates are discarded.
+    """
+
+    def __init__(self, path=None, lex_only=False):
+        self.path = path or get_default_cache_path()
+        self.fingerprint = get_settings_fingerprint(lex_only)
+        self.hits = 0
+        self.misses = 0
+        # The number of entries discarded because of modified libraries
+        self.invalidated = 0
+        # {key: {'path': template file, 'dependencies': digest,
+        #        'libraries': [names], 'result': dict}}
+        self._entries = {}
+        # {name: {'path': module file, 'stamp': [mtime, size],
+        #         'digest': digest of the module's contents}}
+        self._libraries = {}
+        # The keys looked up or stored during the run (kept by save)
+        self._used = set()
+        self._load()
+
+    def _load(self):
+        """
+        Read the entries from the cache file and discard the entries that
+        depend on modified libraries.
+        """
+        try:
+            with io.open(self.path, encoding='UTF-8') as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return
+
+        if data.get('fingerprint') != self.fingerprint:
+            return
+
+        self._entries = data.get('entries', {})
+        self._libraries = data.get('libraries', {})
+        dependents = data.get('dependents', {})
+        for module in self.get_modified_libraries():
+            del self._libraries[module]
+            for key in dependents.get(module, ()):
+                if self._entries.pop(key, None) is not None:
+                    self.invalidated += 1
+
+    def save(self):
+        """
+        Write the entries, the libraries and the dependency index to the
+        cache file.
+
+        The unused entries of the templates scanned during the run and the
+        entries of deleted templates are discarded, so the file does not grow
+        with every edit of a template, while the entries of templates outside
+        the scan (e.g. of another app or shard) are kept. The libraries that
+        no remaining entry depends on are discarded as well.
+        """
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        scanned = set(self._entries[key]['path']
+                      for key in self._used if key in self._entries)
+        self._entries = dict(
+            (key, entry) for key, entry in self._entries.items()
+            if key in self._used or (entry['path'] not in scanned and
+                                     os.path.exists(entry['path'])))
+        dependents = self.get_dependency_index()
+        self._libraries = dict((module, library)
+                               for module, library in self._libraries.items()
+                               if module in dependents)
+        data = {'fingerprint': self.fingerprint,
+                'entries': self._entries,
+                'libraries': self._libraries,
+                'dependents': dependents}
+        # json.dumps returns a byte string on Python 2
+        contents = six.text_type(json.dumps(data, sort_keys=True))
+        write_atomic(self.path, contents)
+
+    def get_modified_libraries(self):
+        """
+        Get the libraries whose modules were modified or deleted.
+
+        The digest of a module is compared only if its modification stamp
+        changed, e.g. a checkout of another branch does not invalidate the
+        results of unchanged modules.
+
+        :returns: a sorted list of library names
+        """
+        modified = []
+        for module, library in sorted(self._libraries.items()):
+            stamp = get_modification_stamp(library['path'])
+            if stamp is None:
+                modified.append(module)
+            elif list(stamp) != library['stamp']:
+                if get_file_digest(library['path']) == library['digest']:
+                    library['stamp'] = list(stamp)
+                else:
+                    modified.append(module)
+
+        return modified
+
+    def get_dependency_index(self):
+        """
+        Get the keys of the entries that depend on each library.
+
+        :returns: {'library name': sorted list of keys}
+        """
+        dependents = {}
+        for key, entry in self._entries.items():
+            for module in entry['libraries']:
+                dependents.setdefault(module, []).append(key)
+
+        return dict((module, sorted(keys))
+                    for module, keys in dependents.items())
+
+    def get_key(self, filepath, source):
+        """
+        Get the key of the template's entry.
+
+        :filepath: String; the absolute path to the template file
+        :source: String; the template's contents
+        :returns: String
+        """
+        return get_digest([filepath, source])
+
+    def get_libraries(self, result, library_index):
+        """
+        Get the libraries the template's results depend on, i.e. the loaded
+        libraries and the libraries providing the used tags and filters.
+
+        :result: TemplateResult object
+        :library_index: LibraryIndex object
+        :returns: a sorted list of library names
+        """
+        tag_providers, filter_providers = library_index.get_providers()
+        libraries = set(result.loaded_modules)
+        for member in result.used_tags:
+            libraries.update(tag_providers.get(member, ()))
+        for member in result.used_filters:
+            libraries.update(filter_providers.get(member, ()))
+
+        return sorted(libraries)
+
+    def get_dependencies(self, result, engine, library_index):
+        """
+        Get the digest of the libraries the template's results depend on.
+
+        :result: TemplateResult object
+        :engine: Engine object
+        :library_index: LibraryIndex object
+        :returns: String
+        """
+        tag_providers, filter_providers = library_index.get_providers()
+        parts = []
+        for module in sorted(result.loaded_modules):
+            parts += [module, library_index.get_fingerprint(module)]
+        for member in result.used_tags:
+            parts += [member] + sorted(tag_providers.get(member, ()))
+        for member in result.used_filters:
+            parts += [member] + sorted(filter_providers.get(member, ()))
+        parts += sorted(library_index.get_builtin_members(engine))
+
+        return get_digest(parts)
+
+    def get(self, key, engine, library_index):
+        """
+        Get the cached results of the template.
+
+        Counts the cache hits and misses.
+
+        :key: String (see get_key)
+        :engine: Engine object
+        :library_index: LibraryIndex object
+        :returns: TemplateResult object or None
+        """
+        self._used.add(key)
+        entry = self._entries.get(key)
+        if entry is not None:
+            result = TemplateResult.from_dict(entry['result'])
+            dependencies = self.get_dependencies(result, engine,
+                                                 library_index)
+            if dependencies == entry['dependencies']:
+                self.hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    def set(self, key, result, engine, library_index):
+        """
+        Store the results of the template.
+
+        :key: String (see get_key)
+        :result: TemplateResult object
+        :engine: Engine object
+        :library_index: LibraryIndex object
+        """
+        self._used.add(key)
+        libraries = self.get_libraries(result, library_index)
+        for module in libraries:
+            if module not in self._libraries:
+                self._add_library(module, library_index)
+        self._entries[key] = {
+            'path': result.name,
+            'dependencies': self.get_dependencies(result, engine,
+                                                  library_index),
+            'libraries': libraries,
+            'result': result.to_dict()
+        }
+
+    def _add_library(self, module, library_index):
+        """
+        Store the modification stamp and the digest of the library's module.
+
+        :module: String; the library's name (e.g. 'app_tags')
+        :library_index: LibraryIndex object
+        """
+        module_path = library_index.libraries.get(module)
+        filepath = get_module_file(sys.modules.get(module_path))
+        stamp = get_modification_stamp(filepath) if filepath else None
+        if stamp is not None:
+            self._libraries[module] = {
+                'path': filepath,
+                'stamp': list(stamp),
+                'digest': get_file_digest(filepath)
+            }
@@ -2,12 +2,34 @@
 
 from __future__ import unicode_literals
 
+import json
+import os
+import pkgutil
+from importlib import import_module
+
+from django.template.base import Parser
+
 try:
     from django.template.base import Lexer, DebugLexer
 except ImportError:
     from django.template.base import Lexer
     from django.template.debug import DebugLexer
 
+# Django 1.8 uses a separate parser class in debug mode
+try:
+    from django.template.debug import DebugParser
+except ImportError:
+    DebugParser = None
+
+# The token type constants were replaced with the TokenType enum in
+# Django 2.1
+try:
+    from django.template.base import TOKEN_BLOCK, TOKEN_VAR
+except ImportError:
+    from django.template.base import TokenType
+    TOKEN_BLOCK = TokenType.BLOCK
+    TOKEN_VAR = TokenType.VAR
+
 # InvalidTemplateLibrary was moved to django.template.library in
 # Django 1.9
 try:
@@ -20,10 +42,42 @@ try:
     from django.template.backends.django import get_installed_libraries
     from django.template.library import import_library
 except ImportError:
-    from django.template.base import get_library
-    get_installed_libraries = None
+    from django.template.base import get_library, get_templatetags_modules
     import_library = None
 
+    def get_installed_libraries():
+        """Get the templatetags libraries of the installed apps (Django 1.8).
+
+        The first module found with a given name takes precedence, as in
+        Django's get_library function.
+
+        Returns:
+            {dict}: {library name: module path}
+
+        """
+        libraries = {}
+        for candidate in get_templatetags_modules():
+            pkg = import_module(candidate)
+            for _, name, _ in pkgutil.iter_modules(pkg.__path__):
+                libraries.setdefault(name, '{}.{}'.format(candidate, name))
+
+        return libraries
+
+# importlib.metadata was added in Python 3.8
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError:
+    importlib_metadata = None
+
+# os.scandir was added in Python 3.5
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 # The future templatetags module was removed in Django 1.10
 try:
     from django.templatetags.future import register as future_lib
@@ -32,6 +86,90 @@ except ImportError:
     FUTURE_FILTERS = {}
 
 
+def get_builtin_libraries(engine):
+    """Get the Library instances that are available without loading them.
+
+    Args:
+        engine {Engine}: object
+
+    Returns:
+        {list} of {Library} objects
+
+    """
+    try:
+        return engine.template_builtins
+    except AttributeError:
+        # Django 1.8 shares the built-in libraries between engines
+        from django.template.base import builtins
+        return builtins
+
+
+def get_distribution_locations():
+    """Get the directories that contain installed distributions.
+
+    Editable installs and distributions installed without metadata
+    (e.g. `setup.py develop`) are skipped because their locations are
+    usually within the project. Requires Python 3.8+.
+
+    Returns:
+        {set} of absolute paths
+
+    """
+    locations = set()
+    if importlib_metadata is None:
+        return locations
+
+    for dist in importlib_metadata.distributions():
+        # The METADATA file is only present in .dist-info directories
+        if dist.read_text('METADATA') is None:
+            continue
+        direct_url = dist.read_text('direct_url.json')
+        if direct_url:
+            dir_info = json.loads(direct_url).get('dir_info', {})
+            if dir_info.get('editable', False):
+                continue
+        locations.add(str(dist.locate_file('')))
+
+    return locations
+
+
+class _DirEntry(object):
+    """A minimal replacement for os.DirEntry (used with os.listdir)."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isdir(self.path)
+
+    def is_file(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isfile(self.path)
+
+
+def iter_directory(directory):
+    """Iterate over the entries of the directory.
+
+    Uses os.scandir (or the scandir package) if available, because it does
+    not need an additional system call to determine the type of an entry.
+
+    Args:
+        directory {str}: path to directory
+
+    Returns:
+        an iterable of {DirEntry} objects
+
+    """
+    if scandir is not None:
+        return scandir(directory)
+
+    return [_DirEntry(directory, name) for name in os.listdir(directory)]
+
+
 def get_lexer(template_string, origin=None, debug=False):
     """Get the Lexer instance.
 
@@ -57,13 +195,42 @@ def get_lexer(template_string, origin=None, debug=False):
         return lexer_class(template_string, origin)
 
 
-def get_templatetag_library(module):
+def get_parser(tokens, engine, origin=None):
+    """Get the Parser instance the engine compiles the tokens with.
+
+    Args:
+        tokens {list}: tokens returned by the lexer (see get_lexer)
+        engine {Engine}: object
+        origin {Origin}: object
+
+    Returns:
+        {Parser} or {DebugParser} object
+
+    """
+    if not hasattr(engine, 'template_builtins'):
+        # Django 1.8 shares the libraries and builtins between engines
+        if engine.debug and DebugParser is not None:
+            return DebugParser(tokens)
+        return Parser(tokens)
+
+    try:
+        return Parser(tokens, engine.template_libraries,
+                      engine.template_builtins, origin)
+    except TypeError:
+        # The origin argument was added in Django 1.10
+        return Parser(tokens, engine.template_libraries,
+                      engine.template_builtins)
+
+
+def get_templatetag_library(module, libraries=None):
     """Get the templatetag module's Library instance.
 
     Needed for extracting template tags and filters.
 
     Args:
         module {str}: module's name (e.g. 'app_tags')
+        libraries {dict}: installed libraries ({name: module path}); fetched
+            from the installed apps if omitted (ignored in Django 1.8)
 
     Returns:
         {Library}
@@ -75,9 +242,45 @@ def get_templatetag_library(module):
 
     """
     try:
-        if import_library is not None and get_installed_libraries is not None:
-            return import_library(get_installed_libraries().get(module))
+        if import_library is not None:
+            if libraries is None:
+                libraries = get_installed_libraries()
+            return import_library(libraries.get(module))
         else:
             return get_library(module)
     except (AttributeError, InvalidTemplateLibrary):
         raise
+
+
+def refresh_engine_libraries(engine, module):
+    """Make the engine use the reloaded templatetags module.
+
+    Args:
+        engine {Engine}: object
+        module {str}: library's name (e.g. 'app_tags')
+
+    """
+    if hasattr(engine, 'get_template_libraries'):
+        engine.template_libraries = engine.get_template_libraries(
+            engine.libraries)
+    else:
+        # Django 1.8 caches the libraries in a module-level dictionary
+        from django.template.base import libraries
+        libraries.pop(module, None)
+
+
+def get_token_position(token):
+    """Get the position of the token created by the DebugLexer.
+
+    Args:
+        token {Token}: object
+
+    Returns:
+        {tuple}: (start, end) offsets in the template's source
+
+    """
+    try:
+        return token.position
+    except AttributeError:
+        # Django 1.8 stores the position along with the origin
+        return token.source[1]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import cProfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# tracemalloc was added in Python 3.4
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# The number of frames stored per allocation
+MEMORY_FRAMES = 1
+
+
+@contextmanager
+def profile_to_file(path):
+    """
+    Profile the block using cProfile and write the statistics to a file
+    that can be read using the pstats module (e.g. python -m pstats PATH).
+
+    Only the current process is profiled, i.e. not the worker processes.
+
+    :path: String; the path to the statistics file
+    :returns: a context manager yielding the cProfile.Profile object
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+@contextmanager
+def trace_memory(frames=MEMORY_FRAMES):
+    """
+    Trace the memory allocations of the block using tracemalloc.
+
+    The yielded report is filled in once the block exits; only the current
+    process is traced.
+
+    :frames: Integer; the number of frames stored per allocation
+    :returns: a context manager yielding a dict with the keys current,
+        peak (bytes) and snapshot (tracemalloc.Snapshot object)
+    :raises: RuntimeError if tracemalloc is not available (Python 2)
+    """
+    if tracemalloc is None:
+        raise RuntimeError('tracemalloc requires Python 3.4 or newer.')
+
+    report = {}
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(frames)
+    try:
+        yield report
+    finally:
+        report['current'], report['peak'] = tracemalloc.get_traced_memory()
+        report['snapshot'] = tracemalloc.take_snapshot()
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+def get_allocation_sites(snapshot, top=10):
+    """
+    Get the source lines that allocated the most memory that is still in
+    use, excluding the allocations of the import system, tracemalloc and
+    cProfile (writing the statistics of profile_to_file).
+
+    :snapshot: tracemalloc.Snapshot object
+    :top: Integer; the number of the listed sites
+    :returns: a list of records (OrderedDict objects with the keys file,
+        line, size and count) sorted by the size
+    """
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, '<unknown>')
+    ])
+    records = []
+    for statistic in snapshot.statistics('lineno')[:top]:
+        frame = statistic.traceback[0]
+        records.append(OrderedDict([
+            ('file', frame.filename),
+            ('line', frame.lineno),
+            ('size', statistic.size),
+            ('count', statistic.count)
+        ]))
+
+    return records
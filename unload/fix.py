@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import difflib
+import io
+import os
+
+from django.template import TemplateSyntaxError
+from django.utils import six
+
+from .compat import TOKEN_BLOCK, get_lexer, get_token_position
+from .libraries import get_library_index
+from .utils import write_atomic
+
+
+def get_tag_spans(source):
+    """
+    Get the names and positions of the template's tags.
+
+    The template is tokenized in the same way as during the analysis, so the
+    load tags correspond to the template's load blocks.
+
+    :source: String; the template's contents
+    :returns: a list of tuples (tag name, start, end, located within a
+        comment block)
+    """
+    spans = []
+    commented = False
+    for token in get_lexer(source, debug=True).tokenize():
+        if token.token_type != TOKEN_BLOCK:
+            continue
+        token_content = token.split_contents()
+        if not token_content:
+            continue
+        tag_name = token_content[0]
+        if tag_name == 'endcomment':
+            commented = False
+        start, end = get_token_position(token)
+        spans.append((tag_name, start, end, commented))
+        if tag_name == 'comment':
+            commented = True
+
+    return spans
+
+
+def get_load_spans(source):
+    """
+    Get the positions of the template's load tags. The load tags within
+    comment blocks are never rendered and therefore skipped (as during the
+    analysis).
+
+    :source: String; the template's contents
+    :returns: a list of tuples (start, end)
+    """
+    return [(start, end)
+            for tag_name, start, end, commented in get_tag_spans(source)
+            if tag_name == 'load' and not commented]
+
+
+def fix_load_block(load_block, result, library_index, kept_modules,
+                   kept_members):
+    """
+    Get the modules and members of the load block that need to be kept.
+
+    Unutilized modules and members are removed, as well as modules and
+    members loaded by one of the preceding blocks. Libraries that cannot be
+    located are kept.
+
+    :load_block: LoadBlock tuple
+    :result: TemplateResult object
+    :library_index: LibraryIndex object
+    :kept_modules: a set of modules loaded by the preceding blocks (updated)
+    :kept_members: a set of (member, module) tuples loaded by the preceding
+        blocks (updated)
+    :returns: a tuple (modules, members); both lists are empty if the block
+        needs to be removed
+    """
+    # FROM syntax
+    if load_block.members:
+        module = load_block.modules[0]
+        unknown = library_index.get_members(module) is None
+        members = []
+        for member in load_block.members:
+            if unknown or (result.utilized_members.get(member) and
+                           module not in kept_modules and
+                           (member, module) not in kept_members):
+                kept_members.add((member, module))
+                members.append(member)
+        return ([module] if members else []), members
+
+    modules = []
+    for module in load_block.modules:
+        if module in kept_modules:
+            continue
+        if (result.utilized_modules.get(module) or
+                library_index.get_members(module) is None):
+            kept_modules.add(module)
+            modules.append(module)
+
+    return modules, []
+
+
+def keep_other_loads(load_block, modules, members, names):
+    """
+    Restore the loads removed from the block (see fix_load_block) that do
+    not load one of the names, i.e. only the loads of the names are removed.
+
+    :load_block: LoadBlock tuple
+    :modules: a list of the block's kept modules
+    :members: a list of the block's kept members
+    :names: a collection of library and tag/filter names (the members of a
+        library loaded using the FROM syntax are removed if the library's
+        name is listed)
+    :returns: a tuple (modules, members)
+    """
+    # FROM syntax
+    if load_block.members:
+        module = load_block.modules[0]
+        members = [member for member in load_block.members
+                   if member in members or
+                   not (member in names or module in names)]
+        return ([module] if members else []), members
+
+    return [module for module in load_block.modules
+            if module in modules or module not in names], []
+
+
+def render_load_block(modules, members):
+    """
+    Get the load tag that loads the modules or members.
+
+    :modules: a list of module names
+    :members: a list of member names (the FROM syntax is used)
+    :returns: String
+    """
+    if members:
+        return '{{% load {} from {} %}}'.format(' '.join(members), modules[0])
+
+    return '{{% load {} %}}'.format(' '.join(modules))
+
+
+def replace_span(source, start, end, replacement=''):
+    """
+    Replace the span of the source. If the span is removed and its line
+    becomes empty, the entire line is removed.
+
+    :source: String
+    :start: Integer
+    :end: Integer
+    :replacement: String
+    :returns: String
+    """
+    if not replacement:
+        line_start = source.rfind('\n', 0, start) + 1
+        line_end = source.find('\n', end)
+        line_end = len(source) if line_end == -1 else line_end + 1
+        if not (source[line_start:start] + source[end:line_end]).strip():
+            start, end = line_start, line_end
+
+    return source[:start] + replacement + source[end:]
+
+
+def fix_source(source, result, library_index, names=None):
+    """
+    Remove the unutilized and duplicate loads from the template's source.
+
+    Only the load tags that change are rewritten; the rest of the source is
+    preserved exactly.
+
+    :source: String; the template's contents
+    :result: TemplateResult object (the analysis of the same contents)
+    :library_index: LibraryIndex object
+    :names: a collection of library and tag/filter names or None; only the
+        unnecessary loads of these names are removed (see keep_other_loads)
+    :returns: String (the fixed contents)
+    """
+    spans = get_load_spans(source)
+    if len(spans) != len(result.load_blocks):
+        # The template was modified since it was analyzed
+        return source
+
+    kept_modules = set()
+    kept_members = set()
+    edits = []
+    for (start, end), load_block in zip(spans, result.load_blocks):
+        modules, members = fix_load_block(load_block, result, library_index,
+                                          kept_modules, kept_members)
+        if names is not None:
+            modules, members = keep_other_loads(load_block, modules, members,
+                                                names)
+        if (modules, members) == (list(load_block.modules),
+                                  list(load_block.members)):
+            continue
+        replacement = render_load_block(modules, members) if modules else ''
+        edits.append((start, end, replacement))
+
+    # Later spans are replaced first, so the earlier positions stay valid
+    for start, end, replacement in reversed(edits):
+        source = replace_span(source, start, end, replacement)
+
+    return source
+
+
+def get_consolidated_loads(result, library_index):
+    """
+    Get the load tags that replace all load tags of the template.
+
+    The libraries are loaded by a single tag and the members by a tag per
+    library, all in alphabetical order. Unutilized and duplicate loads are
+    removed as in fix_source.
+
+    :result: TemplateResult object
+    :library_index: LibraryIndex object
+    :returns: a list of load tags or None if the loads cannot be reordered,
+        i.e. a library cannot be located or several libraries provide a tag
+        or filter with the same name (the last loaded one would be used)
+    """
+    kept_modules = set()
+    kept_members = set()
+    modules = []
+    members = {}
+    for load_block in result.load_blocks:
+        block_modules, block_members = fix_load_block(
+            load_block, result, library_index, kept_modules, kept_members)
+        if block_members:
+            members.setdefault(block_modules[0], []).extend(block_members)
+        else:
+            modules.extend(block_modules)
+
+    # Names loaded by each of the tags
+    loaded_names = []
+    for module in modules:
+        module_members = library_index.get_members(module)
+        if module_members is None:
+            return None
+        loaded_names.append(module_members[0] | module_members[1])
+    for module in members:
+        if library_index.get_members(module) is None:
+            return None
+        loaded_names.append(set(members[module]))
+    if sum(len(names) for names in loaded_names) != len(
+            set().union(*loaded_names)):
+        return None
+
+    load_tags = []
+    if modules:
+        load_tags.append(render_load_block(sorted(modules), []))
+    for module in sorted(members):
+        load_tags.append(render_load_block([module], sorted(members[module])))
+
+    return load_tags
+
+
+def consolidate_source(source, result, library_index):
+    """
+    Replace the template's load tags with the consolidated load tags
+    placed at the top of the template (after the extends tag).
+
+    Templates whose loads cannot be reordered (see get_consolidated_loads)
+    are only fixed using fix_source. Load tags inside comment blocks are left
+    as they are.
+
+    :source: String; the template's contents
+    :result: TemplateResult object (the analysis of the same contents)
+    :library_index: LibraryIndex object
+    :returns: String (the consolidated contents)
+    """
+    tags = [(tag_name, start, end)
+            for tag_name, start, end, commented in get_tag_spans(source)
+            if not commented]
+    loads = [(start, end) for tag_name, start, end in tags
+             if tag_name == 'load']
+    load_tags = get_consolidated_loads(result, library_index)
+    if len(loads) != len(result.load_blocks) or load_tags is None:
+        return fix_source(source, result, library_index)
+
+    # The loads are placed after the extends tag (it must be the first tag)
+    position = 0
+    for tag_name, start, end in tags:
+        if tag_name == 'extends':
+            position = end
+            break
+    text = '\n'.join(load_tags)
+
+    edits = [(start, end, '') for start, end in loads]
+    if loads and not source[position:loads[0][0]].strip():
+        # The first load tag is already located at the top
+        edits[0] = (loads[0][0], loads[0][1], text)
+    elif text:
+        edits.insert(0, (position, position,
+                         '\n' + text if position else text + '\n'))
+
+    # Later spans are replaced first, so the earlier positions stay valid
+    for start, end, replacement in reversed(edits):
+        source = replace_span(source, start, end, replacement)
+
+    return source
+
+
+def get_unified_diff(filepath, original, fixed):
+    """
+    Get the unified diff of the template's contents.
+
+    The path is relative to the current working directory, so the patch can
+    be applied using `git apply` or `patch -p1`.
+
+    :filepath: String
+    :original: String
+    :fixed: String
+    :returns: String (empty if the contents are equal)
+    """
+    name = os.path.relpath(filepath).replace(os.sep, '/')
+    patch = []
+    for line in difflib.unified_diff(original.splitlines(True),
+                                     fixed.splitlines(True),
+                                     'a/' + name, 'b/' + name):
+        patch.append(line)
+        if not line.endswith('\n'):
+            patch.append('\n\\ No newline at end of file\n')
+
+    return ''.join(patch)
+
+
+def fix_template(filepath, engine, result, dry_run=False, consolidate=False,
+                 library_index=None):
+    """
+    Remove the unutilized and duplicate loads from the template file.
+
+    The fixed contents are compiled by the engine first; if they cannot be
+    compiled (e.g. a removed library provides a tag or filter the analysis
+    does not recognize as used), the file is left unchanged. Otherwise the
+    file is replaced atomically and its line endings are preserved.
+
+    :filepath: String; the path to the template file
+    :engine: Engine object (its encoding is used to read and write the file)
+    :result: TemplateResult object
+    :dry_run: Boolean; do not modify the file
+    :consolidate: Boolean; merge the load tags (see consolidate_source)
+    :library_index: LibraryIndex object (defaults to the process-wide index)
+    :returns: a tuple (path, unified diff, the number of removed load tags,
+        error message or None); the diff is empty if the template did not
+        need to be fixed or the fixed contents cannot be compiled
+    """
+    if library_index is None:
+        library_index = get_library_index()
+    encoding = engine.file_charset
+    with io.open(filepath, encoding=encoding, newline='') as fp:
+        original = fp.read()
+    if consolidate:
+        fixed = consolidate_source(original, result, library_index)
+    else:
+        fixed = fix_source(original, result, library_index)
+    if fixed == original:
+        return filepath, '', 0, None
+
+    try:
+        engine.from_string(fixed)
+    except TemplateSyntaxError as error:
+        return (filepath, '', 0,
+                'the fixed template cannot be compiled ({})'.format(
+                    six.text_type(error)))
+
+    if not dry_run:
+        write_atomic(filepath, fixed, encoding=encoding)
+    removed = len(result.load_blocks) - len(get_load_spans(fixed))
+
+    return (filepath, get_unified_diff(filepath, original, fixed), removed,
+            None)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import timeit
+from collections import OrderedDict
+
+from django.template import TemplateSyntaxError
+from django.utils import six
+
+from .fix import fix_source
+from .libraries import get_library_index
+from .utils import get_contents
+
+# The number of compilations per measurement
+COMPILE_NUMBER = 10
+# The number of measurements; the fastest one is used
+COMPILE_REPEAT = 5
+
+
+def time_compile(source, engine, number=COMPILE_NUMBER,
+                 repeat=COMPILE_REPEAT):
+    """
+    Measure the time it takes the engine to compile the template.
+
+    The compilation is repeated and the fastest measurement is used, since
+    the slower ones are mostly caused by other processes (see the timeit
+    module).
+
+    :source: String; the template's contents
+    :engine: Engine object
+    :number: Integer; the number of compilations per measurement
+    :repeat: Integer; the number of measurements
+    :returns: Float (seconds per compilation)
+    """
+    timer = timeit.Timer(lambda: engine.from_string(source))
+
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def get_unnecessary_loads(result):
+    """
+    Get the names of the template's duplicate and unutilized libraries and
+    tags/filters.
+
+    :result: TemplateResult object
+    :returns: a sorted list of names
+    """
+    names = set()
+    for module, lines in result.loaded_modules.items():
+        if len(lines) > 1 or not result.utilized_modules[module]:
+            names.add(module)
+    for member, lines in result.loaded_members.items():
+        if len(lines) > 1 or not result.utilized_members[member]:
+            names.add(member)
+
+    return sorted(names)
+
+
+def estimate_impact(result, engine, library_index=None,
+                    number=COMPILE_NUMBER, repeat=COMPILE_REPEAT):
+    """
+    Estimate the compile time wasted by each of the template's unnecessary
+    loads (see get_unnecessary_loads).
+
+    The template is compiled as it is and once without each of the loads,
+    i.e. only the load is removed (see fix_source), so expensive libraries
+    can be singled out. Loads that fix_source does not remove (e.g. of
+    libraries that cannot be located) are not measured. The differences are
+    not clamped, so measurement noise may result in (small) negative
+    values.
+
+    :result: TemplateResult object
+    :engine: Engine object
+    :library_index: LibraryIndex object (defaults to the process-wide index)
+    :number: Integer; the number of compilations per measurement
+    :repeat: Integer; the number of measurements
+    :returns: a tuple (a list of records, i.e. OrderedDict objects with the
+        keys template, load, compile_ms, fixed_compile_ms and wasted_ms;
+        {load: error message} of the loads the template cannot be compiled
+        without)
+    :raises: TemplateSyntaxError if the template cannot be compiled
+    """
+    if library_index is None:
+        library_index = get_library_index()
+
+    source = get_contents(filepath=result.name, encoding=engine.file_charset)
+    variants = []
+    for name in get_unnecessary_loads(result):
+        fixed = fix_source(source, result, library_index, names=[name])
+        if fixed != source:
+            variants.append((name, fixed))
+    records = []
+    errors = OrderedDict()
+    if not variants:
+        return records, errors
+
+    original_time = time_compile(source, engine, number, repeat)
+    for name, fixed in variants:
+        try:
+            fixed_time = time_compile(fixed, engine, number, repeat)
+        except TemplateSyntaxError as error:
+            errors[name] = six.text_type(error)
+            continue
+        records.append(OrderedDict([
+            ('template', result.name),
+            ('load', name),
+            ('compile_ms', original_time * 1000),
+            ('fixed_compile_ms', fixed_time * 1000),
+            ('wasted_ms', (original_time - fixed_time) * 1000)
+        ]))
+
+    return records, errors
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import hashlib
+
+from .compat import (InvalidTemplateLibrary,
+                     get_builtin_libraries,
+                     get_installed_libraries,
+                     get_templatetag_library)
+
+_library_index = None
+
+
+class LibraryIndex(object):
+    """
+    An index of templatetags libraries and their members.
+
+    Django 1.9+ walks every installed app whenever the installed libraries are
+    listed, so the list is fetched only once per index. Libraries are
+    imported when they are first looked up and the names of their tags and
+    filters are stored as frozensets.
+
+    The reverse index (member name -> names of the libraries providing it)
+    requires importing every installed library, so it is built only when
+    it is first needed.
+    """
+
+    def __init__(self):
+        self._libraries = None
+        self._members = {}
+        self._fingerprints = {}
+        self._providers = None
+        self._builtin_members = {}
+
+    @property
+    def libraries(self):
+        """
+        The installed libraries ({name: module path}).
+        """
+        if self._libraries is None:
+            self._libraries = get_installed_libraries()
+
+        return self._libraries
+
+    def get_fingerprint(self, module):
+        """
+        Get a digest of the library's tag and filter names.
+
+        The digest changes whenever a tag or filter is added to or removed
+        from the library (or the library cannot be located anymore).
+
+        :module: String; the library's name (e.g. 'app_tags')
+        :returns: String (hexadecimal digest)
+        """
+        if module not in self._fingerprints:
+            members = self.get_members(module)
+            if members is None:
+                content = 'missing'
+            else:
+                content = '\n'.join(sorted(members[0]) + [''] +
+                                    sorted(members[1]))
+            self._fingerprints[module] = hashlib.sha1(
+                content.encode('utf-8')).hexdigest()
+
+        return self._fingerprints[module]
+
+    def get_providers(self):
+        """
+        Get the reverse index of the installed libraries' members.
+
+        :returns: {'tag_name': frozenset(libraries)},
+            {'filter_name': frozenset(libraries)}
+        """
+        if self._providers is None:
+            tag_providers = {}
+            filter_providers = {}
+            for module in self.libraries:
+                members = self.get_members(module)
+                if members is None:
+                    continue
+                for tag in members[0]:
+                    tag_providers.setdefault(tag, set()).add(module)
+                for custom_filter in members[1]:
+                    filter_providers.setdefault(custom_filter,
+                                                set()).add(module)
+            self._providers = (
+                dict((k, frozenset(v)) for k, v in tag_providers.items()),
+                dict((k, frozenset(v)) for k, v in filter_providers.items()))
+
+        return self._providers
+
+    def get_builtin_members(self, engine):
+        """
+        Get the names of tags and filters that the engine provides without
+        loading a library (e.g. the 'builtins' option).
+
+        :engine: Engine object
+        :returns: frozenset of tag and filter names
+        """
+        builtin_libraries = get_builtin_libraries(engine)
+        key = tuple(id(lib) for lib in builtin_libraries)
+        if key not in self._builtin_members:
+            names = set()
+            for lib in builtin_libraries:
+                names.update(lib.tags)
+                names.update(lib.filters)
+            self._builtin_members[key] = frozenset(names)
+
+        return self._builtin_members[key]
+
+    def get_members(self, module):
+        """
+        Get the names of the library's tags and filters.
+
+        :module: String; the library's name (e.g. 'app_tags')
+        :returns: (frozenset of tag names, frozenset of filter names) or None
+            if the library cannot be located
+        """
+        if module not in self._members:
+            try:
+                lib = get_templatetag_library(module, self.libraries)
+            except (AttributeError, InvalidTemplateLibrary):
+                self._members[module] = None
+            else:
+                self._members[module] = (frozenset(lib.tags),
+                                         frozenset(lib.filters))
+
+        return self._members[module]
+
+    def invalidate(self, module=None):
+        """
+        Forget the members of the specified library or of all libraries.
+
+        :module: String; the library's name or None (the entire index)
+        """
+        if module is None:
+            self._libraries = None
+            self._members = {}
+            self._fingerprints = {}
+            self._builtin_members = {}
+        else:
+            self._members.pop(module, None)
+            self._fingerprints.pop(module, None)
+        self._providers = None
+
+
+def get_library_index():
+    """
+    Get the process-wide library index (created on first use).
+
+    :returns: LibraryIndex
+    """
+    global _library_index
+    if _library_index is None:
+        _library_index = LibraryIndex()
+
+    return _library_index
+
+
+def invalidate_library_index():
+    """
+    Discard the process-wide library index, e.g. after a templatetags module
+    was changed. A new index is created on the next call to
+    get_library_index.
+    """
+    global _library_index
+    _library_index = None
@@ -3,84 +3,1052 @@
 from __future__ import unicode_literals
 
 import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import Pool, cpu_count
 
-from .base import Template
+import django
+from django.apps import apps
+from django.template import TemplateSyntaxError
+from django.utils import six
+from django.utils.six import StringIO
+
+from .base import LexedTemplate, Template, TemplateResult
+from .diagnostics import get_allocation_sites
+from .fix import fix_template
+from .impact import COMPILE_REPEAT, estimate_impact
+from .libraries import get_library_index
+from .profiling import (PERCENTS,
+                        STATISTICS,
+                        get_compile_statistics,
+                        profile_compile)
+from .timings import (PHASES,
+                      TIMING_PERCENTS,
+                      PhaseRecorder,
+                      perf_counter,
+                      time_phase)
+from .traffic import prioritize_results
+from .usage import LibraryUsage
 from .utils import (get_app,
                     get_contents,
                     get_djangotemplates_engines,
-                    get_package_locations,
+                    get_package_trie,
+                    get_shard_index,
                     get_templates,
+                    output_as_json,
+                    output_as_json_line,
                     output_as_table,
+                    output_cache_statistics,
                     output_message,
                     output_template_name)
 
+# The state of a worker process (see init_worker)
+_worker = {}
+
+OUTPUT_FORMATS = ('table', 'json', 'jsonl')
+
+# The number of the slowest templates listed by profile_templates
+PROFILE_TOP = 10
+
+# The number of templates looked up in the result cache at once when they
+# are analyzed in worker processes
+CACHE_BATCH_SIZE = 256
 
-def list_unnecessary_loads(app_label=None):
+
+def list_unnecessary_loads(app_label=None, lex_only=False, jobs=1,
+                           cache=None, output_format='table',
+                           output=sys.stdout, filepaths=None, shard=None,
+                           render_counts=None, timings=None):
     """
     Scan the project directory tree for template files and process each and
     every one of them.
 
     :app_label: String; app label supplied by the user
+    :lex_only: Boolean; skip the compilation of the templates' nodelists
+    :jobs: Integer; the number of worker processes (0 = one per CPU)
+    :cache: ResultCache object or None; the caller is responsible for saving
+        the cache
+    :output_format: String; one of OUTPUT_FORMATS
+    :output: output destination (console=sys.stdout; testing=StringIO);
+        other messages are sent to sys.stderr unless the format is 'table'
+    :filepaths: an iterable of file paths or None; only the templates from
+        the list are processed instead of scanning the template directories
+    :shard: a tuple (index, count) or None; only the templates assigned to
+        the shard are processed (see get_shard_index)
+    :render_counts: RenderCounts object or None; the templates are annotated
+        with their renders and sorted by the estimated work wasted by their
+        unnecessary loads (see prioritize_results) instead of being output
+        as soon as they are analyzed
+    :timings: ScanTimings object or None; the durations of the scan's
+        phases are added to it (the caller outputs them, e.g. using
+        output_timings)
 
-    :returns: None (outputs to the console)
+    :returns: Boolean (do the template files have issues or not)
     """
-    if app_label:
-        app = get_app(app_label)
-    else:
-        app = None
+    # Keep machine-readable output free of informational messages
+    messages = output if output_format == 'table' else sys.stderr
+
+    has_issues = False
+    records = []
+    engine_results = iter_engine_results(app_label, lex_only=lex_only,
+                                         jobs=jobs, cache=cache,
+                                         filepaths=filepaths, shard=shard,
+                                         output=messages, timings=timings)
+    for _, dt_engine, results, pool in engine_results:
+        weights = None
+        if render_counts is not None:
+            results, weights = prioritize_results(
+                results, render_counts, dt_engine.template_dirs)
+        if output_results(results, output=output,
+                          output_format=output_format, records=records,
+                          weights=weights, timings=timings):
+            has_issues = True
+        else:
+            output_message(reason=3, output=messages)
+
+    if output_format == 'json':
+        with time_phase(timings, 'output'):
+            output_as_json(records, output=output)
+    if timings is not None:
+        timings.stop()
+    if cache is not None:
+        output_cache_statistics(hits=cache.hits, misses=cache.misses,
+                                output=messages)
+
+    return has_issues
+
+
+def fix_unnecessary_loads(app_label=None, lex_only=False, jobs=1, cache=None,
+                          dry_run=False, output=sys.stdout, filepaths=None,
+                          shard=None, consolidate=False):
+    """
+    Remove the unutilized and duplicate loads from the project's templates.
+
+    :app_label: String; app label supplied by the user
+    :lex_only: Boolean; skip the compilation of the templates' nodelists
+    :jobs: Integer; the number of worker processes (0 = one per CPU); the
+        templates are both analyzed and fixed by the workers
+    :cache: ResultCache object or None
+    :dry_run: Boolean; output a unified diff instead of modifying the files
+    :output: output destination (console=sys.stdout; testing=StringIO);
+        other messages are sent to sys.stderr in a dry run
+    :filepaths: an iterable of file paths or None; only the templates from
+        the list are fixed
+    :shard: a tuple (index, count) or None; only the templates assigned to
+        the shard are fixed
+    :consolidate: Boolean; merge the templates' load tags into a minimal
+        sorted set placed at the top of the template
+
+    :returns: a tuple (the number of fixed templates, the number of removed
+        load tags)
+    """
+    # Keep the patch free of informational messages
+    messages = sys.stderr if dry_run else output
+    library_index = get_library_index()
+
+    fixed = 0
+    removed = 0
+    engine_results = iter_engine_results(app_label, lex_only=lex_only,
+                                         jobs=jobs, cache=cache,
+                                         filepaths=filepaths, shard=shard,
+                                         output=messages)
+    for engine_index, dt_engine, results, pool in engine_results:
+        patches = fix_templates(results, engine_index, dt_engine.engine,
+                                dry_run, consolidate=consolidate,
+                                library_index=library_index, pool=pool)
+        for filepath, patch, removed_loads, error in patches:
+            if error is not None:
+                messages.write(
+                    'Unable to fix {}: {}\n'.format(filepath, error))
+                continue
+            fixed += 1
+            removed += removed_loads
+            output.write(patch if dry_run else 'Fixed {}\n'.format(filepath))
+
+    return fixed, removed
 
-    dt_engines = get_djangotemplates_engines()
 
+def rank_unnecessary_loads(app_label=None, lex_only=False, jobs=1,
+                           cache=None, output_format='table',
+                           output=sys.stdout, filepaths=None, shard=None,
+                           repeat=COMPILE_REPEAT, render_counts=None):
+    """
+    Measure the compile time wasted by each unnecessary load of every
+    template and list the loads sorted by the wasted time.
+
+    Templates that cannot be compiled and loads the template cannot be
+    compiled without are reported and skipped.
+
+    The templates are analyzed by the workers, but they are compiled in the
+    current process, so the measurements do not compete for CPUs.
+
+    :app_label: String; app label supplied by the user
+    :lex_only: Boolean; skip the compilation of the templates' nodelists
+        during the analysis
+    :jobs: Integer; the number of worker processes (0 = one per CPU)
+    :cache: ResultCache object or None; the caller is responsible for saving
+        the cache
+    :output_format: String; one of OUTPUT_FORMATS
+    :output: output destination (console=sys.stdout; testing=StringIO);
+        other messages are sent to sys.stderr unless the format is 'table'
+    :filepaths: an iterable of file paths or None
+    :shard: a tuple (index, count) or None
+    :repeat: Integer; the number of measurements per template
+    :render_counts: RenderCounts object or None; the records are extended
+        with the templates' renders and the time wasted if every render
+        compiled the template (total_wasted_ms) and sorted by the latter
+
+    :returns: a list of records (see estimate_impact), one per unnecessary
+        load, sorted by the wasted time
+    """
+    messages = output if output_format == 'table' else sys.stderr
+    library_index = get_library_index()
+
+    records = []
+    engine_results = iter_engine_results(app_label, lex_only=lex_only,
+                                         jobs=jobs, cache=cache,
+                                         filepaths=filepaths, shard=shard,
+                                         output=messages)
+    for _, dt_engine, results, pool in engine_results:
+        for result in results:
+            if not (result.list_duplicates()[0] or
+                    result.list_unutilized_items()[0]):
+                continue
+            try:
+                impact, errors = estimate_impact(
+                    result, dt_engine.engine, library_index=library_index,
+                    repeat=repeat)
+            except TemplateSyntaxError as error:
+                messages.write('Unable to compile {}: {}\n'.format(
+                    result.name, error))
+                continue
+            for load, error in errors.items():
+                messages.write(
+                    'Unable to compile {} without {}: {}\n'.format(
+                        result.name, load, error))
+            if render_counts is not None:
+                renders = render_counts.get(result.name,
+                                            dt_engine.template_dirs)
+                for record in impact:
+                    record['renders'] = renders
+                    record['total_wasted_ms'] = record['wasted_ms'] * renders
+            records += impact
+    key = 'wasted_ms' if render_counts is None else 'total_wasted_ms'
+    records.sort(key=lambda record: -record[key])
+
+    output_impact(records, output=output, output_format=output_format)
+    if cache is not None:
+        output_cache_statistics(hits=cache.hits, misses=cache.misses,
+                                output=messages)
+
+    return records
+
+
+def profile_templates(app_label=None, output_format='table',
+                      output=sys.stdout, filepaths=None, shard=None,
+                      top=PROFILE_TOP):
+    """
+    Compile every template of the project and measure the time spent
+    lexing and parsing it (see profile_compile).
+
+    The templates are compiled in the current process, one at a time.
+    Templates that cannot be compiled are reported and skipped.
+
+    :app_label: String; app label supplied by the user
+    :output_format: String; one of OUTPUT_FORMATS
+    :output: output destination (console=sys.stdout; testing=StringIO);
+        other messages are sent to sys.stderr unless the format is 'table'
+    :filepaths: an iterable of file paths or None
+    :shard: a tuple (index, count) or None
+    :top: Integer; the number of the slowest templates listed in the table
+
+    :returns: a list of records (see profile_compile) sorted by the compile
+        time
+    """
+    app = get_app(app_label) if app_label else None
+    messages = output if output_format == 'table' else sys.stderr
+    dt_engines = get_djangotemplates_engines(output=messages)
+    pkg_locations = get_package_trie()
+
+    records = []
     for dt_engine in dt_engines:
-        has_issues = False
-        templates = []
-        # Get the locations of installed packages
-        pkg_locations = get_package_locations()
-        # Get template directories located within the project
-        for directory in dt_engine.template_dirs:
-            templates += get_templates(directory, pkg_locations, app)
-
-        if templates:
-            for template in templates:
-                status = process_template(template, dt_engine.engine)
-                if status:
-                    has_issues = status
-            if not has_issues:
-                output_message(reason=3)
+        engine = dt_engine.engine
+        templates = get_engine_templates(dt_engine, pkg_locations, app,
+                                         filepaths=filepaths, shard=shard)
+        for filepath in templates:
+            source = get_contents(filepath=filepath,
+                                  encoding=engine.file_charset)
+            try:
+                record = profile_compile(source, engine, name=filepath)
+            except TemplateSyntaxError as error:
+                messages.write('Unable to compile {}: {}\n'.format(
+                    filepath, error))
+                continue
+            if output_format == 'jsonl':
+                output_as_json_line(record, output=output)
+            records.append(record)
+    records.sort(key=lambda record: -record['compile_ms'])
+
+    output_profile(records, output=output, output_format=output_format,
+                   top=top)
+
+    return records
+
+
+def list_dead_templatetags(lex_only=False, jobs=1, cache=None,
+                           output_format='table', output=sys.stdout):
+    """
+    Scan all of the project's templates and list the project's templatetags
+    libraries, tags and filters that none of them uses.
+
+    :lex_only: Boolean; skip the compilation of the templates' nodelists
+    :jobs: Integer; the number of worker processes (0 = one per CPU)
+    :cache: ResultCache object or None; the caller is responsible for saving
+        the cache
+    :output_format: String; one of OUTPUT_FORMATS
+    :output: output destination (console=sys.stdout; testing=StringIO);
+        other messages are sent to sys.stderr unless the format is 'table'
+
+    :returns: Boolean (are there unused libraries, tags or filters)
+    """
+    messages = output if output_format == 'table' else sys.stderr
+    usage = get_library_usage(lex_only=lex_only, jobs=jobs, cache=cache,
+                              output=messages)
+    records = usage.get_dead_templatetags()
+    output_dead_templatetags(records, output=output,
+                             output_format=output_format)
+
+    return bool(records)
+
+
+def list_library_usage(lex_only=False, jobs=1, cache=None,
+                       output_format='table', output=sys.stdout):
+    """
+    Scan all of the project's templates and list the number of templates
+    loading and using each library along with the libraries that should be
+    added to or removed from the engines' 'builtins' option.
+
+    :lex_only: Boolean; skip the compilation of the templates' nodelists
+    :jobs: Integer; the number of worker processes (0 = one per CPU)
+    :cache: ResultCache object or None; the caller is responsible for saving
+        the cache
+    :output_format: String; one of OUTPUT_FORMATS
+    :output: output destination (console=sys.stdout; testing=StringIO);
+        other messages are sent to sys.stderr unless the format is 'table'
+
+    :returns: Integer (the number of recommendations)
+    """
+    messages = output if output_format == 'table' else sys.stderr
+    usage = get_library_usage(lex_only=lex_only, jobs=jobs, cache=cache,
+                              output=messages)
+    records = usage.get_usage_report()
+    output_library_usage(records, usage.templates, output=output,
+                         output_format=output_format)
+
+    return sum(1 for record in records if record['recommendation'])
+
+
+def get_library_usage(lex_only=False, jobs=1, cache=None, output=sys.stdout):
+    """
+    Aggregate the usage of the libraries over all of the project's
+    templates.
+
+    :lex_only: Boolean; skip the compilation of the templates' nodelists
+    :jobs: Integer; the number of worker processes (0 = one per CPU)
+    :cache: ResultCache object or None
+    :output: the destination of informational messages
+
+    :returns: LibraryUsage object
+    """
+    usage = LibraryUsage()
+    engine_results = iter_engine_results(lex_only=lex_only, jobs=jobs,
+                                         cache=cache, output=output)
+    for _, dt_engine, results, pool in engine_results:
+        usage.add_builtins(dt_engine.engine)
+        for result in results:
+            usage.add(result)
+    if cache is not None:
+        output_cache_statistics(hits=cache.hits, misses=cache.misses,
+                                output=output)
+
+    return usage
+
+
+def iter_engine_results(app_label=None, lex_only=False, jobs=1, cache=None,
+                        filepaths=None, shard=None, output=sys.stdout,
+                        timings=None):
+    """
+    Analyze the project's templates engine by engine.
+
+    The worker pool is shared by all engines and it is shut down once the
+    iterator is exhausted or closed.
+
+    :app_label: String; app label supplied by the user
+    :lex_only: Boolean; skip the compilation of the templates' nodelists
+    :jobs: Integer; the number of worker processes (0 = one per CPU)
+    :cache: ResultCache object or None
+    :filepaths: an iterable of file paths or None; only the templates from
+        the list are processed
+    :shard: a tuple (index, count) or None; only the templates assigned to
+        the shard are processed
+    :output: the destination of informational messages (e.g. engines
+        without templates)
+    :timings: ScanTimings object or None; the phases of the scan and of
+        every analyzed template are measured
+
+    :returns: an iterator of tuples (the engine's index, DjangoTemplates
+        object, iterator of TemplateResult objects, multiprocessing.Pool
+        object or None)
+    """
+    app = get_app(app_label) if app_label else None
+    dt_engines = get_djangotemplates_engines(output=output)
+    # Shared by all templates; libraries are imported only once
+    library_index = get_library_index()
+    # Get the locations of installed packages
+    pkg_locations = get_package_trie()
+
+    timed = timings is not None
+    traced = timed and timings.trace
+    with worker_pool(jobs, lex_only, timed=timed, traced=traced) as pool:
+        for engine_index, dt_engine in enumerate(dt_engines):
+            with time_phase(timings, 'discovery'):
+                templates = get_engine_templates(dt_engine, pkg_locations,
+                                                 app, filepaths=filepaths,
+                                                 shard=shard)
+            if not templates:
+                output_message(reason=1, output=output)
+                continue
+
+            results = analyze_templates(
+                templates, engine_index, dt_engine.engine,
+                lex_only=lex_only, library_index=library_index, pool=pool,
+                cache=cache, timings=timings)
+            yield engine_index, dt_engine, results, pool
+
+
+def fix_templates(results, engine_index, engine, dry_run=False,
+                  consolidate=False, library_index=None, pool=None):
+    """
+    Fix the templates with duplicate or unutilized loads (or several load
+    tags when consolidating them), optionally in worker processes.
+
+    :results: an iterable of TemplateResult objects
+    :engine_index: Integer; the position of the engine in the list returned
+        by get_djangotemplates_engines (used by the worker processes)
+    :engine: Engine object
+    :dry_run: Boolean; do not modify the files
+    :consolidate: Boolean; merge the load tags
+    :library_index: LibraryIndex object (defaults to the process-wide index)
+    :pool: multiprocessing.Pool object (initialized using init_worker) or
+        None
+
+    :returns: an iterator of tuples (path, unified diff, the number of
+        removed load tags, error message or None) of the modified templates
+        and of the templates that could not be fixed (see fix_template)
+    """
+    tasks = [(engine_index, result, dry_run, consolidate)
+             for result in results
+             if ((consolidate and len(result.load_blocks) > 1) or
+                 result.list_duplicates()[0] or
+                 result.list_unutilized_items()[0])]
+    if pool is None:
+        patches = (fix_template(result.name, engine, result, dry_run,
+                                consolidate, library_index=library_index)
+                   for _, result, dry_run, consolidate in tasks)
+    else:
+        patches = pool.imap(fix_in_worker, tasks, chunksize=8)
+
+    return (fix for fix in patches if fix[1] or fix[3] is not None)
+
+
+def get_engine_templates(dt_engine, pkg_locations, app=None, filepaths=None,
+                         shard=None):
+    """
+    Get the template files located in the engine's template directories.
+
+    :dt_engine: DjangoTemplates object
+    :pkg_locations: PathTrie object; locations of 3rd party packages
+    :app: AppConfig object
+    :filepaths: an iterable of file paths or None; only the files from the
+        list are returned
+    :shard: a tuple (index, count) or None; only the files assigned to the
+        shard are returned
+
+    :returns: a list of absolute paths to template files
+    """
+    templates = []
+    # Get template directories located within the project
+    for directory in dt_engine.template_dirs:
+        templates += get_templates(directory, pkg_locations, app,
+                                   filepaths=filepaths)
+    if shard is not None:
+        index, count = shard
+        templates = [filepath for filepath in templates
+                     if get_shard_index(filepath, count) == index]
+
+    return templates
+
+
+@contextmanager
+def worker_pool(jobs, lex_only=False, timed=False, traced=False):
+    """
+    Create a pool of worker processes initialized using init_worker.
+
+    :jobs: Integer; the number of worker processes (0 = one per CPU)
+    :lex_only: Boolean; analyze the templates without compiling them
+    :timed: Boolean; measure the phases of the analysis
+    :traced: Boolean; keep the spans of the measured phases
+
+    :returns: a context manager yielding a multiprocessing.Pool object or
+        None (a single job)
+    """
+    if jobs == 0:
+        jobs = cpu_count()
+    if jobs <= 1:
+        yield None
+        return
+
+    pool = Pool(processes=jobs, initializer=init_worker,
+                initargs=(lex_only, timed, traced))
+    try:
+        yield pool
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+
+
+def analyze_templates(filepaths, engine_index, engine, lex_only=False,
+                      library_index=None, pool=None, cache=None,
+                      timings=None):
+    """
+    Analyze the templates, optionally in worker processes.
+
+    The results are yielded in the order of the supplied paths as soon as
+    they are available, regardless of the number of workers.
+
+    :filepaths: a list of absolute paths to template files
+    :engine_index: Integer; the position of the engine in the list returned
+        by get_djangotemplates_engines (used by the worker processes)
+    :engine: Engine object
+    :lex_only: Boolean; analyze the templates without compiling them
+    :library_index: LibraryIndex object (defaults to the process-wide index)
+    :pool: multiprocessing.Pool object (initialized using init_worker) or
+        None; the templates are analyzed in the current process if omitted
+    :cache: ResultCache object or None; unchanged templates are not analyzed
+        and the results of the remaining ones are stored in the cache
+    :timings: ScanTimings object or None; the durations of the analysis are
+        added to it
+
+    :returns: an iterator of TemplateResult objects
+    """
+    if library_index is None:
+        library_index = get_library_index()
+
+    # The templates are looked up in the cache and analyzed in batches (one
+    # at a time without workers): the contents read by the lookup are passed
+    # along, so every file is read only once, but only a batch of them is
+    # held in memory and the first results are not delayed by reading every
+    # file. Without a cache, the files are read by the analysis.
+    # The workers measure the phases using the default timer
+    timer = perf_counter if timings is None else timings.timer
+    if cache is None:
+        batch_size = max(len(filepaths), 1)
+    else:
+        batch_size = 1 if pool is None else CACHE_BATCH_SIZE
+    for start in range(0, len(filepaths), batch_size):
+        # A list of tuples (path, cache key, cached result, contents)
+        with time_phase(timings, 'read'):
+            entries = get_cached_results(filepaths[start:start + batch_size],
+                                         engine, library_index, cache)
+        misses = [(filepath, source) for filepath, key, result, source
+                  in entries if result is None]
+        if pool is None:
+            analyzed = (analyze_template(filepath, engine, lex_only=lex_only,
+                                         library_index=library_index,
+                                         timed=timings is not None,
+                                         traced=(timings is not None and
+                                                 timings.trace),
+                                         source=source, timer=timer)
+                        for filepath, source in misses)
         else:
-            output_message(reason=1)
+            tasks = [(engine_index, filepath, source)
+                     for filepath, source in misses]
+            # Chunks reduce the overhead of inter-process communication, but
+            # large chunks delay the output and balance the work poorly
+            analyzed = pool.imap(analyze_in_worker, tasks, chunksize=8)
 
-    return has_issues
+        for filepath, key, result, _ in entries:
+            if result is None:
+                result = next(analyzed)
+                if cache is not None:
+                    cache.set(key, result, engine, library_index)
+            if timings is not None:
+                timings.add_template(result.timings)
+            yield result
 
 
-def process_template(filepath, engine):
+def get_cached_results(filepaths, engine, library_index, cache=None):
     """
-    Process the specified template
+    Look up the templates' results in the cache.
+
+    The contents of the templates that are not cached are returned, so they
+    do not need to be read again when they are analyzed.
+
+    :filepaths: a list of absolute paths to template files
+    :engine: Engine object
+    :library_index: LibraryIndex object
+    :cache: ResultCache object or None
+
+    :returns: a list of tuples (path, cache key, TemplateResult object,
+        contents); the key, the result and the contents are None if they are
+        not available
+    """
+    entries = []
+    for filepath in filepaths:
+        key = None
+        result = None
+        source = None
+        if cache is not None:
+            source = get_contents(filepath=filepath,
+                                  encoding=engine.file_charset)
+            key = cache.get_key(filepath, source)
+            result = cache.get(key, engine, library_index)
+            if result is not None:
+                source = None
+        entries.append((filepath, key, result, source))
+
+    return entries
+
+
+def analyze_template(filepath, engine, lex_only=False, library_index=None,
+                     timed=False, traced=False, source=None,
+                     timer=perf_counter):
+    """
+    Analyze the specified template
 
     :filepath: String; the absolute path to the template file
     :engine: Engine object
+    :lex_only: Boolean; analyze the template without compiling it
+    :library_index: LibraryIndex object (defaults to the process-wide index)
+    :timed: Boolean; measure the phases of the analysis (stored in the
+        result's timings attribute)
+    :traced: Boolean; keep the spans of the measured phases
+    :source: String; the template's contents (read from the file if None)
+    :timer: a callable returning the current time in seconds (used if the
+        phases are measured)
 
-    :returns: Boolean (does the template file have issues or not)
+    :returns: TemplateResult
     """
-    has_issues = False
+    timings = (PhaseRecorder(filepath, trace=traced, timer=timer)
+               if timed else None)
     # Get the template's contents
-    source = get_contents(filepath=filepath,
-                          encoding=engine.file_charset)
+    if source is None:
+        with time_phase(timings, 'read'):
+            source = get_contents(filepath=filepath,
+                                  encoding=engine.file_charset)
     # Create and process the template
-    template = Template(template_string=source, engine=engine, name=filepath)
-    # Prepare output
-    duplicate_table, duplicate_headers = template.list_duplicates()
-    unutilized_table, unutilized_headers = template.list_unutilized_items()
-    if duplicate_table or unutilized_table:
-        output_template_name(template_name=template.name, output=sys.stdout)
-        has_issues = True
+    template_class = LexedTemplate if lex_only else Template
+    try:
+        template = template_class(template_string=source, engine=engine,
+                                  name=filepath, library_index=library_index,
+                                  timings=timings)
+    except TemplateSyntaxError as error:
+        # E.g. a tag or filter whose library is not loaded; the lexing-only
+        # analysis still finds the issues, so the scan goes on
+        template = LexedTemplate(template_string=source, engine=engine,
+                                 name=filepath, library_index=library_index,
+                                 timings=timings)
+        template.compile_error = six.text_type(error)
+    result = TemplateResult.from_template(template)
+    if timings is not None:
+        timings.stop()
+    result.timings = timings
+
+    return result
+
+
+def init_worker(lex_only, timed=False, traced=False):
+    """
+    Prepare a worker process for analyzing templates.
+
+    Django is set up (unless the process was forked from a process where it
+    already is), the engines are created once and the library index is
+    filled with every installed library.
+
+    :lex_only: Boolean; analyze the templates without compiling them
+    :timed: Boolean; measure the phases of the analysis
+    :traced: Boolean; keep the spans of the measured phases
+    """
+    if not apps.ready:
+        django.setup()
+    _worker['lex_only'] = lex_only
+    _worker['timed'] = timed
+    _worker['traced'] = traced
+    # Messages (e.g. about unsupported engines) are issued by the parent
+    _worker['engines'] = get_djangotemplates_engines(output=StringIO())
+    _worker['library_index'] = get_library_index()
+    _worker['library_index'].get_providers()
+
+
+def analyze_in_worker(task):
+    """
+    Analyze a template in a worker process initialized using init_worker.
+
+    :task: a tuple (engine index, absolute path to the template file, its
+        contents or None)
+    :returns: TemplateResult
+    """
+    engine_index, filepath, source = task
+    engine = _worker['engines'][engine_index].engine
+
+    return analyze_template(filepath, engine,
+                            lex_only=_worker['lex_only'],
+                            library_index=_worker['library_index'],
+                            timed=_worker['timed'],
+                            traced=_worker['traced'],
+                            source=source)
+
+
+def fix_in_worker(task):
+    """
+    Fix a template in a worker process initialized using init_worker.
+
+    :task: a tuple (engine index, TemplateResult, dry run, consolidate)
+    :returns: a tuple (path, unified diff, the number of removed load tags,
+        error message or None)
+    """
+    engine_index, result, dry_run, consolidate = task
+    engine = _worker['engines'][engine_index].engine
+
+    return fix_template(result.name, engine, result, dry_run, consolidate,
+                        library_index=_worker['library_index'])
+
+
+def output_results(results, output=sys.stdout, output_format='table',
+                   records=None, weights=None, timings=None):
+    """
+    Output the issues found in the templates.
+
+    In the 'table' format, only the templates with issues are displayed.
+    The 'jsonl' format streams a record of every template as soon as it is
+    analyzed, while the 'json' format collects the records (the caller
+    outputs them using output_as_json).
+
+    :results: an iterable of TemplateResult objects
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :output_format: String; one of OUTPUT_FORMATS
+    :records: a list the records are appended to (the 'json' format)
+    :weights: {template: OrderedDict} or None; the annotations of the
+        templates (see prioritize_results) added to their records
+    :timings: ScanTimings object or None; the time spent outputting the
+        results is added to it
+
+    :returns: Boolean (do the templates have issues or not)
+    """
+    has_issues = False
+    for result in results:
+        weight = weights.get(result.name) if weights is not None else None
+        with time_phase(timings, 'output', name=result.name):
+            output_report(result, output=output, output_format=output_format,
+                          records=records, weight=weight)
+        if result.has_issues:
+            has_issues = True
+
+    return has_issues
+
+
+def output_report(result, output=sys.stdout, output_format='table',
+                  records=None, weight=None):
+    """
+    Output the issues found in the template in the given format.
+
+    :result: TemplateResult object
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :output_format: String; one of OUTPUT_FORMATS
+    :records: a list the record is appended to (the 'json' format)
+    :weight: OrderedDict (see prioritize_results) or None
+    """
+    if output_format in ('json', 'jsonl'):
+        report = result.get_report()
+        if weight is not None:
+            report.update(weight)
+        if output_format == 'jsonl':
+            output_as_json_line(report, output=output)
+        else:
+            records.append(report)
+    else:
+        output_result(result, output=output, weight=weight)
+
+
+def output_result(result, output=sys.stdout, weight=None):
+    """
+    Output the issues found in the template.
+
+    :result: TemplateResult object
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :weight: OrderedDict (with the keys renders and wasted_loads) or None
+    """
+    output.write(result.messages)
+    if not result.has_issues:
+        return
+
+    output_template_name(template_name=result.name, output=output)
+    if result.compile_error:
+        output.write('Unable to compile the template: {}\n'.format(
+            result.compile_error))
+    if weight is not None:
+        output.write('Renders: {renders}; wasted loads: {wasted_loads}\n'
+                     .format(**weight))
     # Display the table that contains duplicate loads
+    duplicate_table, duplicate_headers = result.list_duplicates()
     if duplicate_table:
         output_as_table(table=duplicate_table,
-                        headers=duplicate_headers, output=sys.stdout)
+                        headers=duplicate_headers, output=output)
     # Display the table that contains unutilized loads
+    unutilized_table, unutilized_headers = result.list_unutilized_items()
     if unutilized_table:
         output_as_table(table=unutilized_table,
-                        headers=unutilized_headers, output=sys.stdout)
+                        headers=unutilized_headers, output=output)
+    # Display the table that contains tags/filters whose libraries are not
+    # loaded
+    missing_table, missing_headers = result.list_missing_loads()
+    if missing_table:
+        output_as_table(table=missing_table,
+                        headers=missing_headers, output=output)
 
-    return has_issues
+
+def process_template(filepath, engine, lex_only=False, library_index=None):
+    """
+    Process the specified template
+
+    :filepath: String; the absolute path to the template file
+    :engine: Engine object
+    :lex_only: Boolean; analyze the template without compiling it
+    :library_index: LibraryIndex object (defaults to the process-wide index)
+
+    :returns: Boolean (does the template file have issues or not)
+    """
+    result = analyze_template(filepath, engine, lex_only=lex_only,
+                              library_index=library_index)
+    output_result(result, output=sys.stdout)
+
+    return result.has_issues
+
+
+def output_dead_templatetags(records, output=sys.stdout,
+                             output_format='table'):
+    """
+    Output the unused libraries, tags and filters.
+
+    :records: a list of records returned by
+        LibraryUsage.get_dead_templatetags
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :output_format: String; one of OUTPUT_FORMATS
+    """
+    if output_format == 'jsonl':
+        for record in records:
+            output_as_json_line(record, output=output)
+    elif output_format == 'json':
+        output_as_json(records, output=output)
+    elif records:
+        table = [[record['library'], record['templates'],
+                  ', '.join(record['unused_tags']),
+                  ', '.join(record['unused_filters'])]
+                 for record in records]
+        output_as_table(table, headers=['Library', 'Used by templates',
+                                        'Unused tags', 'Unused filters'],
+                        output=output)
+    else:
+        output.write('All templatetags libraries are used!\n')
+
+
+def output_library_usage(records, templates, output=sys.stdout,
+                         output_format='table'):
+    """
+    Output the load and usage counts of the libraries.
+
+    :records: a list of records returned by LibraryUsage.get_usage_report
+    :templates: Integer; the number of scanned templates
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :output_format: String; one of OUTPUT_FORMATS
+    """
+    if output_format == 'jsonl':
+        for record in records:
+            output_as_json_line(record, output=output)
+        return
+    elif output_format == 'json':
+        output_as_json(records, output=output)
+        return
+
+    recommendations = {'promote': 'Add to builtins',
+                       'demote': 'Remove from builtins'}
+    table = []
+    for record in records:
+        table.append([record['library'],
+                      'Yes' if record['builtin'] else 'No',
+                      get_share(record['loaded_by'], templates),
+                      get_share(record['used_by'], templates),
+                      recommendations.get(record['recommendation'], '')])
+    output.write('Scanned templates: {}\n'.format(templates))
+    output_as_table(table, headers=['Library', 'Built-in', 'Loaded by',
+                                    'Used by', 'Recommendation'],
+                    output=output)
+
+
+def get_share(count, total):
+    """
+    Format the number of templates along with their share of all templates.
+
+    :count: Integer
+    :total: Integer
+    :returns: String (e.g. '12 (40%)')
+    """
+    if not total:
+        return '{}'.format(count)
+
+    return '{} ({:.0%})'.format(count, float(count) / total)
+
+
+def output_impact(records, output=sys.stdout, output_format='table'):
+    """
+    Output the compile time wasted by the templates' unnecessary loads.
+
+    :records: a list of records returned by estimate_impact (one per load)
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :output_format: String; one of OUTPUT_FORMATS
+    """
+    if output_format == 'jsonl':
+        for record in records:
+            output_as_json_line(record, output=output)
+    elif output_format == 'json':
+        output_as_json(records, output=output)
+    elif records:
+        headers = ['Template', 'Unnecessary load', 'Compile (ms)',
+                   'Without it (ms)', 'Wasted (ms)']
+        table = [[record['template'], record['load'],
+                  '{:.3f}'.format(record['compile_ms']),
+                  '{:.3f}'.format(record['fixed_compile_ms']),
+                  '{:.3f}'.format(record['wasted_ms'])]
+                 for record in records]
+        # Annotated with the render counts
+        if 'renders' in records[0]:
+            headers += ['Renders', 'Total wasted (ms)']
+            for row, record in zip(table, records):
+                row += [record['renders'],
+                        '{:.3f}'.format(record['total_wasted_ms'])]
+        output_as_table(table, headers=headers, output=output)
+    else:
+        output_message(reason=3, output=output)
+
+
+def output_profile(records, output=sys.stdout, output_format='table',
+                   top=PROFILE_TOP):
+    """
+    Output the slowest templates and the percentiles of the compile times.
+
+    The 'jsonl' format streams the records while the templates are
+    compiled (see profile_templates), so only the statistics are output.
+
+    :records: a list of records returned by profile_compile, sorted by the
+        compile time
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :output_format: String; one of OUTPUT_FORMATS
+    :top: Integer; the number of the slowest templates listed in the table
+    """
+    statistics = get_compile_statistics(records)
+    labels = ['p{}'.format(percent) if percent < 100 else 'max'
+              for percent in PERCENTS]
+    if output_format != 'table':
+        summary = OrderedDict([
+            ('templates', len(records)),
+            ('statistics', OrderedDict(
+                (key, OrderedDict(zip(labels, values)))
+                for key, values in statistics.items()))
+        ])
+        if output_format == 'json':
+            summary['records'] = records
+            output_as_json(summary, output=output)
+        else:
+            output_as_json_line(summary, output=output)
+        return
+
+    if not records:
+        output_message(reason=1, output=output)
+        return
+
+    table = [[record['template'], record['tokens'], record['nodes'],
+              record['lex_ms'], record['parse_ms'], record['compile_ms']]
+             for record in records[:top]]
+    output_as_table(table, headers=['Template', 'Tokens', 'Nodes',
+                                    'Lex (ms)', 'Parse (ms)',
+                                    'Compile (ms)'],
+                    output=output)
+    table = [[label] + statistics[key] for key, label in STATISTICS.items()]
+    output_as_table(table, headers=['Templates: {}'.format(len(records))] +
+                    labels, output=output)
+
+
+def output_timings(timings, output=sys.stdout, output_format='table'):
+    """
+    Output the time spent in each phase of the scan along with the
+    percentiles of the per-template durations and the throughput.
+
+    :timings: ScanTimings object
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :output_format: String; one of OUTPUT_FORMATS; the summary is output as
+        a single JSON record unless the format is 'table'
+    """
+    summary = timings.get_summary()
+    if output_format != 'table':
+        output_as_json_line(summary, output=output)
+        return
+
+    columns = ['total_ms'] + ['p{}'.format(percent)
+                              for percent in TIMING_PERCENTS]
+    table = []
+    for phase, label in PHASES.items():
+        values = summary['phases'][phase]
+        table.append([label] + [None if values[column] is None else
+                                '{:.3f}'.format(values[column])
+                                for column in columns])
+    output_as_table(table, headers=['Phase', 'Total (ms)'] + [
+        'p{} (ms)'.format(percent) for percent in TIMING_PERCENTS],
+        output=output)
+    output.write('Templates: {}; elapsed: {:.3f} ms; templates/second: '
+                 '{:.1f}\n'.format(summary['templates'],
+                                   summary['elapsed_ms'],
+                                   summary['templates_per_second'] or 0))
+
+
+def output_memory_report(report, output=sys.stdout, output_format='table',
+                         top=PROFILE_TOP):
+    """
+    Output the peak of the traced memory and the sites that allocated the
+    most memory that is still in use.
+
+    :report: dict filled in by trace_memory
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :output_format: String; one of OUTPUT_FORMATS; the report is output as
+        a single JSON record unless the format is 'table'
+    :top: Integer; the number of the listed allocation sites
+    """
+    sites = get_allocation_sites(report['snapshot'], top=top)
+    if output_format != 'table':
+        output_as_json_line(OrderedDict([
+            ('current', report['current']),
+            ('peak', report['peak']),
+            ('sites', sites)
+        ]), output=output)
+        return
+
+    if sites:
+        table = [['{}:{}'.format(site['file'], site['line']),
+                  '{:.1f}'.format(site['size'] / 1024.0), site['count']]
+                 for site in sites]
+        output_as_table(table, headers=['Allocation site', 'Size (KiB)',
+                                        'Blocks'], output=output)
+    output.write('Memory in use: {:.1f} KiB; peak: {:.1f} KiB\n'.format(
+        report['current'] / 1024.0, report['peak'] / 1024.0))
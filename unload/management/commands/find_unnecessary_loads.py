@@ -2,22 +2,463 @@
 
 from __future__ import unicode_literals
 
-from django.core.management.base import BaseCommand
+from subprocess import CalledProcessError
+
+from django.core.management.base import BaseCommand, CommandError
 from django.utils.translation import ugettext_lazy as _
 
-from ...logic import list_unnecessary_loads
+from ...cache import ResultCache
+from ...diagnostics import profile_to_file, trace_memory, tracemalloc
+from ...impact import COMPILE_REPEAT
+from ...logic import (OUTPUT_FORMATS,
+                      PROFILE_TOP,
+                      fix_unnecessary_loads,
+                      list_dead_templatetags,
+                      list_library_usage,
+                      list_unnecessary_loads,
+                      output_memory_report,
+                      output_timings,
+                      profile_templates,
+                      rank_unnecessary_loads)
+from ...timings import ScanTimings
+from ...traffic import RenderCounts
+from ...utils import get_changed_files, parse_shard
+from ...watch import watch_templates
 
 
 class Command(BaseCommand):
     help = 'List unutilized templatetag libraries'
 
     def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*', type=str, metavar='PATH',
+            help=_('Template files that need to be scanned (by default, all '
+                   'templates are scanned)'))
         parser.add_argument(
             '-a', '--app', nargs='?', type=str, action='store', required=False,
             help=_('The label of the application that needs to be scanned'))
+        parser.add_argument(
+            '--lex-only', action='store_true', dest='lex_only', default=False,
+            help=_('Analyze the templates without compiling them (faster, '
+                   'but syntax errors are not detected)'))
+        parser.add_argument(
+            '-j', '--jobs', type=int, action='store', default=1,
+            help=_('The number of worker processes used for analyzing the '
+                   'templates (0 = one per CPU)'))
+        parser.add_argument(
+            '--cache', nargs='?', type=str, action='store', const='',
+            default=None, metavar='PATH',
+            help=_('Reuse the results of unchanged templates from the cache '
+                   'file (defaults to a file in $XDG_CACHE_HOME)'))
+        parser.add_argument(
+            '--format', choices=OUTPUT_FORMATS, action='store',
+            dest='output_format', default='table',
+            help=_('The output format; jsonl streams a JSON record per '
+                   'template'))
+        parser.add_argument(
+            '--since', type=str, action='store', metavar='REV',
+            help=_('Scan only the templates changed since the git revision '
+                   '(including uncommitted changes)'))
+        parser.add_argument(
+            '--shard', type=str, action='store', metavar='INDEX/COUNT',
+            help=_('Analyze only the templates assigned to the shard, e.g. '
+                   '1/4 (for splitting the scan between CI runners)'))
+        parser.add_argument(
+            '--fail-on-issues', action='store_true', dest='fail_on_issues',
+            default=False,
+            help=_('Exit with a non-zero status if any template has issues '
+                   '(e.g. to fail a CI run or one of its shards)'))
+        parser.add_argument(
+            '--fix', action='store_true', dest='fix', default=False,
+            help=_('Remove the unutilized and duplicate loads from the '
+                   'templates'))
+        parser.add_argument(
+            '--consolidate', action='store_true', dest='consolidate',
+            default=False,
+            help=_('Like --fix, but also merge the load tags into a minimal '
+                   'sorted set at the top of each template'))
+        parser.add_argument(
+            '--diff', action='store_true', dest='diff', default=False,
+            help=_('Output the changes --fix (or --consolidate) would make '
+                   'as a unified diff without modifying the templates'))
+        parser.add_argument(
+            '--rank', action='store_true', dest='rank', default=False,
+            help=_('Measure the compile time wasted by the unnecessary loads '
+                   'and sort the templates by it'))
+        parser.add_argument(
+            '--repeat', type=int, action='store', default=COMPILE_REPEAT,
+            help=_('The number of compile time measurements per template '
+                   '(used with --rank)'))
+        parser.add_argument(
+            '--render-counts', action='append', dest='render_counts',
+            metavar='FILE',
+            help=_('A JSON or CSV file mapping templates to their render '
+                   'counts (or a runtime profile); the findings are sorted '
+                   'by the estimated wasted work (can be repeated)'))
+        parser.add_argument(
+            '--profile-compile', action='store_true', dest='profile_compile',
+            default=False,
+            help=_('Measure the time spent lexing and parsing every template '
+                   'and list the slowest ones'))
+        parser.add_argument(
+            '--top', type=int, action='store', default=PROFILE_TOP,
+            help=_('The number of the slowest templates listed by '
+                   '--profile-compile (or allocation sites listed by '
+                   '--memory-report)'))
+        parser.add_argument(
+            '--dead', action='store_true', dest='dead', default=False,
+            help=_('List the templatetags libraries, tags and filters of the '
+                   'project that are not used in any template'))
+        parser.add_argument(
+            '--usage', action='store_true', dest='usage', default=False,
+            help=_('List the number of templates loading and using each '
+                   'library and recommend changes of the builtins option'))
+        parser.add_argument(
+            '--timings', action='store_true', dest='timings', default=False,
+            help=_('Output the time spent in each phase of the scan, the '
+                   'per-template percentiles and the templates per second'))
+        parser.add_argument(
+            '--trace-out', type=str, action='store', dest='trace_out',
+            metavar='FILE',
+            help=_('Write the spans of the scan\'s phases in every process '
+                   'to the file as Chrome trace events'))
+        parser.add_argument(
+            '--profile-out', type=str, action='store', dest='profile_out',
+            metavar='FILE',
+            help=_('Profile the command using cProfile and write the '
+                   'statistics to the file (read it using pstats)'))
+        parser.add_argument(
+            '--memory-report', action='store_true', dest='memory_report',
+            default=False,
+            help=_('Trace the memory allocations using tracemalloc and '
+                   'output the peak and the top allocation sites'))
+        parser.add_argument(
+            '--watch', action='store_true', dest='watch', default=False,
+            help=_('Keep running and re-analyze the modified templates '
+                   '(stop with Ctrl+C)'))
 
     def handle(self, *args, **options):
+        output_format = options.get('output_format', 'table')
+        messages = self.stdout if output_format == 'table' else self.stderr
+        if not options.get('memory_report', False):
+            self.profile_run(options, messages)
+            return
+
+        if tracemalloc is None:
+            raise CommandError('--memory-report requires Python 3.4 or '
+                               'newer.')
+        top = options.get('top', PROFILE_TOP)
+        if top < 0:
+            raise CommandError('The number of allocation sites cannot be '
+                               'negative.')
+        with trace_memory() as report:
+            self.profile_run(options, messages)
+        output_memory_report(report, output=messages,
+                             output_format=output_format, top=top)
+
+    def profile_run(self, options, messages):
+        """
+        Run the command and profile it if a statistics file is supplied.
+        """
+        profile_out = options.get('profile_out', None)
+        if not profile_out:
+            self.run(options)
+            return
+
+        with profile_to_file(profile_out):
+            self.run(options)
+        messages.write('Profile written to {}'.format(profile_out))
+
+    def run(self, options):
+        """
+        Run the selected action.
+        """
         # Find the app
         app_label = options.get('app', None)
-        self.stdout.write(
-            'Has issues: {}'.format(str(list_unnecessary_loads(app_label))))
+        lex_only = options.get('lex_only', False)
+        jobs = options.get('jobs', 1)
+        if jobs < 0:
+            raise CommandError('The number of jobs cannot be negative.')
+        cache_path = options.get('cache', None)
+        cache = None
+        if cache_path is not None:
+            cache = ResultCache(path=cache_path or None, lex_only=lex_only)
+        output_format = options.get('output_format', 'table')
+        filepaths = self.get_filepaths(options.get('paths', None),
+                                       options.get('since', None))
+        self.check_timings(options)
+        self.check_fail_on_issues(options)
+        if options.get('watch', False):
+            self.watch(options, app_label, lex_only, output_format, filepaths)
+            return
+        if options.get('dead', False) or options.get('usage', False):
+            self.report(options, app_label, lex_only, jobs, cache, filepaths)
+            return
+        shard = self.get_shard(options.get('shard', None))
+        render_counts = self.get_render_counts(
+            options.get('render_counts', None))
+        if (options.get('fix', False) or options.get('diff', False) or
+                options.get('consolidate', False)):
+            self.fix(options, app_label, lex_only, jobs, cache, filepaths,
+                     shard)
+            return
+        if options.get('rank', False):
+            self.rank(options, app_label, lex_only, jobs, cache, filepaths,
+                      shard, render_counts)
+            return
+        if options.get('profile_compile', False):
+            self.profile(options, app_label, filepaths, shard)
+            return
+        self.scan(options, app_label, lex_only, jobs, cache, filepaths,
+                  shard, render_counts)
+
+    def scan(self, options, app_label, lex_only, jobs, cache, filepaths,
+             shard, render_counts=None):
+        """
+        List the unnecessary loads of the templates.
+        """
+        output_format = options.get('output_format', 'table')
+        trace_out = options.get('trace_out', None)
+        timings = None
+        if options.get('timings', False) or trace_out:
+            timings = ScanTimings(trace=bool(trace_out))
+        has_issues = list_unnecessary_loads(app_label, lex_only=lex_only,
+                                            jobs=jobs, cache=cache,
+                                            output_format=output_format,
+                                            filepaths=filepaths, shard=shard,
+                                            render_counts=render_counts,
+                                            timings=timings)
+        if cache is not None:
+            cache.save()
+        summary = 'Has issues: {}'.format(str(has_issues))
+        messages = self.stdout if output_format == 'table' else self.stderr
+        if options.get('timings', False):
+            output_timings(timings, output=messages,
+                           output_format=output_format)
+        if trace_out:
+            timings.write_trace(trace_out)
+            messages.write('Trace written to {}'.format(trace_out))
+        messages.write(summary)
+        if has_issues and options.get('fail_on_issues', False):
+            raise CommandError('The templates have issues.')
+
+    def fix(self, options, app_label, lex_only, jobs, cache, filepaths,
+            shard):
+        """
+        Remove the unutilized and duplicate loads or output the diff.
+        """
+        if options.get('output_format', 'table') != 'table':
+            raise CommandError('--fix, --consolidate and --diff cannot be '
+                               'combined with --format.')
+        if (options.get('rank', False) or
+                options.get('profile_compile', False) or
+                options.get('render_counts')):
+            raise CommandError('--fix, --consolidate and --diff cannot be '
+                               'combined with --rank, --profile-compile or '
+                               '--render-counts.')
+        dry_run = options.get('diff', False)
+        fixed, removed = fix_unnecessary_loads(
+            app_label, lex_only=lex_only, jobs=jobs, cache=cache,
+            dry_run=dry_run, filepaths=filepaths, shard=shard,
+            consolidate=options.get('consolidate', False))
+        if cache is not None:
+            cache.save()
+        summary = 'Fixed templates: {}; removed load tags: {}'.format(
+            fixed, removed)
+        if dry_run:
+            self.stderr.write(summary)
+        else:
+            self.stdout.write(summary)
+
+    def rank(self, options, app_label, lex_only, jobs, cache, filepaths,
+             shard, render_counts=None):
+        """
+        List the templates sorted by the compile time wasted by their
+        unnecessary loads.
+        """
+        if options.get('profile_compile', False):
+            raise CommandError('--rank cannot be combined with '
+                               '--profile-compile.')
+        repeat = options.get('repeat', COMPILE_REPEAT)
+        if repeat < 1:
+            raise CommandError('The number of measurements must be '
+                               'positive.')
+        output_format = options.get('output_format', 'table')
+        records = rank_unnecessary_loads(
+            app_label, lex_only=lex_only, jobs=jobs, cache=cache,
+            output_format=output_format, filepaths=filepaths, shard=shard,
+            repeat=repeat, render_counts=render_counts)
+        if cache is not None:
+            cache.save()
+        summary = 'Wasted compile time: {:.3f} ms'.format(
+            sum(record['wasted_ms'] for record in records))
+        if render_counts is not None:
+            summary += ' ({:.3f} ms over all renders)'.format(
+                sum(record['total_wasted_ms'] for record in records))
+        if output_format == 'table':
+            self.stdout.write(summary)
+        else:
+            self.stderr.write(summary)
+
+    def profile(self, options, app_label, filepaths, shard):
+        """
+        Measure the compile time of every template.
+        """
+        if (options.get('jobs', 1) != 1 or
+                options.get('cache') is not None or
+                options.get('render_counts')):
+            raise CommandError('--profile-compile cannot be combined with '
+                               '--jobs, --cache or --render-counts.')
+        top = options.get('top', PROFILE_TOP)
+        if top < 0:
+            raise CommandError('The number of templates cannot be negative.')
+        output_format = options.get('output_format', 'table')
+        records = profile_templates(app_label, output_format=output_format,
+                                    filepaths=filepaths, shard=shard,
+                                    top=top)
+        summary = 'Total compile time: {:.3f} ms'.format(
+            sum(record['compile_ms'] for record in records))
+        if output_format == 'table':
+            self.stdout.write(summary)
+        else:
+            self.stderr.write(summary)
+
+    def report(self, options, app_label, lex_only, jobs, cache, filepaths):
+        """
+        Aggregate the usage of the libraries over all templates and list the
+        unused libraries, tags and filters (--dead) or the usage counts of
+        the libraries (--usage).
+        """
+        if (app_label or filepaths is not None or
+                options.get('shard') is not None or
+                options.get('fix', False) or options.get('diff', False) or
+                options.get('consolidate', False) or
+                options.get('rank', False) or
+                options.get('profile_compile', False) or
+                options.get('render_counts')):
+            raise CommandError('--dead and --usage require a scan of all '
+                               'templates and cannot be combined with --app, '
+                               'paths, --since, --shard, --fix, '
+                               '--consolidate, --diff, --rank, '
+                               '--profile-compile or --render-counts.')
+        if options.get('dead', False) and options.get('usage', False):
+            raise CommandError('--dead and --usage cannot be combined.')
+        output_format = options.get('output_format', 'table')
+        if options.get('dead', False):
+            has_dead = list_dead_templatetags(lex_only=lex_only, jobs=jobs,
+                                              cache=cache,
+                                              output_format=output_format)
+            summary = 'Has unused templatetags: {}'.format(str(has_dead))
+        else:
+            recommendations = list_library_usage(
+                lex_only=lex_only, jobs=jobs, cache=cache,
+                output_format=output_format)
+            summary = 'Recommendations: {}'.format(recommendations)
+        if cache is not None:
+            cache.save()
+        if output_format == 'table':
+            self.stdout.write(summary)
+        else:
+            self.stderr.write(summary)
+
+    def watch(self, options, app_label, lex_only, output_format, filepaths):
+        """
+        Analyze the templates and keep re-analyzing the modified ones until
+        the command is interrupted.
+        """
+        if (options.get('jobs', 1) != 1 or
+                options.get('cache') is not None or
+                options.get('shard') is not None or
+                options.get('fix', False) or options.get('diff', False) or
+                options.get('consolidate', False) or
+                options.get('dead', False) or options.get('usage', False) or
+                options.get('rank', False) or
+                options.get('profile_compile', False) or
+                options.get('render_counts')):
+            raise CommandError('--watch cannot be combined with --jobs, '
+                               '--cache, --shard, --fix, --consolidate, '
+                               '--diff, --rank, --profile-compile, '
+                               '--render-counts, --dead or --usage.')
+        if output_format == 'json':
+            raise CommandError('--watch requires the table or jsonl format.')
+        try:
+            watch_templates(app_label, lex_only=lex_only,
+                            output_format=output_format, filepaths=filepaths)
+        except KeyboardInterrupt:
+            pass
+
+    def check_timings(self, options):
+        """
+        Ensure that the timings are only measured (and traced) while listing
+        the unnecessary loads.
+        """
+        if ((options.get('timings', False) or options.get('trace_out')) and
+                any(options.get(option, False)
+                    for option in ('watch', 'dead', 'usage', 'fix', 'diff',
+                                   'consolidate', 'rank',
+                                   'profile_compile'))):
+            raise CommandError('--timings and --trace-out can only be used '
+                               'when listing the unnecessary loads.')
+
+    def check_fail_on_issues(self, options):
+        """
+        Ensure that the exit status only depends on the issues while listing
+        the unnecessary loads.
+        """
+        if (options.get('fail_on_issues', False) and
+                any(options.get(option, False)
+                    for option in ('watch', 'dead', 'usage', 'fix', 'diff',
+                                   'consolidate', 'rank',
+                                   'profile_compile'))):
+            raise CommandError('--fail-on-issues can only be used when '
+                               'listing the unnecessary loads.')
+
+    def get_shard(self, value):
+        """
+        Parse the shard specification.
+
+        :value: String ('INDEX/COUNT') or None
+        :returns: a tuple (index, count) or None
+        """
+        if value is None:
+            return None
+        try:
+            return parse_shard(value)
+        except ValueError as error:
+            raise CommandError(str(error))
+
+    def get_render_counts(self, paths):
+        """
+        Load the render counts supplied by the user.
+
+        :paths: a list of file paths or None
+        :returns: RenderCounts object or None
+        """
+        if not paths:
+            return None
+        try:
+            return RenderCounts.from_files(paths)
+        except (IOError, OSError, ValueError) as error:
+            raise CommandError('Unable to load the render counts: '
+                               '{}'.format(error))
+
+    def get_filepaths(self, paths, revision):
+        """
+        Get the files supplied by the user.
+
+        :paths: a list of file paths
+        :revision: String; a git revision or None
+        :returns: a list of file paths or None (all templates are scanned)
+        """
+        if not paths and revision is None:
+            return None
+
+        filepaths = list(paths or [])
+        if revision is not None:
+            try:
+                filepaths += get_changed_files(revision)
+            except (OSError, CalledProcessError) as error:
+                raise CommandError('Unable to list the files changed since '
+                                   '{}: {}'.format(revision, error))
+
+        return filepaths
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+
+from .compat import iter_directory
+
+# Marks the end of a stored path; path components are never empty
+_TERMINAL = ''
+
+
+def split_path(path):
+    """
+    Normalize the path and split it into components.
+
+    Symbolic links are resolved, so a path and its link resolve to the same
+    components.
+
+    :path: String
+    :returns: a list of path components
+    """
+    path = os.path.normcase(os.path.realpath(path))
+    return [part for part in path.split(os.sep) if part]
+
+
+class PathTrie(object):
+    """
+    A trie of normalized path components.
+
+    Answers whether a path is located within one of the stored directories
+    by comparing whole components, i.e. '/venv/lib2' is not located within
+    '/venv/lib'.
+    """
+
+    def __init__(self, paths=()):
+        self._root = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path):
+        """
+        Store the directory path.
+
+        :path: String
+        """
+        node = self._root
+        for part in split_path(path):
+            node = node.setdefault(part, {})
+        node[_TERMINAL] = True
+
+    def contains(self, path):
+        """
+        Check whether the path is one of the stored directories or is
+        located within one of them.
+
+        :path: String
+        :returns: Boolean
+        """
+        node = self._root
+        if _TERMINAL in node:
+            return True
+        for part in split_path(path):
+            node = node.get(part)
+            if node is None:
+                return False
+            if _TERMINAL in node:
+                return True
+
+        return False
+
+
+class ExtensionFilter(object):
+    """
+    Classifies files by their extensions.
+
+    Extensions are compared case insensitively and the result is cached for
+    every distinct extension.
+    """
+
+    def __init__(self, extensions):
+        self.extensions = frozenset(ext.lower() for ext in extensions)
+        self._cache = {}
+
+    def accepts(self, filename):
+        """
+        Check whether the file's extension is allowed.
+
+        :filename: String
+        :returns: Boolean
+        """
+        extension = os.path.splitext(filename)[1]
+        try:
+            return self._cache[extension]
+        except KeyError:
+            accepted = extension.lower() in self.extensions
+            self._cache[extension] = accepted
+            return accepted
+
+
+def walk_files(directory, file_filter, ignored_names=(), exclude=None):
+    """
+    Get the paths of accepted files located in the directory tree.
+
+    Directories are pruned before they are entered; symbolic links to
+    directories are not followed.
+
+    :directory: String; path to directory
+    :file_filter: ExtensionFilter object
+    :ignored_names: a collection of directory names that are not scanned
+    :exclude: PathTrie object; directories located within its paths are not
+        scanned
+    :returns: a sorted list of file paths
+    """
+    files = []
+    directories = [directory]
+    while directories:
+        current = directories.pop()
+        try:
+            entries = iter_directory(current)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if (entry.name not in ignored_names and
+                        (exclude is None or not exclude.contains(entry.path))):
+                    directories.append(entry.path)
+            elif file_filter.accepts(entry.name) and entry.is_file():
+                files.append(entry.path)
+
+    return sorted(files)
+
+
+def filter_files(directory, filepaths, file_filter, ignored_names=(),
+                 exclude=None):
+    """
+    Get the paths of accepted files from the list that walk_files would find
+    in the directory tree.
+
+    The returned paths are located in the supplied directory, i.e. they are
+    equal to the paths returned by walk_files.
+
+    :directory: String; path to directory
+    :filepaths: an iterable of file paths (e.g. supplied by the user)
+    :file_filter: ExtensionFilter object
+    :ignored_names: a collection of directory names that are not scanned
+    :exclude: PathTrie object; files located within its paths are skipped
+    :returns: a sorted list of file paths
+    """
+    root = os.path.realpath(directory)
+    files = set()
+    for filepath in filepaths:
+        relative_path = os.path.relpath(os.path.realpath(filepath), root)
+        parts = relative_path.split(os.sep)
+        if parts[0] == os.pardir or any(part in ignored_names
+                                        for part in parts[:-1]):
+            continue
+        filepath = os.path.join(directory, relative_path)
+        if (file_filter.accepts(filepath) and os.path.isfile(filepath) and
+                (exclude is None or not exclude.contains(filepath))):
+            files.add(filepath)
+
+    return sorted(files)
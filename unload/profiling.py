@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from timeit import default_timer
+
+from django.template.base import UNKNOWN_SOURCE, Node, Origin
+
+from .compat import get_lexer, get_parser
+from .utils import get_percentiles
+
+# The percentiles of the compile statistics
+PERCENTS = (50, 90, 99, 100)
+# The columns of the compile statistics ({record key: label})
+STATISTICS = OrderedDict([
+    ('lex_ms', 'Lex (ms)'),
+    ('parse_ms', 'Parse (ms)'),
+    ('compile_ms', 'Compile (ms)'),
+    ('tokens', 'Tokens'),
+    ('nodes', 'Nodes')
+])
+
+
+def profile_compile(source, engine, name=None, timer=default_timer):
+    """
+    Compile the template the same way the engine does and measure the time
+    spent in each phase.
+
+    The libraries a template loads are imported during its parsing if they
+    were not imported yet.
+
+    :source: String; the template's contents
+    :engine: Engine object
+    :name: String; the template's name (e.g. its path)
+    :timer: a function returning the current time in seconds
+    :returns: OrderedDict (with the keys template, lex_ms, parse_ms,
+        compile_ms, tokens and nodes)
+    """
+    # Like Django's Template class when no origin is supplied
+    origin = Origin(name or UNKNOWN_SOURCE)
+    start = timer()
+    tokens = get_lexer(source, origin, debug=engine.debug).tokenize()
+    lexed = timer()
+    # The parser consumes the list of tokens
+    token_count = len(tokens)
+    nodelist = get_parser(tokens, engine, origin).parse()
+    parsed = timer()
+
+    return OrderedDict([
+        ('template', name),
+        ('lex_ms', (lexed - start) * 1000),
+        ('parse_ms', (parsed - lexed) * 1000),
+        ('compile_ms', (parsed - start) * 1000),
+        ('tokens', token_count),
+        # Includes the nested nodes (e.g. within blocks)
+        ('nodes', len(nodelist.get_nodes_by_type(Node)))
+    ])
+
+
+def get_compile_statistics(records, percents=PERCENTS):
+    """
+    Get the percentiles of the templates' compile times and sizes.
+
+    :records: a list of records returned by profile_compile
+    :percents: an iterable of percents (100 = the maximum)
+    :returns: OrderedDict ({'lex_ms': [percentiles], ...})
+    """
+    return OrderedDict(
+        (key, get_percentiles([record[key] for record in records], percents))
+        for key in STATISTICS)
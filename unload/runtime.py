@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.template.base import FilterExpression, Node
+from django.template.loaders import cached
+from django.template.smartif import TokenBase
+from django.utils import six
+
+from .compat import TOKEN_BLOCK, get_lexer, get_parser
+from .settings import BUILT_IN_FILTERS, BUILT_IN_TAG_VALUES, BUILT_IN_TAGS
+from .utils import write_atomic
+
+# Increase whenever the format of the profile file changes
+PROFILE_VERSION = 1
+# The share of the renders whose tags and filters are recorded
+SAMPLE_RATE = 0.01
+# The minimal number of seconds between two writes of the profile file
+FLUSH_INTERVAL = 60
+# Every n-th render of a template (in each thread) checks whether the profile
+# file is due to be written
+FLUSH_CHECK_INTERVAL = 10
+
+_runtime_profiler = None
+_runtime_profiler_lock = threading.Lock()
+
+
+def get_default_profile_path():
+    """
+    Get the default location of the profile file.
+
+    The file is located in $XDG_CACHE_HOME/django-unload (~/.cache by
+    default); the placeholder {pid} is replaced by the process ID, so the
+    processes of a server do not overwrite each other's profile.
+
+    :returns: String
+    """
+    cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                  os.path.join(os.path.expanduser('~'), '.cache'))
+
+    return os.path.join(cache_home, 'django-unload', 'profile-{pid}.json')
+
+
+class ThreadCounters(object):
+    """
+    The counters of a single thread.
+
+    Only the owning thread modifies the counters, so they are updated
+    without locks; the profiler copies them when the profile is written.
+    """
+
+    def __init__(self):
+        # {template: the number of renders}
+        self.renders = {}
+        # {template: the number of renders whose tags/filters were recorded}
+        self.sampled = {}
+        # {template: {'tag_name': the number of executions}}
+        self.tags = {}
+        # {template: {'filter_name': the number of executions}}
+        self.filters = {}
+
+
+class RuntimeProfiler(object):
+    """
+    Records the renders of templates and the custom tags and filters that
+    are executed while rendering them.
+
+    Every render of an instrumented template is counted. Only a sample of
+    the renders (every n-th render of each template in each thread) uses an
+    instrumented copy of the template's nodelist, which counts the executed
+    tags and filters. The remaining renders use the template's own nodelist,
+    so their overhead is limited to updating the render count.
+
+    The counters are kept per thread and written to the profile file (a JSON
+    object) at most once per flush interval and when the process exits. The
+    flush interval is checked on every n-th render of each template, whether
+    it is sampled or not.
+    """
+
+    def __init__(self, path=None, sample_rate=SAMPLE_RATE,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = (path or get_default_profile_path()).format(
+            pid=os.getpid())
+        self.sample_rate = sample_rate
+        # Every n-th render of a template is sampled (0 = none)
+        self.sample_interval = (int(round(1.0 / sample_rate))
+                                if sample_rate > 0 else 0)
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        # The counters of all threads (including the finished ones)
+        self._counters = []
+        self._counters_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.time()
+
+    def get_counters(self):
+        """
+        Get the counters of the current thread.
+
+        :returns: ThreadCounters object
+        """
+        try:
+            return self._local.counters
+        except AttributeError:
+            counters = ThreadCounters()
+            with self._counters_lock:
+                self._counters.append(counters)
+            self._local.counters = counters
+            return counters
+
+    def instrument(self, template, source=None, name=None):
+        """
+        Count the renders of the compiled template and record the executed
+        tags and filters of the sampled renders.
+
+        The template is instrumented only once; its own nodelist is not
+        modified.
+
+        :template: Template object
+        :source: String; the template's contents (defaults to the template's
+            source attribute); only the renders are counted if the source is
+            not available
+        :name: String; the name the template is recorded under (defaults to
+            the name of the template's origin, i.e. usually its path)
+        """
+        if getattr(template, '_unload_profiled', False):
+            return
+        template._unload_profiled = True
+
+        if name is None:
+            origin = getattr(template, 'origin', None)
+            name = getattr(origin, 'name', None) or template.name
+        if source is None:
+            source = getattr(template, 'source', None)
+        render = template._render
+        local = self._local
+        interval = self.sample_interval
+        check_interval = FLUSH_CHECK_INTERVAL
+        profiler = self
+
+        def profiled_render(context):
+            try:
+                counters = local.counters
+            except AttributeError:
+                counters = profiler.get_counters()
+            renders = counters.renders
+            count = renders.get(name, 0) + 1
+            renders[name] = count
+            if not count % check_interval:
+                profiler.flush_if_due()
+            if interval and not count % interval and source is not None:
+                return profiler.render_sampled(template, render, source, name,
+                                               context)
+            return render(context)
+
+        template._render = profiled_render
+
+    def render_sampled(self, template, render, source, name, context):
+        """
+        Render the template using the instrumented copy of its nodelist,
+        which is compiled when the template is sampled for the first time.
+
+        :template: Template object
+        :render: the template's original _render method
+        :source: String; the template's contents
+        :name: String; the name the template is recorded under
+        :context: Context object
+        :returns: String
+        """
+        nodelist = getattr(template, '_unload_nodelist', False)
+        if nodelist is False:
+            nodelist = self.compile_nodelist(template, source, name)
+            template._unload_nodelist = nodelist
+        if nodelist is None:
+            return render(context)
+
+        sampled = self.get_counters().sampled
+        sampled[name] = sampled.get(name, 0) + 1
+        return nodelist.render(context)
+
+    def compile_nodelist(self, template, source, name):
+        """
+        Compile an instrumented copy of the template's nodelist.
+
+        :template: Template object
+        :source: String; the template's contents
+        :name: String; the name the template is recorded under
+        :returns: NodeList object or None if the template cannot be compiled
+        """
+        origin = getattr(template, 'origin', None)
+        engine = template.engine
+        try:
+            tokens = get_lexer(source, origin, debug=engine.debug).tokenize()
+            parser = get_parser(tokens, engine, origin)
+            extend_nodelist = parser.extend_nodelist
+
+            def record_token(nodelist, node, token):
+                # Django 1.8 does not store the node's token
+                node.token = token
+                return extend_nodelist(nodelist, node, token)
+
+            parser.extend_nodelist = record_token
+            nodelist = parser.parse()
+        except Exception:
+            return None
+
+        self.instrument_nodelist(nodelist, name)
+
+        return nodelist
+
+    def instrument_nodelist(self, nodelist, name):
+        """
+        Count the executions of the custom tags and filters in the nodelist.
+
+        :nodelist: NodeList object
+        :name: String; the name the template is recorded under
+        """
+        expressions = set()
+        for node in nodelist.get_nodes_by_type(Node):
+            token = getattr(node, 'token', None)
+            if token is not None and token.token_type == TOKEN_BLOCK:
+                tag_name = token.contents.split()[0]
+                if (tag_name not in BUILT_IN_TAGS and
+                        tag_name not in BUILT_IN_TAG_VALUES):
+                    node.render = self.wrap(node.render, self.tags_of(name),
+                                            tag_name)
+            for value in vars(node).values():
+                for expression in iter_filter_expressions(value):
+                    if id(expression) not in expressions:
+                        expressions.add(id(expression))
+                        self.instrument_filters(expression, name)
+
+    def instrument_filters(self, expression, name):
+        """
+        Count the executions of the custom filters of the expression.
+
+        :expression: FilterExpression object
+        :name: String; the name the template is recorded under
+        """
+        for index, (func, args) in enumerate(expression.filters):
+            filter_name = getattr(func, '_filter_name', None)
+            if filter_name is None or filter_name in BUILT_IN_FILTERS:
+                continue
+            expression.filters[index] = (
+                self.wrap(func, self.filters_of(name), filter_name), args)
+
+    def tags_of(self, name):
+        """
+        Get a function returning the tag counters of the template in the
+        current thread.
+
+        :name: String; the name the template is recorded under
+        :returns: a function without arguments returning a dict
+        """
+        return lambda: self.get_counters().tags.setdefault(name, {})
+
+    def filters_of(self, name):
+        """
+        Get a function returning the filter counters of the template in the
+        current thread.
+
+        :name: String; the name the template is recorded under
+        :returns: a function without arguments returning a dict
+        """
+        return lambda: self.get_counters().filters.setdefault(name, {})
+
+    def wrap(self, func, get_counts, member):
+        """
+        Wrap the function so that its calls are counted.
+
+        The wrapper keeps the function's attributes (e.g. is_safe), which
+        Django reads from filter functions.
+
+        :func: a callable
+        :get_counts: a function returning the dict the call is counted in
+        :member: String; the name of the tag or filter
+        :returns: a callable
+        """
+        def counted(*args, **kwargs):
+            counts = get_counts()
+            counts[member] = counts.get(member, 0) + 1
+            return func(*args, **kwargs)
+
+        try:
+            return functools.wraps(func)(counted)
+        except AttributeError:
+            # e.g. callable objects without a name on Python 2
+            return counted
+
+    def get_profile(self):
+        """
+        Get the counters of all threads.
+
+        The counters are copied without stopping the threads, so the
+        profile may miss the updates made while it is being created.
+
+        :returns: a JSON-serializable dict
+        """
+        with self._counters_lock:
+            all_counters = list(self._counters)
+
+        profile = {'version': PROFILE_VERSION, 'pid': os.getpid(),
+                   'sample_rate': self.sample_rate, 'renders': {},
+                   'sampled_renders': {}, 'tags': {}, 'filters': {}}
+        for counters in all_counters:
+            merge_counts(profile['renders'], dict(counters.renders))
+            merge_counts(profile['sampled_renders'], dict(counters.sampled))
+            for key in ('tags', 'filters'):
+                for name, counts in dict(getattr(counters, key)).items():
+                    merge_counts(profile[key].setdefault(name, {}),
+                                 dict(counts))
+
+        return profile
+
+    def flush(self):
+        """
+        Write the profile to the profile file.
+        """
+        self._last_flush = time.time()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # json.dumps returns a byte string on Python 2
+        contents = six.text_type(json.dumps(self.get_profile(),
+                                            sort_keys=True))
+        write_atomic(self.path, contents)
+
+    def flush_if_due(self):
+        """
+        Write the profile unless it was written within the flush interval or
+        another thread is writing it.
+        """
+        if time.time() - self._last_flush < self.flush_interval:
+            return
+        if not self._flush_lock.acquire(False):
+            return
+        try:
+            self.flush()
+        finally:
+            self._flush_lock.release()
+
+
+def iter_filter_expressions(value):
+    """
+    Find the filter expressions stored in a node's attribute, e.g. in lists
+    of arguments or in the conditions of the if tag.
+
+    :value: the value of the attribute
+    :returns: an iterator of FilterExpression objects
+    """
+    if isinstance(value, FilterExpression):
+        yield value
+        return
+
+    if isinstance(value, (list, tuple)):
+        items = value
+    elif isinstance(value, dict):
+        items = value.values()
+    elif isinstance(value, TokenBase):
+        # The operators and literals of the if tag's condition
+        items = [getattr(value, attribute, None)
+                 for attribute in ('value', 'first', 'second')]
+    else:
+        items = ()
+    for item in items:
+        for expression in iter_filter_expressions(item):
+            yield expression
+
+
+def merge_counts(totals, counts):
+    """
+    Add the counts to the totals.
+
+    :totals: {key: Integer}
+    :counts: {key: Integer}
+    """
+    for key, count in counts.items():
+        totals[key] = totals.get(key, 0) + count
+
+
+def get_runtime_profiler():
+    """
+    Get the process-wide runtime profiler (created on first use).
+
+    The profiler is configured using the UNLOAD_PROFILER_FILE,
+    UNLOAD_PROFILER_SAMPLE_RATE and UNLOAD_PROFILER_FLUSH_INTERVAL settings
+    and it writes the profile when the process exits.
+
+    :returns: RuntimeProfiler
+    """
+    global _runtime_profiler
+    with _runtime_profiler_lock:
+        if _runtime_profiler is None:
+            _runtime_profiler = RuntimeProfiler(
+                path=getattr(settings, 'UNLOAD_PROFILER_FILE', None),
+                sample_rate=getattr(settings, 'UNLOAD_PROFILER_SAMPLE_RATE',
+                                    SAMPLE_RATE),
+                flush_interval=getattr(settings,
+                                       'UNLOAD_PROFILER_FLUSH_INTERVAL',
+                                       FLUSH_INTERVAL))
+            atexit.register(_runtime_profiler.flush)
+
+    return _runtime_profiler
+
+
+class Loader(cached.Loader):
+    """
+    A cached template loader that instruments the loaded templates using
+    the process-wide runtime profiler.
+
+    Replace Django's cached loader in the engine's options:
+
+        'loaders': [
+            ('unload.runtime.Loader', [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ]),
+        ]
+    """
+
+    def __init__(self, engine, loaders):
+        super(Loader, self).__init__(engine, loaders)
+        self.profiler = get_runtime_profiler()
+
+    def get_template(self, *args, **kwargs):
+        """
+        Get the cached template and instrument it (Django 1.9+).
+        """
+        template = super(Loader, self).get_template(*args, **kwargs)
+        if not getattr(template, '_unload_profiled', False):
+            self.profiler.instrument(template)
+
+        return template
+
+    def load_template(self, template_name, template_dirs=None):
+        """
+        Get the cached template and instrument it (Django 1.8).
+        """
+        template, origin = super(Loader, self).load_template(template_name,
+                                                             template_dirs)
+        if (hasattr(template, 'render') and
+                not getattr(template, '_unload_profiled', False)):
+            source, name = self.load_template_source(template_name,
+                                                     template_dirs)
+            self.profiler.instrument(template, source=source, name=name)
+
+        return template, origin
+
+    def load_template_source(self, template_name, template_dirs=None):
+        """
+        Get the template's contents and path from the wrapped loaders
+        (Django 1.8 does not store them in the template).
+
+        :returns: a tuple (contents, path) or (None, None)
+        """
+        for loader in self.loaders:
+            try:
+                return loader.load_template_source(template_name,
+                                                   template_dirs)
+            except Exception:
+                continue
+
+        return None, None
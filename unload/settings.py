@@ -95,3 +95,37 @@ elif six.PY3:
                               list(L10N_TAGS.values()) +
                               list(CACHE_TAGS.values()) +
                               list(STATIC_TAGS.values()))
+
+# The extensions of files that are scanned as templates (case insensitive).
+# Override using the UNLOAD_TEMPLATE_EXTENSIONS setting; add an empty string
+# to scan files without an extension.
+TEMPLATE_EXTENSIONS = (
+    '.css',
+    '.csv',
+    '.email',
+    '.htm',
+    '.html',
+    '.ics',
+    '.js',
+    '.json',
+    '.md',
+    '.rst',
+    '.svg',
+    '.tpl',
+    '.tsv',
+    '.txt',
+    '.vcf',
+    '.xml'
+)
+
+# The names of directories that are never scanned. Extend using the
+# UNLOAD_IGNORED_DIRECTORIES setting.
+IGNORED_DIRECTORIES = (
+    '.git',
+    '.hg',
+    '.svn',
+    '.tox',
+    '__pycache__',
+    'bower_components',
+    'node_modules'
+)
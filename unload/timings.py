@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import os
+from collections import OrderedDict
+
+from django.utils import six
+
+from .utils import get_percentiles, write_atomic
+
+# time.perf_counter (a monotonic clock) was added in Python 3.3
+try:
+    from time import perf_counter
+except ImportError:
+    from timeit import default_timer as perf_counter
+
+# The phases of a scan ({phase: label}); the phases from read to libraries
+# are measured for every analyzed template
+PHASES = OrderedDict([
+    ('discovery', 'Discovery'),
+    ('read', 'Read'),
+    ('compile', 'Compile'),
+    ('lex', 'Lex'),
+    ('libraries', 'Library resolution'),
+    ('analysis', 'Analysis'),
+    ('output', 'Output')
+])
+# The percentiles of the per-template durations
+TIMING_PERCENTS = (50, 90, 99)
+# The span covering the entire analysis of a template (see PhaseRecorder)
+TEMPLATE_SPAN = 'analyze'
+
+
+class PhaseTimer(object):
+    """
+    A context manager adding its block to a recorder's phase (measured using
+    the recorder's timer).
+    """
+
+    def __init__(self, recorder, phase, name=None):
+        self.recorder = recorder
+        self.phase = phase
+        self.name = name
+        self.timer = recorder.timer
+        self.start = None
+
+    def __enter__(self):
+        self.start = self.timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add(self.phase, self.start, self.timer(),
+                          name=self.name)
+
+
+class NullTimer(object):
+    """
+    A context manager measuring nothing (the timings are disabled).
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def time_phase(recorder, phase, name=None):
+    """
+    Measure the duration of a phase.
+
+    :recorder: PhaseRecorder or ScanTimings object or None (nothing is
+        measured)
+    :phase: String; one of PHASES
+    :name: String; the template the phase belongs to (used in traces)
+    :returns: a context manager
+    """
+    if recorder is None:
+        return NULL_TIMER
+
+    return PhaseTimer(recorder, phase, name=name)
+
+
+class PhaseRecorder(object):
+    """
+    The durations of the phases of a single template's analysis.
+
+    The recorder is created in the process analyzing the template and sent
+    along with its result (see TemplateResult.timings).
+    """
+
+    def __init__(self, name=None, trace=False, timer=perf_counter):
+        self.name = name
+        self.timer = timer
+        # {phase: seconds}
+        self.durations = OrderedDict()
+        # A list of tuples (pid, phase, start, end, template) or None
+        self.spans = [] if trace else None
+        self.started = timer()
+
+    def add(self, phase, start, end, name=None):
+        """
+        Add a measured phase.
+
+        :phase: String; one of PHASES
+        :start: Float; the timer's value at the start of the phase
+        :end: Float; the timer's value at the end of the phase
+        :name: String; the template (defaults to the recorder's template)
+        """
+        self.durations[phase] = self.durations.get(phase, 0) + end - start
+        if self.spans is not None:
+            self.spans.append((os.getpid(), phase, start, end,
+                               name or self.name))
+
+    def stop(self):
+        """
+        Finish the analysis of the template; the whole analysis is recorded
+        as a span if the phases are traced.
+        """
+        if self.spans is not None:
+            self.spans.append((os.getpid(), TEMPLATE_SPAN, self.started,
+                               self.timer(), self.name))
+
+
+class ScanTimings(object):
+    """
+    The time spent in each phase of a scan.
+
+    The phases of the analyzed templates are measured in the process
+    analyzing them (see TemplateResult.timings), so with several worker
+    processes the totals of these phases are the sum of the workers' times
+    and may exceed the elapsed time. The results of cached templates are not
+    analyzed; only their reads are measured.
+
+    If the scan is traced, the spans of all phases are kept along with the
+    processes they were measured in (see get_trace_events). The timer must
+    be shared by all processes (perf_counter uses a system-wide clock).
+    """
+
+    def __init__(self, timer=perf_counter, trace=False):
+        self.timer = timer
+        self.trace = trace
+        # {phase: seconds}
+        self.totals = OrderedDict((phase, 0.0) for phase in PHASES)
+        # {phase: [seconds per analyzed template]}
+        self.template_durations = OrderedDict(
+            (phase, []) for phase in PHASES)
+        # A list of tuples (pid, phase, start, end, template) or None
+        self.spans = [] if trace else None
+        # The number of scanned templates (including the cached ones)
+        self.templates = 0
+        self.pid = os.getpid()
+        self.started = timer()
+        self.stopped = None
+
+    def add(self, phase, start, end, name=None):
+        """
+        Add a phase measured in the current process.
+
+        :phase: String; one of PHASES
+        :start: Float; the timer's value at the start of the phase
+        :end: Float; the timer's value at the end of the phase
+        :name: String; the template the phase belongs to or None
+        """
+        self.totals[phase] += end - start
+        if self.spans is not None:
+            self.spans.append((self.pid, phase, start, end, name))
+
+    def add_template(self, recorder=None):
+        """
+        Add a scanned template.
+
+        :recorder: PhaseRecorder object or None (e.g. a cached result)
+        """
+        self.templates += 1
+        if recorder is None:
+            return
+        for phase, seconds in recorder.durations.items():
+            self.totals[phase] += seconds
+            self.template_durations[phase].append(seconds)
+        if self.spans is not None and recorder.spans:
+            self.spans.extend(recorder.spans)
+
+    def stop(self):
+        """
+        Stop measuring the elapsed time.
+        """
+        self.stopped = self.timer()
+
+    @property
+    def elapsed(self):
+        """
+        The seconds elapsed since the scan started (until it was stopped).
+        """
+        return (self.stopped or self.timer()) - self.started
+
+    def get_summary(self, percents=TIMING_PERCENTS):
+        """
+        Get the totals, the percentiles of the per-template durations and
+        the throughput of the scan.
+
+        :percents: an iterable of integers (1-100)
+        :returns: OrderedDict (with the keys templates, elapsed_ms,
+            templates_per_second and phases, i.e. {phase: OrderedDict with
+            the keys total_ms and the percentiles, e.g. p50})
+        """
+        elapsed = self.elapsed
+        phases = OrderedDict()
+        for phase, total in self.totals.items():
+            phases[phase] = OrderedDict([('total_ms', total * 1000)])
+            percentiles = get_percentiles(
+                [seconds * 1000
+                 for seconds in self.template_durations[phase]], percents)
+            for percent, value in zip(percents, percentiles):
+                phases[phase]['p{}'.format(percent)] = value
+
+        return OrderedDict([
+            ('templates', self.templates),
+            ('elapsed_ms', elapsed * 1000),
+            ('templates_per_second',
+             float(self.templates) / elapsed if elapsed > 0 else None),
+            ('phases', phases)
+        ])
+
+    def get_trace_events(self):
+        """
+        Convert the spans to events of the Chrome trace event format, which
+        can be viewed using chrome://tracing or ui.perfetto.dev.
+
+        Every process is displayed as a separate track. The span of a
+        template's entire analysis is named after the template, the spans of
+        the phases after the phase.
+
+        :returns: a list of JSON-serializable dicts (the timestamps are in
+            microseconds since the start of the scan)
+        """
+        events = []
+        for pid in sorted(set(span[0] for span in self.spans or ())):
+            name = 'main' if pid == self.pid else 'worker {}'.format(pid)
+            events.append(OrderedDict([
+                ('name', 'process_name'), ('ph', 'M'), ('pid', pid),
+                ('tid', pid), ('args', {'name': name})
+            ]))
+        for pid, phase, start, end, template in self.spans or ():
+            event = OrderedDict([
+                ('name', template if phase == TEMPLATE_SPAN else phase),
+                ('cat', phase),
+                ('ph', 'X'),
+                ('ts', (start - self.started) * 1e6),
+                ('dur', (end - start) * 1e6),
+                ('pid', pid),
+                ('tid', pid)
+            ])
+            if template is not None:
+                event['args'] = {'template': template}
+            events.append(event)
+
+        return events
+
+    def write_trace(self, path):
+        """
+        Write the trace events to a JSON file (see get_trace_events).
+
+        :path: String; the path to the trace file
+        """
+        trace = OrderedDict([('traceEvents', self.get_trace_events()),
+                             ('displayTimeUnit', 'ms')])
+        # json.dumps returns a byte string on Python 2
+        write_atomic(path, six.text_type(json.dumps(trace)))
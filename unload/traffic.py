@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import os
+from collections import OrderedDict
+
+from django.utils import six
+
+from .impact import get_unnecessary_loads
+from .utils import get_contents
+
+
+class RenderCounts(object):
+    """
+    The number of renders of each template, e.g. exported from access logs
+    or recorded by the runtime profiler (see unload.runtime).
+
+    A template is looked up by its absolute path and by its name relative
+    to the engine's template directories (e.g. 'app/page.html'), i.e. the
+    name passed to get_template.
+    """
+
+    def __init__(self, counts=None):
+        # {template: the number of renders}
+        self.counts = {}
+        if counts:
+            self.update(counts)
+
+    def update(self, counts):
+        """
+        Add the render counts; the counts of the same template are summed.
+
+        :counts: {template: the number of renders}
+        """
+        for name, count in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def get(self, filepath, template_dirs=()):
+        """
+        Get the number of renders of the template.
+
+        :filepath: String; the absolute path to the template file
+        :template_dirs: the engine's template directories
+        :returns: Integer (0 if the template is not listed)
+        """
+        count = self.counts.get(filepath)
+        if count is not None:
+            return count
+        for directory in template_dirs:
+            name = os.path.relpath(filepath, directory)
+            if name.startswith(os.pardir):
+                continue
+            count = self.counts.get(name.replace(os.sep, '/'))
+            if count is not None:
+                return count
+
+        return 0
+
+    def load(self, path):
+        """
+        Add the render counts from a file.
+
+        The file is either a JSON object mapping templates to render counts,
+        a profile written by the runtime profiler or a CSV file whose rows
+        contain a template and its render count (a header is optional).
+
+        :path: String; the path to the file
+        :raises: ValueError if the file's format is invalid
+        """
+        contents = get_contents(filepath=path)
+        if path.lower().endswith('.csv'):
+            counts = parse_csv_counts(contents)
+        else:
+            counts = json.loads(contents)
+            # A profile written by the runtime profiler
+            if isinstance(counts, dict) and 'version' in counts:
+                counts = counts.get('renders')
+        if not isinstance(counts, dict) or not all(
+                isinstance(name, six.string_types) and
+                isinstance(count, six.integer_types) and count >= 0
+                for name, count in counts.items()):
+            raise ValueError('{} does not map templates to render '
+                             'counts.'.format(path))
+        self.update(counts)
+
+    @classmethod
+    def from_files(cls, paths):
+        """
+        Load and merge the render counts of several files (e.g. the profiles
+        of all processes of a server).
+
+        :paths: an iterable of file paths
+        :returns: RenderCounts object
+        """
+        render_counts = cls()
+        for path in paths:
+            render_counts.load(path)
+
+        return render_counts
+
+
+def parse_csv_counts(contents):
+    """
+    Parse the rows of a CSV file containing a template and its render
+    count. The template is separated from the count by the row's last
+    comma, so the template's name may contain commas.
+
+    :contents: String; the file's contents
+    :returns: {template: the number of renders}
+    :raises: ValueError if a row (other than the header) is invalid
+    """
+    counts = {}
+    for number, line in enumerate(contents.splitlines()):
+        if not line.strip():
+            continue
+        name, _, count = line.rpartition(',')
+        name = name.strip().strip('"')
+        try:
+            count = int(count.strip().strip('"'))
+        except ValueError:
+            # The header
+            if number == 0:
+                continue
+            raise ValueError('Invalid render count on line {}: '
+                             '{}'.format(number + 1, line))
+        counts[name] = counts.get(name, 0) + count
+
+    return counts
+
+
+def prioritize_results(results, render_counts, template_dirs=()):
+    """
+    Sort the templates by the estimated work wasted by their unnecessary
+    loads, i.e. the number of their unnecessary loads (see
+    get_unnecessary_loads) multiplied by the number of their renders.
+
+    :results: an iterable of TemplateResult objects
+    :render_counts: RenderCounts object
+    :template_dirs: the engine's template directories
+    :returns: a tuple (a list of TemplateResult objects, {template:
+        OrderedDict with the keys renders and wasted_loads})
+    """
+    weights = {}
+    prioritized = []
+    for result in results:
+        renders = render_counts.get(result.name, template_dirs)
+        weights[result.name] = OrderedDict([
+            ('renders', renders),
+            ('wasted_loads', renders * len(get_unnecessary_loads(result)))
+        ])
+        prioritized.append(result)
+    prioritized.sort(key=lambda result: (
+        -weights[result.name]['wasted_loads'],
+        -weights[result.name]['renders'], result.name))
+
+    return prioritized, weights
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import sys
+from collections import OrderedDict
+
+from .compat import (InvalidTemplateLibrary,
+                     get_builtin_libraries,
+                     get_templatetag_library)
+from .libraries import get_library_index
+from .utils import get_module_file, get_package_trie
+
+# Libraries used by at least this share of the templates are recommended
+# for the 'builtins' option
+PROMOTE_THRESHOLD = 0.5
+# Built-in libraries used by less than this share of the templates are
+# recommended for removal from the 'builtins' option
+DEMOTE_THRESHOLD = 0.05
+
+
+class LibraryUsage(object):
+    """
+    The usage of templatetags libraries aggregated over many templates.
+
+    A used tag or filter is attributed to the loaded libraries providing it.
+    If none of them is loaded (e.g. the library is a built-in library or the
+    load is missing), it is attributed to every library providing it, so
+    a library is never reported as unused because of a name collision.
+    """
+
+    def __init__(self, library_index=None):
+        self.library_index = library_index or get_library_index()
+        # The number of aggregated templates
+        self.templates = 0
+        # {library: {'tag_name': the number of templates using it}}
+        self.tags = {}
+        # {library: {'filter_name': the number of templates using it}}
+        self.filters = {}
+        # {library: the number of templates using its tags or filters}
+        self.libraries = {}
+        # {library: the number of templates loading it}
+        self.loads = {}
+        # The names of the installed libraries in the engines' builtins
+        self.builtins = set()
+        # The names of tags and filters provided by the engines' builtins
+        self.builtin_members = set()
+
+    def add_builtins(self, engine):
+        """
+        Add the engine's built-in libraries (e.g. the 'builtins' option).
+
+        Only the installed libraries (i.e. modules in the templatetags
+        packages) are recognized by their names.
+
+        :engine: Engine object
+        """
+        builtin_libraries = get_builtin_libraries(engine)
+        self.builtin_members.update(
+            self.library_index.get_builtin_members(engine))
+        libraries = self.library_index.libraries
+        for module in libraries:
+            try:
+                lib = get_templatetag_library(module, libraries)
+            except (AttributeError, InvalidTemplateLibrary):
+                continue
+            if any(lib is builtin for builtin in builtin_libraries):
+                self.builtins.add(module)
+
+    def add(self, result):
+        """
+        Add the tags and filters used in the template.
+
+        :result: TemplateResult object
+        """
+        tag_providers, filter_providers = self.library_index.get_providers()
+        self.templates += 1
+        used_libraries = set()
+        used = [(tag_providers, result.used_tags, self.tags),
+                (filter_providers, result.used_filters, self.filters)]
+        for providers, used_members, counts in used:
+            for member in set(used_members):
+                libraries = providers.get(member, frozenset())
+                for module in (libraries.intersection(result.loaded_modules) or
+                               libraries):
+                    library_counts = counts.setdefault(module, {})
+                    library_counts[member] = library_counts.get(member, 0) + 1
+                    used_libraries.add(module)
+        for module in used_libraries:
+            self.libraries[module] = self.libraries.get(module, 0) + 1
+        for module in result.loaded_modules:
+            self.loads[module] = self.loads.get(module, 0) + 1
+
+    def get_project_libraries(self, pkg_locations=None):
+        """
+        Get the installed libraries located within the project, i.e. not in
+        3rd party packages (e.g. Django's own libraries).
+
+        :pkg_locations: PathTrie object (defaults to the installed packages)
+        :returns: a sorted list of library names
+        """
+        if pkg_locations is None:
+            pkg_locations = get_package_trie()
+
+        project_libraries = []
+        libraries = self.library_index.libraries
+        for module, module_path in sorted(libraries.items()):
+            # Imports the library
+            if self.library_index.get_members(module) is None:
+                continue
+            filepath = get_module_file(sys.modules.get(module_path))
+            if filepath and not pkg_locations.contains(filepath):
+                project_libraries.append(module)
+
+        return project_libraries
+
+    def get_dead_templatetags(self, pkg_locations=None):
+        """
+        Find the project's libraries, tags and filters that are not used in
+        any of the aggregated templates.
+
+        :pkg_locations: PathTrie object (defaults to the installed packages)
+        :returns: a list of records (OrderedDict objects with the keys
+            library, module, templates, unused_tags and unused_filters) of
+            libraries with unused members; templates is the number of
+            templates using the library (0 = the entire library is unused)
+        """
+        records = []
+        for module in self.get_project_libraries(pkg_locations):
+            tags, filters = self.library_index.get_members(module)
+            templates = self.libraries.get(module, 0)
+            unused_tags = sorted(tags.difference(self.tags.get(module, ())))
+            unused_filters = sorted(
+                filters.difference(self.filters.get(module, ())))
+            if templates and not unused_tags and not unused_filters:
+                continue
+            records.append(OrderedDict([
+                ('library', module),
+                ('module', self.library_index.libraries[module]),
+                ('templates', templates),
+                ('unused_tags', unused_tags),
+                ('unused_filters', unused_filters)
+            ]))
+
+        return records
+
+    def get_recommendation(self, module, promote_threshold=PROMOTE_THRESHOLD,
+                           demote_threshold=DEMOTE_THRESHOLD):
+        """
+        Recommend a change of the 'builtins' option for the library.
+
+        A library used by most templates is promoted unless one of its tags
+        or filters would replace a built-in one; templates loading it without
+        using it do not count. A built-in library used by only a few
+        templates is demoted.
+
+        :module: String; the library's name (e.g. 'app_tags')
+        :promote_threshold: Float; the minimal share of templates using the
+            library
+        :demote_threshold: Float; the share of templates using the built-in
+            library below which it is demoted
+        :returns: 'promote', 'demote' or None
+        """
+        if not self.templates:
+            return None
+
+        used_by = self.libraries.get(module, 0)
+        if module in self.builtins:
+            if used_by < demote_threshold * self.templates:
+                return 'demote'
+        elif used_by >= promote_threshold * self.templates:
+            members = self.library_index.get_members(module)
+            if (members is not None and
+                    self.builtin_members.isdisjoint(members[0]) and
+                    self.builtin_members.isdisjoint(members[1])):
+                return 'promote'
+
+        return None
+
+    def get_usage_report(self, promote_threshold=PROMOTE_THRESHOLD,
+                         demote_threshold=DEMOTE_THRESHOLD):
+        """
+        Get the load and usage counts of the loaded, used and built-in
+        libraries along with the recommended changes of the 'builtins'
+        option (see get_recommendation).
+
+        :promote_threshold: Float (see get_recommendation)
+        :demote_threshold: Float (see get_recommendation)
+        :returns: a list of records (OrderedDict objects with the keys
+            library, builtin, loaded_by, used_by and recommendation) sorted
+            by the number of templates loading the library
+        """
+        modules = set(self.loads).union(self.libraries, self.builtins)
+        records = []
+        for module in modules:
+            recommendation = self.get_recommendation(
+                module, promote_threshold=promote_threshold,
+                demote_threshold=demote_threshold)
+            records.append(OrderedDict([
+                ('library', module),
+                ('builtin', module in self.builtins),
+                ('loaded_by', self.loads.get(module, 0)),
+                ('used_by', self.libraries.get(module, 0)),
+                ('recommendation', recommendation)
+            ]))
+        records.sort(key=lambda record: (-record['loaded_by'],
+                                         -record['used_by'],
+                                         record['library']))
+
+        return records
@@ -2,19 +2,32 @@
 
 from __future__ import unicode_literals
 
+import hashlib
 import io
+import json
+import math
 import os
+import shutil
+import site
+import subprocess
 import sys
+import sysconfig
+import tempfile
 from copy import deepcopy
-from mimetypes import guess_type
 
 from django.apps import apps
 from django.conf import settings
 from django.template.backends.django import DjangoTemplates
-from pip import get_installed_distributions
+from django.utils import six
 from tabulate import tabulate
 
-from .compat import InvalidTemplateLibrary, get_templatetag_library
+from .compat import get_distribution_locations
+from .libraries import get_library_index
+from .paths import ExtensionFilter, PathTrie, filter_files, walk_files
+from .settings import IGNORED_DIRECTORIES, TEMPLATE_EXTENSIONS
+
+_package_locations = None
+_package_trie = None
 
 
 def get_app(app_label):
@@ -32,33 +45,33 @@ def get_app(app_label):
     return app
 
 
-def get_templates(directory, pkg_locations, app=None):
+def get_templates(directory, pkg_locations, app=None, filepaths=None):
     """
     Traverse the project's template directories and get the paths of template
     files.
 
     :directory: String; path to directory
-    :pkg_locations: a list of paths of 3rd party packages
+    :pkg_locations: PathTrie object or a collection of paths of 3rd party
+        packages
     :app: AppConfig object
+    :filepaths: an iterable of file paths or None; if supplied, only the
+        template files from the list are returned instead of traversing the
+        directory
 
-    :reeturns: a list of paths to template files
+    :returns: a list of paths to template files
     """
-    templates = []
-    within_project = True
-    for location in pkg_locations:
-        if directory.startswith(location):
-            within_project = False
-            break
+    if not isinstance(pkg_locations, PathTrie):
+        pkg_locations = PathTrie(pkg_locations)
+
+    within_project = not pkg_locations.contains(directory)
+    # Only one app needs to be scanned
+    if app and not PathTrie([app.path]).contains(directory):
+        within_project = False
     # Get the template files from the directory
-    if within_project:
-        # Only one app needs to be scanned
-        if app:
-            if directory.startswith(app.path):
-                templates = get_template_files(directory)
-        else:
-            templates += get_template_files(directory)
+    if not within_project:
+        return []
 
-    return templates
+    return get_template_files(directory, pkg_locations, filepaths=filepaths)
 
 
 def get_contents(filepath, encoding='UTF-8'):
@@ -76,10 +89,11 @@ def get_contents(filepath, encoding='UTF-8'):
         return fp.read()
 
 
-def get_djangotemplates_engines():
+def get_djangotemplates_engines(output=sys.stdout):
     """
     Create template engines from the parameters in the settings file.
 
+    :output: output destination (console=sys.stdout; testing=StringIO)
     :returns: a list of DjangoTemplates instances
     """
     engines = []
@@ -93,7 +107,7 @@ def get_djangotemplates_engines():
             copied_params['NAME'] = 'django'
             engines.append(DjangoTemplates(params=copied_params))
         else:
-            output_message(reason=2)
+            output_message(reason=2, output=output)
 
     return engines
 
@@ -123,56 +137,196 @@ def get_package_locations():
     """
     Get the paths of directories where 3rd packages are installed.
 
-    :returns: a list of absolute paths
+    The locations are resolved from the interpreter's installation schemes
+    (sysconfig), the site module and the metadata of installed distributions.
+    They are computed once per process.
+
+    :returns: a frozenset of normalized absolute paths
+    """
+    global _package_locations
+    if _package_locations is None:
+        paths = sysconfig.get_paths()
+        candidates = set([paths['purelib'], paths['platlib']])
+        # Not available in the site module of older virtualenv releases
+        if hasattr(site, 'getsitepackages'):
+            candidates.update(site.getsitepackages())
+        if site.ENABLE_USER_SITE:
+            candidates.add(site.getusersitepackages())
+        candidates.update(get_distribution_locations())
+
+        _package_locations = frozenset(
+            os.path.normcase(os.path.abspath(candidate))
+            for candidate in candidates if os.path.isdir(candidate))
+
+    return _package_locations
+
+
+def get_package_trie():
+    """
+    Get the locations of installed 3rd party packages as a path trie.
+
+    The trie is built once per process.
+
+    :returns: PathTrie object
     """
-    pkg_locations = []
-    installed_pkgs = get_installed_distributions(local_only=True,
-                                                 include_editables=False)
-    for pkg in installed_pkgs:
-        if pkg.location not in pkg_locations:
-            pkg_locations.append(pkg.location)
+    global _package_trie
+    if _package_trie is None:
+        _package_trie = PathTrie(get_package_locations())
 
-    return pkg_locations
+    return _package_trie
 
 
-def get_template_files(template_dir):
+def get_template_files(template_dir, exclude=None, filepaths=None):
     """
     Scan the provided template directory and its subdirectories for template
     files.
 
+    Files are recognized by their extensions (the UNLOAD_TEMPLATE_EXTENSIONS
+    setting). Directories listed in the UNLOAD_IGNORED_DIRECTORIES setting
+    are skipped, along with the default ones (e.g. node_modules).
+
+    :template_dir: String; path to directory
+    :exclude: PathTrie object; subdirectories located within the trie's
+        paths (e.g. installed packages) are not scanned
+    :filepaths: an iterable of file paths or None; if supplied, the files
+        from the list that would be found in the directory are returned
+        without scanning it
     :returns: a list of absolute paths to template files
     """
-    templates = []
-    for dirpath, dirnames, filenames in os.walk(template_dir):
-        for filename in filenames:
-            filetype = guess_type(filename)
-            if filetype != (None, None):
-                maintype, subtype = filetype[0].split('/')
-                if maintype == 'text':
-                    templates.append(os.path.join(dirpath, filename))
+    extensions = getattr(settings, 'UNLOAD_TEMPLATE_EXTENSIONS',
+                         TEMPLATE_EXTENSIONS)
+    ignored_names = set(IGNORED_DIRECTORIES)
+    ignored_names.update(getattr(settings, 'UNLOAD_IGNORED_DIRECTORIES', ()))
+
+    if filepaths is not None:
+        return filter_files(template_dir, filepaths,
+                            ExtensionFilter(extensions), ignored_names,
+                            exclude)
+
+    return walk_files(template_dir, ExtensionFilter(extensions),
+                      ignored_names, exclude)
+
+
+def get_modification_stamp(filepath):
+    """
+    Get a value that changes whenever the file is modified.
+
+    :filepath: String
+    :returns: a tuple (modification time, size) or None if the file does not
+        exist
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+
+    return stat.st_mtime, stat.st_size
+
+
+def get_module_file(module):
+    """
+    Get the source file of the imported Python module.
+
+    :module: module object
+    :returns: String or None
+    """
+    filepath = getattr(module, '__file__', None)
+    if filepath and filepath.endswith(('.pyc', '.pyo')):
+        filepath = filepath[:-1]
+
+    return filepath
+
+
+def parse_shard(value):
+    """
+    Parse the shard specification supplied by the user.
+
+    :value: String; 'INDEX/COUNT', e.g. '1/4' (the index starts at 1)
+    :returns: a tuple (index, count)
+    :raises: ValueError (invalid specification)
+    """
+    index, separator, count = value.partition('/')
+    if not separator or not index.isdigit() or not count.isdigit():
+        raise ValueError('The shard must be specified as INDEX/COUNT.')
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError('The shard index must be between 1 and the number '
+                         'of shards.')
+
+    return index, count
+
+
+def get_shard_index(filepath, count, root=None):
+    """
+    Get the shard the template file is assigned to.
+
+    The assignment depends only on the file's path relative to the project's
+    root, so every runner assigns the file to the same shard, regardless of
+    the operating system or the location of the checkout.
 
-    return templates
+    :filepath: String; the path to the template file
+    :count: Integer; the number of shards
+    :root: String; the project's root directory (the current working
+        directory by default)
+    :returns: Integer (between 1 and count)
+    """
+    relative_path = os.path.relpath(filepath, root or os.getcwd())
+    relative_path = relative_path.replace(os.sep, '/')
+    digest = hashlib.sha1(relative_path.encode('utf-8')).hexdigest()
+
+    return int(digest[:8], 16) % count + 1
+
+
+def get_changed_files(revision):
+    """
+    Get the files changed in the local git repository since the revision.
 
+    Both committed and uncommitted changes are included, along with
+    untracked files that are not ignored. Deleted files are omitted.
 
-def get_templatetag_members(template_name, loaded_modules, output=sys.stdout):
+    :revision: String; a git revision (e.g. 'origin/master' or a hash)
+    :returns: a sorted list of absolute file paths
+    :raises: OSError (git is not installed) or CalledProcessError (e.g. an
+        unknown revision or the directory is not a repository)
+    """
+    def run_git(*args):
+        output = subprocess.check_output(('git',) + args)
+        return output.decode(sys.getfilesystemencoding() or 'UTF-8')
+
+    toplevel = run_git('rev-parse', '--show-toplevel').strip()
+    changed = run_git('diff', '--name-only', '--diff-filter=d', '-z',
+                      revision, '--').split('\0')
+    untracked = run_git('ls-files', '--others', '--exclude-standard',
+                        '--full-name', '-z').split('\0')
+
+    return sorted(set(os.path.join(toplevel, path)
+                      for path in changed + untracked if path))
+
+
+def get_templatetag_members(template_name, loaded_modules, output=sys.stdout,
+                            library_index=None):
     """
     Get the names of tags and filters from available templatetags modules.
 
-    :returns: {'somelib': [tags]}, {'somelib': [filters]}
+    :template_name: String
+    :loaded_modules: {'somelib': [line_numbers]}
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :library_index: LibraryIndex object (defaults to the process-wide index)
+    :returns: {'somelib': frozenset(tags)}, {'somelib': frozenset(filters)}
     """
+    if library_index is None:
+        library_index = get_library_index()
+
     tags = {}
     filters = {}
     for module in loaded_modules:
-        try:
-            lib = get_templatetag_library(module)
-        except (AttributeError, InvalidTemplateLibrary):
+        members = library_index.get_members(module)
+        if members is None:
             msg = ('Unable to locate the loaded library! Library: {}; '
                    'Template: {}\n').format(module, template_name)
             output.write(msg)
-            tags[module] = []
-            continue
-        tags[module] = lib.tags.keys()
-        filters[module] = lib.filters.keys()
+            members = (frozenset(), frozenset())
+        tags[module], filters[module] = members
 
     return tags, filters
 
@@ -200,6 +354,42 @@ def output_as_table(table, headers, output=sys.stdout, tablefmt='psql'):
     output.write(tabulate(table, headers, tablefmt=tablefmt) + '\n')
 
 
+def output_as_json_line(record, output=sys.stdout):
+    """
+    Output the record as a single line of JSON (JSON Lines).
+
+    The output is flushed, so consumers receive the record immediately.
+
+    :record: a JSON-serializable dict
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    """
+    output.write(six.text_type(json.dumps(record)) + '\n')
+    output.flush()
+
+
+def output_as_json(records, output=sys.stdout):
+    """
+    Output the records as an indented JSON array.
+
+    :records: a list of JSON-serializable dicts
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    """
+    # The separators avoid trailing whitespace on Python 2
+    contents = json.dumps(records, indent=2, separators=(',', ': '))
+    output.write(six.text_type(contents) + '\n')
+
+
+def output_cache_statistics(hits, misses, output=sys.stdout):
+    """
+    Output the number of templates answered from the result cache.
+
+    :hits: Integer; the number of templates found in the cache
+    :misses: Integer; the number of analyzed templates
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    """
+    output.write('Cache hits: {}; cache misses: {}\n'.format(hits, misses))
+
+
 def output_message(reason, output=sys.stdout):
     """
     Output a message to the console.
@@ -215,6 +405,37 @@ def output_message(reason, output=sys.stdout):
     output.write(reasons[reason] + '\n')
 
 
+def write_atomic(filepath, contents, encoding='UTF-8'):
+    """
+    Write the contents to the file atomically.
+
+    The contents are written to a temporary file in the same directory,
+    which then replaces the file. Readers never see a partially written file.
+
+    :filepath: absolute path to the file
+    :contents: String
+    :encoding: String
+    """
+    directory = os.path.dirname(filepath)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.unload-')
+    try:
+        with io.open(fd, 'w', encoding=encoding, newline='') as fp:
+            fp.write(contents)
+        if os.path.exists(filepath):
+            # Preserve the permissions of the original file
+            shutil.copymode(filepath, temp_path)
+        try:
+            os.rename(temp_path, filepath)
+        except OSError:
+            # Windows does not replace existing files
+            os.remove(filepath)
+            os.rename(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
 def update_dictionary(dictionary, key, value):
     """
     Add the key-value pair to the dictionary and return the dictionary.
@@ -232,3 +453,25 @@ def update_dictionary(dictionary, key, value):
             dictionary[key].append(value)
 
     return dictionary
+
+
+def get_percentiles(values, percents=(50, 90, 99)):
+    """
+    Get the percentiles of the values using the nearest-rank method, i.e.
+    every percentile is one of the values.
+
+    :values: an iterable of numbers
+    :percents: an iterable of numbers between 0 and 100
+    :returns: a list of numbers (None for each percentile if there are no
+        values)
+    """
+    values = sorted(values)
+    if not values:
+        return [None for _ in percents]
+
+    percentiles = []
+    for percent in percents:
+        rank = int(math.ceil(percent / 100.0 * len(values)))
+        percentiles.append(values[min(max(rank, 1), len(values)) - 1])
+
+    return percentiles
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import sys
+import time
+
+from django.template import TemplateSyntaxError
+from django.utils.six.moves import reload_module
+
+from .compat import refresh_engine_libraries
+from .libraries import get_library_index
+from .logic import analyze_template, get_engine_templates, output_results
+from .utils import (get_app,
+                    get_djangotemplates_engines,
+                    get_modification_stamp,
+                    get_module_file,
+                    get_package_trie,
+                    output_message)
+
+# The number of seconds between two scans of the template directories
+WATCH_INTERVAL = 1.0
+
+
+class TemplateWatcher(object):
+    """
+    Re-analyzes the templates that changed since the previous poll.
+
+    The engines and the library index are created once and kept between the
+    polls. The template directories are polled for modification times; a
+    modified templatetags module is reloaded and the templates that load it
+    (or use tags/filters whose libraries are not loaded) are analyzed again.
+
+    Templates that cannot be analyzed (e.g. saved in the middle of an edit
+    with an invalid encoding) are reported and analyzed again on every poll
+    until they succeed.
+    """
+
+    def __init__(self, app=None, lex_only=False, filepaths=None,
+                 output=sys.stdout):
+        self.app = app
+        self.lex_only = lex_only
+        self.filepaths = filepaths
+        self.output = output
+        self.engines = get_djangotemplates_engines(output=output)
+        self.library_index = get_library_index()
+        self.pkg_locations = get_package_trie()
+        # {(engine index, path): TemplateResult}
+        self.results = {}
+        # {(engine index, path): the message of the analysis' error}
+        self.errors = {}
+        # {(engine index, path): modification stamp}
+        self._stamps = {}
+        # {library name: (path, modification stamp)}
+        self._library_stamps = {}
+
+    @property
+    def has_issues(self):
+        """
+        Do the current versions of the templates have issues (or cannot be
+        analyzed).
+        """
+        return bool(self.errors) or any(result.has_issues
+                                        for result in self.results.values())
+
+    def poll(self):
+        """
+        Analyze the new and modified templates (all templates on the first
+        poll).
+
+        :returns: a list of TemplateResult objects
+        """
+        dirty = self._poll_libraries()
+        stamps = {}
+        for engine_index, dt_engine in enumerate(self.engines):
+            templates = get_engine_templates(dt_engine, self.pkg_locations,
+                                             self.app,
+                                             filepaths=self.filepaths)
+            for filepath in templates:
+                key = (engine_index, filepath)
+                stamps[key] = get_modification_stamp(filepath)
+                if self._stamps.get(key) != stamps[key]:
+                    dirty.add(key)
+        self._stamps = stamps
+
+        # Forget the deleted templates
+        for key in set(self.results) - set(stamps):
+            del self.results[key]
+        for key in set(self.errors) - set(stamps):
+            del self.errors[key]
+
+        results = []
+        for key in sorted(dirty & set(stamps)):
+            result = self._analyze(key)
+            if result is None:
+                # Analyze the template again on the next poll
+                stamps[key] = None
+                continue
+            self.results[key] = result
+            results.append(result)
+        self._update_library_stamps()
+
+        return results
+
+    def _analyze(self, key):
+        """
+        Analyze the template; an error is written to the output (unless it
+        was already reported for the template).
+
+        :key: a tuple (engine index, path)
+        :returns: TemplateResult object or None (the analysis failed)
+        """
+        engine_index, filepath = key
+        try:
+            result = analyze_template(
+                filepath, self.engines[engine_index].engine,
+                lex_only=self.lex_only, library_index=self.library_index)
+        except (TemplateSyntaxError, UnicodeDecodeError, IOError,
+                OSError) as error:
+            message = 'Unable to analyze {}: {}\n'.format(filepath, error)
+            if self.errors.get(key) != message:
+                self.output.write(message)
+            self.errors[key] = message
+            self.results.pop(key, None)
+            return None
+
+        self.errors.pop(key, None)
+        return result
+
+    def _poll_libraries(self):
+        """
+        Reload the modified templatetags modules.
+
+        :returns: a set of (engine index, path) tuples of the templates that
+            depend on the modified libraries
+        """
+        dirty = set()
+        for module, (filepath, stamp) in sorted(self._library_stamps.items()):
+            if get_modification_stamp(filepath) == stamp:
+                continue
+            self._reload_library(module)
+            for key, result in self.results.items():
+                if module in result.loaded_modules or result.missing_loads:
+                    dirty.add(key)
+
+        return dirty
+
+    def _reload_library(self, module):
+        """
+        Reload the templatetags module and forget its members.
+
+        :module: String; the library's name (e.g. 'app_tags')
+        """
+        module_path = self.library_index.libraries.get(module)
+        try:
+            reload_module(sys.modules[module_path])
+            for dt_engine in self.engines:
+                refresh_engine_libraries(dt_engine.engine, module)
+        except Exception as error:
+            # The module is probably being edited; it is reloaded again when
+            # it is saved
+            self.output.write(
+                'Unable to reload {}: {}\n'.format(module_path, error))
+        self.library_index.invalidate(module)
+
+    def _update_library_stamps(self):
+        """
+        Store the modification stamps of the imported templatetags modules.
+        """
+        for module, module_path in self.library_index.libraries.items():
+            python_module = sys.modules.get(module_path)
+            filepath = get_module_file(python_module)
+            if filepath is not None:
+                self._library_stamps[module] = (
+                    filepath, get_modification_stamp(filepath))
+
+
+def watch_templates(app_label=None, lex_only=False, output_format='table',
+                    output=sys.stdout, filepaths=None, interval=WATCH_INTERVAL,
+                    polls=None):
+    """
+    Analyze the templates and keep re-analyzing the modified ones.
+
+    :app_label: String; app label supplied by the user
+    :lex_only: Boolean; skip the compilation of the templates' nodelists
+    :output_format: 'table' or 'jsonl'
+    :output: output destination (console=sys.stdout; testing=StringIO)
+    :filepaths: an iterable of file paths or None; only the templates from
+        the list are watched
+    :interval: Float; the number of seconds between two polls
+    :polls: Integer or None (runs until interrupted); the number of polls
+
+    :returns: Boolean (do the templates have issues or not)
+    """
+    app = get_app(app_label) if app_label else None
+    # Keep machine-readable output free of informational messages
+    messages = output if output_format == 'table' else sys.stderr
+    watcher = TemplateWatcher(app=app, lex_only=lex_only,
+                              filepaths=filepaths, output=messages)
+
+    count = 0
+    while polls is None or count < polls:
+        if count:
+            time.sleep(interval)
+        results = watcher.poll()
+        if not count and not results:
+            output_message(reason=1, output=messages)
+        elif results and not output_results(results, output=output,
+                                            output_format=output_format):
+            output_message(reason=3, output=messages)
+        count += 1
+
+    return watcher.has_issues